@@ -11,17 +11,23 @@ Feature flag ADVANCED_MODE:
 import streamlit as st
 import os
 import json
+import time
+import uuid
+from dataclasses import replace
 from datetime import datetime
 
 # ── Feature flag ──────────────────────────────────────
 ADVANCED_MODE = False   # Cambia a True per abilitare moduli avanzati
 # ──────────────────────────────────────────────────────
 
-from src.parser import parse_pdf as _parse_pdf
-from src.analyzer import analyze as _analyze
+from src.document_cache import get_default_document_cache
+from src.incremental import VersionDiff
+from src.jobs import CANCELLED, DONE, JobQueue, JobStore, analysis_runner, partial_card, progress_summary
+from src.llm_cache import cache_dir
 from src.requirements_engine import evaluate_all
 from src.bando_card import build_bando_card, BandoCard, ReqItem
 from src.profile_builder import build_from_form, build_from_json
+from src.tracing import traced
 
 st.set_page_config(
     page_title="BidPilot — BandoCard",
@@ -73,6 +79,7 @@ footer { display: none !important; }
 .card-block-icon { font-size: 1rem; }
 .card-block-title { font-size: 0.85rem; font-weight: 700; color: #0f172a; text-transform: uppercase; letter-spacing: 0.4px; }
 .card-block-body { padding: 1rem 1.2rem; }
+.card-block-pending { color: #94a3b8; font-style: italic; font-size: 0.8rem; }
 
 /* Identità gara */
 .gara-title { font-size: 1.1rem; font-weight: 600; color: #0f172a; line-height: 1.35; margin-bottom: 0.7rem; }
@@ -197,42 +204,61 @@ def render_req_item(item: ReqItem):
     """, unsafe_allow_html=True)
 
 
-def render_bando_card(card: BandoCard):
-    # ── BLOCCO 1 — IDENTITÀ GARA ──────────────────────
-    imp_str = f"€ {card.importo:,.0f}" if card.importo else "Importo da verificare"
-    cig_chip = f'<span class="chip blue">CIG {card.cig}</span>' if card.cig else '<span class="chip orange">CIG da verificare</span>'
-    lotti_chip = f'<span class="chip">🗂️ {card.lotti} lotto/i</span>' if card.lotti > 1 else ""
-    pnrr_chip = '<span class="chip orange">🔷 PNRR</span>' if card.is_pnrr else ""
-    imp_chip = f'<span class="chip blue">💶 {imp_str}</span>'
+def _render_pending_block(icon: str, title: str):
+    """Segnaposto di un blocco la cui categoria è ancora in estrazione (card parziale)."""
+    st.markdown(f"""
+    <div class="bando-card">
+      <div class="card-block-header">
+        <span class="card-block-icon">{icon}</span>
+        <span class="card-block-title">{title}</span>
+      </div>
+      <div class="card-block-body"><span class="card-block-pending">⏳ In estrazione…</span></div>
+    </div>
+    """, unsafe_allow_html=True)
 
-    ev_html = ""
-    if card.importo_evidence:
-        q = card.importo_evidence[:150]
-        ev_html = f'<div class="req-evidence" style="margin-top:0.6rem">📎 "{q}"</div>'
 
+def _render_na_block(icon: str, title: str):
+    """Blocco di categorie che il tipo di documento non usa (es. SOA in una richiesta di preventivo)."""
     st.markdown(f"""
     <div class="bando-card">
       <div class="card-block-header">
-        <span class="card-block-icon">🏛️</span>
-        <span class="card-block-title">Identità Gara</span>
-      </div>
-      <div class="card-block-body">
-        <div class="gara-title">{card.oggetto}</div>
-        <div class="gara-chips">
-          {imp_chip}
-          <span class="chip">🏛️ {card.ente[:60]}</span>
-          <span class="chip">📋 {card.tipo_procedura}</span>
-          {cig_chip}
-          {lotti_chip}
-          {pnrr_chip}
-        </div>
-        {ev_html}
+        <span class="card-block-icon">{icon}</span>
+        <span class="card-block-title">{title}</span>
       </div>
+      <div class="card-block-body"><span class="card-block-pending">➖ Non applicabile a questo tipo di documento</span></div>
     </div>
     """, unsafe_allow_html=True)
 
+
+def _changed_chip(card: BandoCard, block: str) -> str:
+    return '<span class="chip orange">🔄 Modificato</span>' if block in card.changed_blocks else ""
+
+
+def render_bando_card(card: BandoCard):
+    """
+    Disegna la card; con una card parziale i blocchi in card.pending_blocks
+    sono segnaposto, con una nuova versione i blocchi cambiati sono evidenziati.
+    """
+    pending = set(card.pending_blocks)
+
+    if card.changed_pages or card.changed_blocks:
+        pages = ", ".join(str(p) for p in card.changed_pages[:20]) or "nessuna"
+        blocks = len(card.changed_blocks)
+        st.info(
+            f"🔄 Nuova versione del bando — pagine modificate: {pages}. "
+            + (f"{blocks} blocchi aggiornati (🔄)." if blocks else "Nessun dato estratto è cambiato.")
+        )
+
+    # ── BLOCCO 1 — IDENTITÀ GARA ──────────────────────
+    if "identita" in pending:
+        _render_pending_block("🏛️", "Identità Gara")
+    else:
+        _render_identita(card)
+
     # ── BLOCCO 2 — SCADENZE ────────────────────────────
-    if card.scadenze:
+    if "scadenze" in pending:
+        _render_pending_block("📅", "Scadenze")
+    elif card.scadenze:
         rows_html = ""
         for sc in card.scadenze:
             if sc.data:
@@ -261,13 +287,18 @@ def render_bando_card(card: BandoCard):
           <div class="card-block-header">
             <span class="card-block-icon">📅</span>
             <span class="card-block-title">Scadenze</span>
+            {_changed_chip(card, "scadenze")}
           </div>
           <div class="card-block-body">{rows_html}</div>
         </div>
         """, unsafe_allow_html=True)
 
     # ── BLOCCO 3 — SOA RICHIESTE ──────────────────────
-    if card.soa_items:
+    if "soa" in pending:
+        _render_pending_block("🏗️", "SOA Richieste")
+    elif not card.is_applicable("soa"):
+        _render_na_block("🏗️", "SOA Richieste")
+    elif card.soa_items:
         soa_summary_ok = sum(1 for i in card.soa_items if i.stato == "ok")
         soa_summary_ko = sum(1 for i in card.soa_items if i.stato == "ko")
         soa_summary_unk = sum(1 for i in card.soa_items if i.stato == "unknown")
@@ -277,6 +308,7 @@ def render_bando_card(card: BandoCard):
           <div class="card-block-header">
             <span class="card-block-icon">🏗️</span>
             <span class="card-block-title">SOA Richieste</span>
+            {_changed_chip(card, "soa")}
             &nbsp;
             <span class="chip green">✅ {soa_summary_ok}</span>
             <span class="chip" style="background:#fff1f2;border-color:#fca5a5;color:#b91c1c">❌ {soa_summary_ko}</span>
@@ -298,7 +330,11 @@ def render_bando_card(card: BandoCard):
         st.markdown("</div></div>", unsafe_allow_html=True)
 
     # ── BLOCCO 4 — CERTIFICAZIONI ─────────────────────
-    if card.cert_items:
+    if "certificazioni" in pending:
+        _render_pending_block("🏆", "Certificazioni")
+    elif not card.is_applicable("certificazioni"):
+        _render_na_block("🏆", "Certificazioni")
+    elif card.cert_items:
         cert_ok = sum(1 for i in card.cert_items if i.stato == "ok")
         cert_ko = sum(1 for i in card.cert_items if i.stato == "ko")
         cert_unk = sum(1 for i in card.cert_items if i.stato == "unknown")
@@ -308,6 +344,7 @@ def render_bando_card(card: BandoCard):
           <div class="card-block-header">
             <span class="card-block-icon">🏆</span>
             <span class="card-block-title">Certificazioni</span>
+            {_changed_chip(card, "certificazioni")}
             &nbsp;
             <span class="chip green">✅ {cert_ok}</span>
             <span class="chip" style="background:#fff1f2;border-color:#fca5a5;color:#b91c1c">❌ {cert_ko}</span>
@@ -329,6 +366,74 @@ def render_bando_card(card: BandoCard):
         st.markdown("</div></div>", unsafe_allow_html=True)
 
     # ── BLOCCO 5 — INFO OPERATIVE ─────────────────────
+    if "info_operative" in pending:
+        _render_pending_block("⚙️", "Info Operative")
+    else:
+        _render_info_operative(card)
+
+    # ── BLOCCO 6 — DA VERIFICARE ──────────────────────
+    if "da_verificare" in pending:
+        _render_pending_block("❓", "Da Verificare")
+    elif card.da_verificare:
+        dv_html = "".join(
+            f'<div class="dv-item"><span>❓</span><span>{msg}</span></div>'
+            for msg in card.da_verificare
+        )
+        st.markdown(f"""
+        <div class="bando-card" style="border-color:#fde68a">
+          <div class="card-block-header" style="background:#fffbeb;border-color:#fde68a">
+            <span class="card-block-icon">❓</span>
+            <span class="card-block-title" style="color:#92400e">Da Verificare ({len(card.da_verificare)})</span>
+          </div>
+          <div class="card-block-body" style="background:#fffbeb">{dv_html}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+    # ── ADVANCED MODE (disabilitato nel MVP) ──────────
+    if ADVANCED_MODE and not card.is_partial and hasattr(st.session_state, "full_result"):
+        _render_advanced(st.session_state.full_result)
+
+
+def _render_identita(card: BandoCard):
+    imp_str = f"€ {card.importo:,.0f}" if card.importo else "Importo da verificare"
+    cig_chip = f'<span class="chip blue">CIG {card.cig}</span>' if card.cig else '<span class="chip orange">CIG da verificare</span>'
+    if not card.importo and not card.is_applicable("importo"):
+        imp_str = "Importo non applicabile"
+    if not card.cig and not card.is_applicable("anac_cig"):
+        cig_chip = '<span class="chip">CIG non applicabile</span>'
+    lotti_chip = f'<span class="chip">🗂️ {card.lotti} lotto/i</span>' if card.lotti > 1 else ""
+    pnrr_chip = '<span class="chip orange">🔷 PNRR</span>' if card.is_pnrr else ""
+    imp_chip = f'<span class="chip blue">💶 {imp_str}</span>'
+
+    ev_html = ""
+    if card.importo_evidence:
+        q = card.importo_evidence[:150]
+        ev_html = f'<div class="req-evidence" style="margin-top:0.6rem">📎 "{q}"</div>'
+
+    st.markdown(f"""
+    <div class="bando-card">
+      <div class="card-block-header">
+        <span class="card-block-icon">🏛️</span>
+        <span class="card-block-title">Identità Gara</span>
+        {_changed_chip(card, "identita")}
+      </div>
+      <div class="card-block-body">
+        <div class="gara-title">{card.oggetto}</div>
+        <div class="gara-chips">
+          {imp_chip}
+          <span class="chip">🏛️ {card.ente[:60]}</span>
+          <span class="chip">📋 {card.tipo_procedura}</span>
+          {cig_chip}
+          {lotti_chip}
+          {pnrr_chip}
+        </div>
+        {ev_html}
+      </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+
+def _render_info_operative(card: BandoCard):
     info = card.info_op
 
     def yn(val: bool, si_label="SÌ", no_label="NO"):
@@ -341,6 +446,8 @@ def render_bando_card(card: BandoCard):
             return '<span class="info-si">⚠️ SÌ</span>'
         if val == "no":
             return '<span class="info-no">✅ NO</span>'
+        if val == "non_applicabile":
+            return '<span class="info-no">➖ Non applicabile</span>'
         return '<span class="info-unknown">❓ Da verificare</span>'
 
     piatt_str = info.piattaforma or "Non identificata"
@@ -352,6 +459,7 @@ def render_bando_card(card: BandoCard):
       <div class="card-block-header">
         <span class="card-block-icon">⚙️</span>
         <span class="card-block-title">Info Operative</span>
+        {_changed_chip(card, "info_operative")}
       </div>
       <div class="card-block-body">
         <div class="info-grid">
@@ -384,26 +492,6 @@ def render_bando_card(card: BandoCard):
     </div>
     """, unsafe_allow_html=True)
 
-    # ── BLOCCO 6 — DA VERIFICARE ──────────────────────
-    if card.da_verificare:
-        dv_html = "".join(
-            f'<div class="dv-item"><span>❓</span><span>{msg}</span></div>'
-            for msg in card.da_verificare
-        )
-        st.markdown(f"""
-        <div class="bando-card" style="border-color:#fde68a">
-          <div class="card-block-header" style="background:#fffbeb;border-color:#fde68a">
-            <span class="card-block-icon">❓</span>
-            <span class="card-block-title" style="color:#92400e">Da Verificare ({len(card.da_verificare)})</span>
-          </div>
-          <div class="card-block-body" style="background:#fffbeb">{dv_html}</div>
-        </div>
-        """, unsafe_allow_html=True)
-
-    # ── ADVANCED MODE (disabilitato nel MVP) ──────────
-    if ADVANCED_MODE and hasattr(st.session_state, "full_result"):
-        _render_advanced(st.session_state.full_result)
-
 
 def _render_advanced(result: dict):
     """Moduli avanzati — attivi solo con ADVANCED_MODE=True."""
@@ -546,6 +634,7 @@ def sidebar_profile():
         if st.session_state.get("card_result"):
             if st.button("🗑️ Nuova analisi", use_container_width=True, type="secondary"):
                 st.session_state.card_result = None
+                st.session_state.analysis_result = None
                 st.session_state.analyzed_file = None
                 st.rerun()
 
@@ -566,11 +655,12 @@ def sidebar_profile():
 # PIPELINE ANALISI
 # ══════════════════════════════════════════════════════
 
-def run_analysis(pdf_path: str, api_key: str, minimal_profile) -> BandoCard:
-    """Pipeline completa: PDF → BandoCard."""
-    # 1. Parsing (extraction + guardrail)
-    parsed = _parse_pdf(pdf_path, api_key=api_key)
-    analysis = _analyze(parsed)
+@traced("app.build_card")
+def build_card(analysis, minimal_profile) -> BandoCard:
+    """
+    Matching requisiti + BandoCard da un'analisi già disponibile.
+    Non chiama l'LLM: viene rieseguito a ogni modifica del profilo in sidebar.
+    """
     bando = analysis.bando
 
     # 2. Matching requisiti
@@ -584,17 +674,146 @@ def run_analysis(pdf_path: str, api_key: str, minimal_profile) -> BandoCard:
             "results": results,
         }
 
-    # 4. Costruisci BandoCard
+    # 4. Costruisci BandoCard (nuova versione: blocchi cambiati evidenziati)
+    diff = analysis.diff
     card = build_bando_card(
         bando=bando,
         results=results,
         soa_profile_empty=not minimal_profile.has_soa_data,
         cert_profile_empty=not minimal_profile.has_cert_data,
+        changed_categories=diff.changed_categories if diff else None,
+        changed_pages=diff.changed_pages if diff else None,
+        skipped_categories=analysis.skipped_categories,
     )
 
     return card
 
 
+# ══════════════════════════════════════════════════════
+# ANALISI IN BACKGROUND
+# ══════════════════════════════════════════════════════
+
+_POLL_SECONDS = 1.0
+
+
+@st.cache_resource
+def _job_queue() -> JobQueue:
+    """
+    Coda del processo, condivisa dalle sessioni: l'analisi gira nei worker, la UI legge gli eventi.
+    Store separato da quello del servizio HTTP: chiave API, profilo e snapshot
+    precedente vivono solo nel context di questo processo.
+    """
+    store = JobStore(os.path.join(cache_dir(), "app_jobs.sqlite"))
+    return JobQueue(store, analysis_runner({}, require_context=True), workers=2).start()
+
+
+def start_analysis(uploaded, api_key: str, minimal_profile) -> None:
+    """
+    Salva il PDF e accoda il job; chiave API e profilo restano in memoria (context).
+    Con un'analisi già in sessione il suo snapshot permette di ri-analizzare
+    una rettifica estraendo solo le categorie toccate (incremental.py).
+    """
+    previous = st.session_state.get("analysis_result")
+    os.makedirs("data", exist_ok=True)
+    job_id = uuid.uuid4().hex
+    temp_path = os.path.abspath(f"data/temp_{job_id}.pdf")
+    with open(temp_path, "wb") as f:
+        f.write(uploaded.getbuffer())
+    _job_queue().submit(
+        temp_path, {"decision_report": False, "filename": uploaded.name}, job_id=job_id,
+        context={"api_key": api_key, "profile": minimal_profile,
+                 "previous": previous.snapshot if previous is not None else None},
+    )
+    st.session_state.active_job = job_id
+    st.session_state.active_job_file = uploaded.name
+
+
+def render_job_progress(minimal_profile) -> bool:
+    """
+    Avanzamento del job della sessione + anteprima della card, ridisegnata a
+    ogni polling man mano che le categorie sono estratte; la card precedente
+    resta in un tab a parte. True finché il job è in corso.
+    """
+    job_id = st.session_state.get("active_job")
+    if not job_id:
+        return False
+    queue = _job_queue()
+    job = queue.store.get(job_id)
+    if job is None:
+        st.session_state.active_job = None
+        return False
+
+    if not job.finished:
+        progress = progress_summary(job.events)
+        st.markdown(f"#### ⏳ Analisi di **{st.session_state.active_job_file}** in corso")
+        st.progress(progress["fraction"], text=f"Fase: {progress['stage']}")
+        details = []
+        if progress["pages"] is not None:
+            details.append(f"📄 {progress['pages']} pagine estratte")
+        if progress["total"]:
+            details.append(
+                f"🧩 {len(progress['categories'])}/{progress['total']} categorie: "
+                + ", ".join(progress["categories"])
+            )
+        if details:
+            st.caption(" · ".join(details))
+        if job.cancel_requested:
+            st.caption("Annullamento richiesto: si ferma alla prossima fase.")
+        elif st.button("⏹ Annulla analisi", type="secondary"):
+            queue.cancel(job_id)
+            st.rerun()
+        _render_preview(partial_card(job.events, minimal_profile))
+        return True
+
+    _finish_job(job, minimal_profile)
+    return False
+
+
+def _render_preview(preview) -> None:
+    previous = st.session_state.get("card_result")
+    if previous is None:
+        if preview is not None:
+            render_bando_card(preview)
+        return
+    tab_preview, tab_previous = st.tabs(["⏳ Anteprima analisi in corso", "📄 Bando precedente"])
+    with tab_preview:
+        if preview is not None:
+            render_bando_card(preview)
+        else:
+            st.caption("I blocchi compaiono appena le prime categorie sono estratte.")
+    with tab_previous:
+        st.caption(f"📄 Bando analizzato: **{st.session_state.analyzed_file}**")
+        render_bando_card(previous)
+
+
+def _finish_job(job, minimal_profile) -> None:
+    """Job concluso: AnalysisResult dalla cache documenti → BandoCard della sessione."""
+    st.session_state.active_job = None
+    try:
+        os.remove(job.input_path)
+    except Exception:
+        pass
+
+    if job.status == CANCELLED:
+        st.info("Analisi annullata.")
+        return
+    analysis = get_default_document_cache().get(job.result["document_key"]) if job.status == DONE else None
+    if analysis is None:
+        st.error(f"❌ Errore: {job.error}" if job.error else "❌ Risultato non disponibile: ripeti l'analisi.")
+        if job.error and ("modulo 'anthropic'" in job.error or "modulo 'openai'" in job.error):
+            st.info("Suggerimento: attiva il venv corretto e installa le dipendenze con `pip install -r requirements.txt`.")
+        return
+
+    changes = job.result.get("changes")
+    if changes:
+        # la cache documenti conserva l'analisi senza diff: vale solo rispetto alla versione precedente
+        analysis = replace(analysis, diff=VersionDiff(**changes))
+    st.session_state.analysis_result = analysis
+    st.session_state.analyzed_file = st.session_state.active_job_file
+    st.session_state.card_result = build_card(analysis, minimal_profile)
+    st.success("✅ Analisi completata!")
+
+
 # ══════════════════════════════════════════════════════
 # TAB ANALISI
 # ══════════════════════════════════════════════════════
@@ -610,6 +829,10 @@ def tab_analisi(minimal_profile):
         """, unsafe_allow_html=True)
         return
 
+    if st.session_state.get("active_job"):
+        st.info("Analisi in corso: puoi annullarla o attendere che finisca per caricarne un'altra.")
+        return
+
     st.markdown("#### 📄 Carica il PDF del bando")
 
     uploaded = st.file_uploader(
@@ -638,36 +861,12 @@ def tab_analisi(minimal_profile):
     if not start:
         return
 
-    error = False
-    with st.spinner("🤖 Estrazione in corso… (30–90 secondi)"):
-        os.makedirs("data", exist_ok=True)
-        temp_path = f"data/temp_{uploaded.name}"
-        try:
-            with open(temp_path, "wb") as f:
-                f.write(uploaded.getbuffer())
-
-            card = run_analysis(temp_path, st.session_state.api_key, minimal_profile)
-            st.session_state.card_result = card
-            st.session_state.analyzed_file = uploaded.name
-
-        except Exception as e:
-            st.error(f"❌ Errore: {e}")
-            if isinstance(e, RuntimeError) and (
-                "modulo 'anthropic'" in str(e) or "modulo 'openai'" in str(e)
-            ):
-                st.info("Suggerimento: attiva il venv corretto e installa le dipendenze con `pip install -r requirements.txt`.")
-            else:
-                st.exception(e)
-            error = True
-        finally:
-            try:
-                os.remove(temp_path)
-            except Exception:
-                pass
-
-    if not error and st.session_state.get("card_result"):
-        st.success("✅ Analisi completata!")
-        st.rerun()
+    try:
+        start_analysis(uploaded, st.session_state.api_key, minimal_profile)
+    except OSError as e:
+        st.error(f"❌ Errore: {e}")
+        return
+    st.rerun()
 
 
 # ══════════════════════════════════════════════════════
@@ -675,7 +874,8 @@ def tab_analisi(minimal_profile):
 # ══════════════════════════════════════════════════════
 
 def main():
-    for key in ("api_key", "card_result", "analyzed_file", "soa_entries", "cert_entries", "regioni"):
+    for key in ("api_key", "card_result", "analysis_result", "analyzed_file",
+                "active_job", "active_job_file", "soa_entries", "cert_entries", "regioni"):
         if key not in st.session_state:
             if key == "soa_entries":
                 st.session_state[key] = [{"categoria": "", "classifica": "I", "scadenza": ""}]
@@ -689,6 +889,15 @@ def main():
     render_header()
     minimal_profile = sidebar_profile()
 
+    # Profilo modificato dopo l'analisi: ricalcola solo matching + card
+    if st.session_state.analysis_result is not None and minimal_profile is not None:
+        st.session_state.card_result = build_card(st.session_state.analysis_result, minimal_profile)
+
+    # Analisi in background: avanzamento + anteprima, la card precedente resta consultabile
+    if render_job_progress(minimal_profile):
+        time.sleep(_POLL_SECONDS)
+        st.rerun()
+
     if st.session_state.card_result:
         st.caption(f"📄 Bando analizzato: **{st.session_state.analyzed_file}**")
         render_bando_card(st.session_state.card_result)
@@ -0,0 +1 @@
+"""BidPilot — benchmark e generatori di dati sintetici (non usati in produzione)."""
@@ -0,0 +1,252 @@
+"""
+BidPilot — Benchmark end-to-end
+================================
+Throughput della pipeline completa su disciplinari sintetici
+(benchmarks/synthetic.py), senza rete:
+
+  parse_text → analyze → evaluate_all → build_bando_card
+
+L'LLM è lo stand-in "local" di llm_client con un responder deterministico:
+per ogni categoria risponde con i valori attesi del disciplinare, e con la
+relativa evidence, solo se la frase chiave è arrivata nel prompt (come un
+modello che legge il contesto). La latenza per chiamata è configurabile.
+
+Per ogni dimensione riporta:
+  - tempo per fase (span di tracing.py, in memoria) e tempo totale
+  - picco di memoria (tracemalloc, in un'esecuzione separata)
+  - chiamate LLM, token di input/output (stima dello stand-in), token di contesto
+
+Baseline in benchmarks/baselines/pipeline.json: --save-baseline la scrive,
+--check confronta e termina con codice 1 se un tempo, la memoria o i token
+peggiorano oltre la tolleranza. I token sono deterministici: qualsiasi
+aumento oltre la tolleranza è una regressione reale. Una BandoCard
+incompleta (card_ok false) fa sempre fallire --check e non viene mai salvata
+come baseline: non è un risultato atteso ma un errore di retrieval.
+
+Esegui con: python -m benchmarks.bench_pipeline [--pages 10 100 1000] [--latency 0.05]
+                                                [--check | --save-baseline]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic import SyntheticTender, generate_tender
+from src.analyzer import analyze
+from src.bando_card import build_bando_card
+from src.llm_client import LocalBackend, register_backend, reset_backends
+from src.parser import _CATEGORY_SCHEMA, _META_SCHEMA, parse_text
+from src.requirements_engine import evaluate_all
+from src.schemas import CompanyProfile
+from src.tracing import configure_tracing
+
+_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "pipeline.json")
+_STAGES = [
+    "parse_text", "chunk_full_text", "Retriever.index", "_run_extraction", "pre_extract_fields",
+    "Retriever.retrieve", "pack_context", "_call_llm", "analyze", "evaluate_all", "build_bando_card",
+]
+# metriche confrontate con la baseline (più alto = peggio)
+_CHECKED = ["total_ms", "peak_kib", "input_tokens", "context_tokens"]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# LLM FINTO
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _answers(tender: SyntheticTender) -> Dict[str, Callable[[str], dict]]:
+    """Categoria → risposta in funzione dell'evidence effettivamente presente nel prompt."""
+    t = tender.truth
+    needle = {cat: lines[0] for cat, lines in tender.needles.items()}
+    soa_lines = [line for line in tender.text.splitlines() if line.startswith("Categoria ")]
+    day = t["scadenza_offerta"]
+
+    return {
+        "meta": lambda p: {
+            "oggetto_appalto": "Lavori di riqualificazione energetica del polo scolastico comunale",
+            "oggetto_evidence": needle["meta"], "stazione_appaltante": "Comune di Valdora",
+            "stazione_evidence": "Stazione Appaltante: Comune di Valdora.",
+            "tipo_procedura": "aperta", "lotti": 1,
+        },
+        "anac_cig": lambda p: {
+            "codice_cig": t["codice_cig"], "cig_evidence": needle["anac_cig"],
+            "anac_contributo_richiesto": "yes", "fvoe_required": True,
+        },
+        "importo": lambda p: {
+            "importo_base_gara": t["importo_base_gara"], "oneri_sicurezza": t["oneri_sicurezza"],
+            "importo_lavori": t["importo_base_gara"], "importo_evidence": needle["importo"],
+        },
+        "soa": lambda p: {"soa_richieste": [
+            {"categoria": cat, "classifica": cls, "prevalente": i == 0, "is_scorporabile": i > 0,
+             "qualificazione_obbligatoria": True, "evidence": line}
+            for i, ((cat, cls), line) in enumerate(zip(t["soa"], soa_lines)) if line in p
+        ]},
+        "piattaforma": lambda p: {
+            "canale_invio": "piattaforma", "piattaforma_gara": t["piattaforma_gara"],
+            "piattaforma_spid_required": False, "piattaforma_evidence": needle["piattaforma"],
+        },
+        "scadenze": lambda p: {"scadenze": [{
+            "tipo": "presentazione_offerta", "data": day, "ora": t["ora_offerta"],
+            "obbligatorio": True, "evidence": needle["scadenze"], "esclusione_se_mancante": True,
+        }]},
+        "certificazioni": lambda p: {"certificazioni_richieste": ["ISO 9001", "ISO 14001"]},
+        "dgue": lambda p: {"dgue_required": True, "dgue_format": "elettronico"},
+        "forme_partecipazione": lambda p: {
+            "rti_ammesso": "yes", "avvalimento_ammesso": "yes", "allowed_forms": ["RTI", "consorzio"],
+        },
+    }
+
+
+def fake_responder(tender: SyntheticTender) -> Callable[[str, str], str]:
+    """responder(prompt, model) per LocalBackend: JSON deterministico, {} senza evidence."""
+    answers = _answers(tender)
+    descriptions = [(cat, s["description"]) for cat, s in _CATEGORY_SCHEMA.items()]
+
+    def responder(prompt: str, model: str) -> str:
+        if _META_SCHEMA["description"] in prompt:
+            cat = "meta"
+        else:
+            cat = next((c for c, d in descriptions if d in prompt), None)
+        if cat is None or tender.needles[cat][0] not in prompt:
+            return "{}"
+        return json.dumps(answers[cat](prompt), ensure_ascii=False)
+
+    return responder
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ESECUZIONE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _pipeline(tender: SyntheticTender, company: CompanyProfile, max_workers: int):
+    doc = parse_text(tender.text, model="local", use_cache=False, max_workers=max_workers)
+    analysis = analyze(doc)
+    results = evaluate_all(analysis.bando, company)
+    card = build_bando_card(analysis.bando, results, soa_profile_empty=True, cert_profile_empty=True)
+    return doc, card
+
+
+def run_benchmark(pages: int, latency: float = 0.0, max_workers: int = 4, repeat: int = 1, seed: int = 0) -> dict:
+    """Metriche di una dimensione: migliore di `repeat` esecuzioni + un passaggio per la memoria."""
+    tender = generate_tender(pages=pages, seed=seed)
+    company = CompanyProfile()
+    register_backend("local", lambda api_key: LocalBackend(responder=fake_responder(tender), latency=latency))
+    try:
+        best: Optional[dict] = None
+        for _ in range(repeat):
+            tracer = configure_tracing()
+            t0 = time.perf_counter()
+            doc, card = _pipeline(tender, company, max_workers)
+            total_ms = (time.perf_counter() - t0) * 1000
+            configure_tracing(enabled=False)
+            if best is None or total_ms < best["total_ms"]:
+                stages: Dict[str, float] = defaultdict(float)
+                for span in tracer.spans:
+                    stages[span.name] += span.duration_us / 1000
+                best = {"total_ms": round(total_ms, 1),
+                        "stages_ms": {s: round(stages.get(s, 0.0), 1) for s in _STAGES}}
+
+        tracemalloc.start()
+        _pipeline(tender, company, max_workers)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        configure_tracing(enabled=False)
+        reset_backends()
+        register_backend("local", LocalBackend)
+
+    usage = doc.usage_summary()
+    best.update({
+        "pages": pages,
+        "chunks": len(doc.chunks),
+        "peak_kib": round(peak / 1024),
+        "llm_calls": usage["llm_calls"],
+        "input_tokens": usage["input_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "context_tokens": doc.tokens_sent,
+        "card_ok": card.cig == tender.truth["codice_cig"] and bool(card.scadenze) and bool(card.soa_items),
+    })
+    return best
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# BASELINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _baseline_key(pages: int, latency: float, max_workers: int) -> str:
+    return f"pages={pages},latency={latency},workers={max_workers}"
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Regressioni oltre la tolleranza relativa (metriche _CHECKED) e BandoCard incomplete."""
+    regressions: List[str] = []
+    for key, current in results.items():
+        if not current.get("card_ok"):
+            regressions.append(f"{key} card_ok: la BandoCard non contiene CIG, scadenze e SOA")
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in _CHECKED:
+            old, new = base.get(metric), current.get(metric)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append(f"{key} {metric}: {old} → {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--latency", type=float, default=0.0, help="secondi simulati per chiamata LLM")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--tolerance", type=float, default=0.5, help="peggioramento relativo ammesso")
+    ap.add_argument("--baseline", default=_BASELINE_PATH)
+    group = ap.add_mutually_exclusive_group()
+    group.add_argument("--check", action="store_true", help="confronta con la baseline")
+    group.add_argument("--save-baseline", action="store_true", help="aggiorna la baseline")
+    args = ap.parse_args()
+
+    results: Dict[str, dict] = {}
+    for pages in args.pages:
+        r = run_benchmark(pages, latency=args.latency, max_workers=args.workers, repeat=args.repeat)
+        results[_baseline_key(pages, args.latency, args.workers)] = r
+        stages = "  ".join(f"{name}={ms:.0f}" for name, ms in r["stages_ms"].items())
+        print(f"{pages:5d} pagine, {r['chunks']:5d} chunk: {r['total_ms']:8.1f} ms totali, "
+              f"picco {r['peak_kib'] / 1024:6.1f} MiB, {r['llm_calls']} chiamate LLM, "
+              f"{r['input_tokens']} token input / {r['output_tokens']} output "
+              f"(contesto {r['context_tokens']}){'' if r['card_ok'] else '  ⚠ BandoCard incompleta'}")
+        print(f"      fasi (ms): {stages}")
+
+    if args.save_baseline:
+        incomplete = [key for key, r in results.items() if not r["card_ok"]]
+        if incomplete:
+            print(f"✗ baseline non salvata: BandoCard incompleta per {', '.join(incomplete)}")
+            sys.exit(1)
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline aggiornata: {args.baseline}")
+    elif args.check:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"✗ regressione: {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"✓ nessuna regressione oltre il {args.tolerance * 100:.0f}% rispetto alla baseline")
+
+
+if __name__ == "__main__":
+    main()
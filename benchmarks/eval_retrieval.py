@@ -0,0 +1,74 @@
+"""
+BidPilot — Evaluation retrieval: token inviati vs. recall
+==========================================================
+Per ogni scorer del Retriever misura, su disciplinari sintetici con verità
+di riferimento (benchmarks/synthetic.py):
+
+  - token inviati: token del contesto di ogni categoria, sommati su tutte
+  - recall:        frazione delle frasi chiave ("needle") di ogni categoria
+                   presenti nel contesto inviato per quella categoria
+
+Ogni scorer è valutato con i chunk interi e con il context packer a uno o più
+budget di token per categoria (--budget).
+
+La categoria "meta" non passa dal retrieval (usa le prime pagine) ed è esclusa.
+
+Esegui con: python -m benchmarks.eval_retrieval [--docs 5] [--pages 40 120 300] [--budget 1500 2500]
+"""
+from __future__ import annotations
+
+import argparse
+from typing import Dict, List, Optional
+
+from benchmarks.synthetic import SyntheticTender, generate_tender
+from src.context_packer import pack_context
+from src.retrieval import CATEGORY_KEYWORDS, SCORERS, Retriever, chunk_by_page
+
+
+def evaluate(
+    tenders: List[SyntheticTender],
+    scorer: str,
+    budget: Optional[int] = None,
+    top_n: int = 6,
+    min_score: float = 0.1,
+) -> Dict[str, float]:
+    tokens = 0
+    found = 0
+    total = 0
+    for tender in tenders:
+        retriever = Retriever(chunk_by_page(tender.pages), scorer=scorer)
+        for cat in CATEGORY_KEYWORDS:
+            result = retriever.retrieve(cat, top_n=top_n, min_score=min_score)
+            packed = pack_context(result, budget)
+            tokens += packed.tokens_sent
+            for needle in tender.needles.get(cat, []):
+                total += 1
+                found += needle in packed.text
+    return {"tokens": tokens, "recall": found / total if total else 1.0}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", type=int, default=5, help="documenti sintetici per dimensione")
+    ap.add_argument("--pages", type=int, nargs="+", default=[40, 120, 300])
+    ap.add_argument("--top-n", type=int, default=6)
+    ap.add_argument("--min-score", type=float, default=0.1)
+    ap.add_argument("--budget", type=int, nargs="*", default=[1500, 2500],
+                    help="budget di token per categoria del context packer")
+    args = ap.parse_args()
+
+    tenders = [generate_tender(pages=p, seed=s) for p in args.pages for s in range(args.docs)]
+    print(f"{len(tenders)} disciplinari sintetici ({', '.join(map(str, args.pages))} pagine), "
+          f"top_n={args.top_n}, min_score={args.min_score}")
+    print(f"{'scorer':<8} {'budget':>7} {'token inviati':>14} {'recall':>8}")
+    baseline = None
+    for scorer in SCORERS:
+        for budget in [None] + args.budget:
+            r = evaluate(tenders, scorer, budget=budget, top_n=args.top_n, min_score=args.min_score)
+            baseline = baseline or r["tokens"]
+            print(f"{scorer:<8} {budget or '-':>7} {r['tokens']:>14,} {r['recall']:>8.1%}   "
+                  f"({r['tokens'] / baseline:.0%} di {SCORERS[0]} a chunk interi)")
+
+
+if __name__ == "__main__":
+    main()
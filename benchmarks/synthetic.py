@@ -0,0 +1,146 @@
+"""
+BidPilot — Disciplinari sintetici
+==================================
+Genera disciplinari di gara realistici di lunghezza configurabile, con verità
+di riferimento (CIG, importi, SOA, scadenze, piattaforma) per benchmark ed
+evaluation senza PDF reali.
+
+Il testo di riempimento usa volutamente i termini "rumorosi" dei disciplinari
+veri (ore, data, euro, offerta, termine...) per non rendere il retrieval banale.
+"""
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+_FILLER = [
+    "L'operatore economico è tenuto a prendere visione della documentazione di gara entro la data indicata.",
+    "Le comunicazioni tra stazione appaltante e operatori economici avvengono in lingua italiana.",
+    "Il presente disciplinare contiene le norme integrative al bando relative alle modalità di partecipazione.",
+    "Ai sensi del codice dei contratti pubblici, la stazione appaltante si riserva di non procedere all'aggiudicazione.",
+    "Le offerte tardive, condizionate o espresse in modo indeterminato non saranno prese in considerazione.",
+    "Il concorrente indica nell'offerta i propri costi della manodopera e gli oneri aziendali.",
+    "La documentazione amministrativa deve essere sottoscritta dal legale rappresentante del concorrente.",
+    "Il responsabile unico del progetto è reperibile dal lunedì al venerdì dalle ore 9:00 alle ore 13:00.",
+    "Il corrispettivo sarà liquidato in euro secondo gli stati di avanzamento dei lavori.",
+    "Le sedute pubbliche si svolgono in modalità telematica e ne viene data comunicazione agli operatori.",
+    "Il contratto è stipulato in modalità elettronica mediante scrittura privata.",
+    "La verifica dei requisiti avviene attraverso la banca dati nazionale dei contratti pubblici.",
+    "Gli atti di gara sono pubblicati sul profilo del committente e sull'albo pretorio online.",
+    "Eventuali rettifiche al presente documento saranno pubblicate con le stesse modalità.",
+    "Il termine di validità dell'offerta è di 180 giorni dalla data di scadenza della presentazione.",
+    "Le spese di pubblicazione sono rimborsate dall'aggiudicatario entro sessanta giorni.",
+    "La stazione appaltante procede alla verifica della congruità delle offerte anormalmente basse.",
+    "L'esecuzione del contratto è soggetta agli obblighi in tema di tracciabilità dei flussi finanziari.",
+    "Il cronoprogramma dei lavori prevede una durata complessiva di 365 giorni naturali e consecutivi.",
+    "In caso di discordanza tra il bando e il presente disciplinare prevale quest'ultimo.",
+]
+
+_CIG_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ0123456789"
+_SOA_CATEGORIES = ["OG1", "OG2", "OG3", "OG11", "OS3", "OS6", "OS18", "OS28", "OS30"]
+_CLASSIFICHE = ["I", "II", "III", "IV", "V"]
+
+
+@dataclass
+class SyntheticTender:
+    """Disciplinare sintetico: testo per pagina + valori attesi."""
+    pages: List[str]
+    truth: Dict[str, object] = field(default_factory=dict)
+    needles: Dict[str, List[str]] = field(default_factory=dict)   # categoria → frasi che DEVONO arrivare all'LLM
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.pages)
+
+
+def _euro(amount: float) -> str:
+    """Formato italiano: € 1.234.567,89"""
+    s = f"{amount:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"€ {s}"
+
+
+def _filler(rng: random.Random, chars: int) -> str:
+    out: List[str] = []
+    size = 0
+    while size < chars:
+        paragraph = " ".join(rng.choice(_FILLER) for _ in range(rng.randint(3, 6)))
+        out.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(out)
+
+
+def generate_tender(pages: int = 100, seed: int = 0, page_chars: int = 2800) -> SyntheticTender:
+    """
+    Genera un disciplinare di `pages` pagine (minimo 10) con le sezioni chiave
+    distribuite nel documento come nei disciplinari reali.
+    """
+    pages = max(10, pages)
+    rng = random.Random(seed)
+
+    cig = "".join(rng.choice(_CIG_ALPHABET) for _ in range(10))
+    importo = round(rng.uniform(300_000, 9_000_000), 2)
+    oneri = round(importo * rng.uniform(0.02, 0.05), 2)
+    cats = rng.sample(_SOA_CATEGORIES, 3)
+    classifiche = [rng.choice(_CLASSIFICHE) for _ in cats]
+    day, month, year = rng.randint(1, 28), rng.randint(1, 12), 2030
+    deadline = f"{year}-{month:02d}-{day:02d}"
+    ora = rng.choice(["12:00", "13:00", "18:00"])
+
+    sections: Dict[int, List[str]] = {}
+
+    def put(page: int, category: str, text: str) -> None:
+        sections.setdefault(page, []).append(text)
+        needles.setdefault(category, []).append(text.splitlines()[0])
+
+    needles: Dict[str, List[str]] = {}
+    put(0, "meta",
+        "DISCIPLINARE DI GARA\nProcedura aperta per l'affidamento dei lavori di riqualificazione "
+        f"energetica del polo scolastico comunale.\nStazione Appaltante: Comune di Valdora.\n"
+        f"CUP: B{rng.randint(10, 99)}C{rng.randint(10_000_000, 99_999_999)}001")
+    put(1, "anac_cig",
+        f"Il Codice Identificativo Gara (CIG) assegnato dall'ANAC è: {cig}\n"
+        "Il concorrente effettua il pagamento del contributo ANAC tramite pagoPA e verifica "
+        "la propria posizione nel FVOE.")
+    put(2, "importo",
+        f"Importo a base di gara: {_euro(importo)} di cui oneri sicurezza non soggetti a ribasso "
+        f"pari a {_euro(oneri)}.\nL'importo complessivo dell'appalto è al netto di IVA.")
+    soa_lines = [
+        f"Categoria prevalente {cats[0]} classifica {classifiche[0]} — qualificazione obbligatoria."
+    ] + [
+        f"Categoria scorporabile {c} classifica {k} — subappaltabile."
+        for c, k in zip(cats[1:], classifiche[1:])
+    ]
+    put(3, "soa", "Requisiti di qualificazione: attestazione SOA.\n" + "\n".join(soa_lines))
+    put(max(4, pages * 3 // 10), "piattaforma",
+        "Le offerte devono essere presentate esclusivamente tramite la piattaforma telematica "
+        "Sintel, previa registrazione al portale e con firma digitale.")
+    put(max(5, pages * 4 // 10), "scadenze",
+        f"Il termine di presentazione delle offerte è fissato alle ore {ora} del giorno "
+        f"{day:02d}/{month:02d}/{year}, termine perentorio.\n"
+        "I quesiti e le richieste di chiarimenti possono essere inviati entro dieci giorni prima.")
+    put(max(6, pages * 5 // 10), "certificazioni",
+        "È richiesto il possesso della certificazione del sistema di gestione per la qualità "
+        "UNI EN ISO 9001 e della certificazione ambientale UNI EN ISO 14001.")
+    put(max(7, pages * 6 // 10), "dgue",
+        "Il concorrente compila il DGUE (documento di gara unico europeo) dichiarando l'assenza "
+        "delle cause di esclusione di cui all'art. 94 e all'art. 95 del codice.")
+    put(max(8, pages * 7 // 10), "forme_partecipazione",
+        "Sono ammessi a partecipare i raggruppamenti temporanei (RTI), i consorzi e le reti d'impresa. "
+        "È ammesso l'avvalimento; il subappalto è ammesso nei limiti di legge.")
+
+    out: List[str] = []
+    for p in range(pages):
+        body = "\n\n".join(sections.get(p, []))
+        out.append((body + "\n\n" if body else "") + _filler(rng, page_chars - len(body)))
+
+    truth = {
+        "codice_cig": cig,
+        "importo_base_gara": importo,
+        "oneri_sicurezza": oneri,
+        "soa": list(zip(cats, classifiche)),
+        "scadenza_offerta": deadline,
+        "ora_offerta": ora,
+        "piattaforma_gara": "Sintel",
+    }
+    return SyntheticTender(pages=out, truth=truth, needles=needles)
@@ -23,6 +23,8 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
+from src.tracing import traced
+
 try:
     from src.schemas import BandoRequisiti, Scadenza, SOACategoria
     _HAS_PYDANTIC = True
@@ -99,6 +101,11 @@ class AnalysisResult:
     bando: BandoRequisiti
     violations: List[GuardrailViolation] = field(default_factory=list)
     warnings: List[str] = field(default_factory=list)
+    # Ri-analisi incrementale (incremental.py): impostati da analyze_pdf / reanalyze_pdf
+    snapshot: Optional[Any] = None   # DocumentSnapshot di questa versione
+    diff: Optional[Any] = None       # VersionDiff rispetto alla versione precedente
+    # Categorie che la pipeline non ha estratto (classificazione certa): blocchi non applicabili
+    skipped_categories: List[str] = field(default_factory=list)
 
     @property
     def has_critical_unknowns(self) -> bool:
@@ -456,6 +463,7 @@ def _validate_certificazioni(raw_certs: List[str]) -> List[str]:
 # ENTRY POINT
 # ══════════════════════════════════════════════════════════════════════════════
 
+@traced("analyze")
 def analyze(parsed_doc) -> AnalysisResult:
     """
     Trasforma ParsedDocument (raw fields) → AnalysisResult (BandoRequisiti + violazioni).
@@ -568,4 +576,7 @@ def analyze(parsed_doc) -> AnalysisResult:
         for w in warnings:
             logger.warning(f"analyze(): {w}")
 
-    return AnalysisResult(bando=bando, violations=violations, warnings=warnings)
+    return AnalysisResult(
+        bando=bando, violations=violations, warnings=warnings,
+        skipped_categories=list(getattr(parsed_doc, "skipped_categories", [])),
+    )
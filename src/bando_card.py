@@ -14,14 +14,29 @@ La BandoCard ha 6 blocchi:
 Regola hard MVP:
   - Se evidence mancante dal bando → "Da verificare"
   - Se dato aziendale mancante → stato = ❓ (mai ❌ per mancanza di info)
+
+Card parziale (estrazione in corso): con pending_categories i blocchi che
+dipendono da categorie non ancora estratte (BLOCK_CATEGORIES) sono marcati
+in pending_blocks e non producono "Da verificare"; il Blocco 6 resta in
+attesa finché manca una qualsiasi categoria.
+
+Nuova versione del bando (rettifica): con changed_categories i blocchi i cui
+campi sono cambiati rispetto all'analisi precedente sono in changed_blocks,
+le pagine modificate in changed_pages (vedi incremental.VersionDiff).
+
+Tipo di documento: le categorie che la pipeline non ha estratto perché la
+classificazione certa del documento non le usa (es. SOA, certificazioni e
+DGUE in una richiesta di preventivo) sono in not_applicable; i loro blocchi
+sono "non applicabili", non "da verificare".
 """
 from __future__ import annotations
 
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from src.schemas import BandoRequisiti, RequirementResult, ReqStatus, Severity
+from src.tracing import traced
 
 
 # ══════════════════════════════════════════════════════
@@ -60,8 +75,8 @@ class InfoOperativa:
     piattaforma_spid: bool
     pnrr: bool
     appalto_integrato: bool
-    dgue_required: bool
-    contributo_anac: str    # "si" | "no" | "da_verificare"
+    dgue_required: Optional[bool]   # None = non applicabile al tipo di documento
+    contributo_anac: str    # "si" | "no" | "da_verificare" | "non_applicabile"
     canale_invio: str
 
 
@@ -96,11 +111,37 @@ class BandoCard:
     da_verificare: List[str]    # messaggi testuali ambiguità
     note_avanzate: List[str]    # requisiti SOFT_RISK non critici
 
+    # Blocchi in attesa di categorie non ancora estratte (card parziale)
+    pending_blocks: List[str] = field(default_factory=list)
+
+    # Nuova versione: blocchi con campi cambiati e pagine (1-based) modificate
+    changed_blocks: List[str] = field(default_factory=list)
+    changed_pages: List[int] = field(default_factory=list)
+
+    # Categorie non applicabili al tipo di documento (non estratte, vedi doc_classifier)
+    not_applicable: List[str] = field(default_factory=list)
+
+    @property
+    def is_partial(self) -> bool:
+        return bool(self.pending_blocks)
+
+    def is_applicable(self, category: str) -> bool:
+        return category not in self.not_applicable
+
 
 # ══════════════════════════════════════════════════════
 # BUILDER
 # ══════════════════════════════════════════════════════
 
+# Blocco → categorie di estrazione da cui dipende ("meta" = _extract_meta)
+BLOCK_CATEGORIES: Dict[str, Tuple[str, ...]] = {
+    "identita": ("meta", "anac_cig", "importo"),
+    "scadenze": ("scadenze",),
+    "soa": ("soa",),
+    "certificazioni": ("certificazioni",),
+    "info_operative": ("meta", "anac_cig", "piattaforma", "dgue"),
+}
+
 _TIPO_LABEL = {
     "presentazione_offerta": "Scadenza offerta",
     "presentazione offerta": "Scadenza offerta",
@@ -311,11 +352,13 @@ def _build_cert_items(
     return items, da_verificare
 
 
-def _build_info_operative(bando: BandoRequisiti) -> Tuple[InfoOperativa, List[str]]:
+def _build_info_operative(bando: BandoRequisiti, not_applicable: List[str]) -> Tuple[InfoOperativa, List[str]]:
     da_verificare = []
 
     # Contributo ANAC
-    if bando.anac_contributo_richiesto == "yes":
+    if "anac_cig" in not_applicable:
+        contributo = "non_applicabile"
+    elif bando.anac_contributo_richiesto == "yes":
         contributo = "si"
     elif bando.anac_contributo_richiesto == "no":
         contributo = "no"
@@ -336,7 +379,7 @@ def _build_info_operative(bando: BandoRequisiti) -> Tuple[InfoOperativa, List[st
         piattaforma_spid=bando.piattaforma_spid_required,
         pnrr=bando.is_pnrr,
         appalto_integrato=bando.appalto_integrato,
-        dgue_required=bando.dgue_required,
+        dgue_required=None if "dgue" in not_applicable else bando.dgue_required,
         contributo_anac=contributo,
         canale_invio=bando.canale_invio,
     ), da_verificare
@@ -345,6 +388,7 @@ def _build_info_operative(bando: BandoRequisiti) -> Tuple[InfoOperativa, List[st
 def _collect_da_verificare(
     results: List[RequirementResult],
     bando: BandoRequisiti,
+    not_applicable: List[str],
 ) -> Tuple[List[str], List[str]]:
     """
     Raccoglie UNKNOWN HARD_KO come "Da verificare"
@@ -372,7 +416,7 @@ def _collect_da_verificare(
             da_verificare.append(f"[{r.req_id}] {r.user_message}")
 
     # Importo mancante
-    if bando.importo_lavori is None and bando.importo_base_gara is None:
+    if "importo" not in not_applicable and bando.importo_lavori is None and bando.importo_base_gara is None:
         da_verificare.append("Importo base gara non trovato — verificare manualmente nel documento")
 
     return da_verificare, note_avanzate
@@ -382,37 +426,68 @@ def _collect_da_verificare(
 # ENTRY POINT
 # ══════════════════════════════════════════════════════
 
+@traced("build_bando_card")
 def build_bando_card(
     bando: BandoRequisiti,
     results: List[RequirementResult],
     soa_profile_empty: bool = False,
     cert_profile_empty: bool = False,
+    pending_categories: Optional[Iterable[str]] = None,
+    changed_categories: Optional[Iterable[str]] = None,
+    changed_pages: Optional[List[int]] = None,
+    skipped_categories: Optional[Iterable[str]] = None,
 ) -> BandoCard:
     """
     Costruisce la BandoCard MVP da BandoRequisiti + RequirementResults.
 
     Args:
-        bando: dati estratti dal PDF
+        bando: dati estratti dal PDF (anche parziali, a estrazione in corso)
         results: output dell'engine di matching
         soa_profile_empty: True se l'utente non ha inserito SOA nel profilo
         cert_profile_empty: True se l'utente non ha inserito certificazioni
+        pending_categories: categorie non ancora estratte → blocchi in attesa
+        changed_categories: categorie cambiate rispetto alla versione precedente
+        changed_pages: pagine modificate rispetto alla versione precedente
+        skipped_categories: categorie che la pipeline non ha estratto per il
+            tipo di documento (AnalysisResult.skipped_categories) → blocchi non
+            applicabili. Non si deduce da bando.document_type: il modello può
+            etichettare il documento diversamente dalla classificazione, e le
+            categorie estratte e valutate vanno comunque mostrate.
     """
+    not_applicable = list(skipped_categories or [])
+    pending = set(pending_categories or ())
+    pending_blocks = [block for block, cats in BLOCK_CATEGORIES.items() if pending.intersection(cats)]
+    if pending:
+        pending_blocks.append("da_verificare")
+    changed = set(changed_categories or ())
+    changed_blocks = [block for block, cats in BLOCK_CATEGORIES.items() if changed.intersection(cats)]
+
     # Blocco 2 — Scadenze
     scadenze, dv_scad = _build_scadenze(bando)
 
     # Blocco 3 — SOA
-    soa_items, dv_soa = _build_soa_items(bando, results, soa_profile_empty)
+    soa_items, dv_soa = [], []
+    if "soa" not in not_applicable:
+        soa_items, dv_soa = _build_soa_items(bando, results, soa_profile_empty)
 
     # Blocco 4 — Certificazioni
-    cert_items, dv_cert = _build_cert_items(bando, results, cert_profile_empty)
+    cert_items, dv_cert = [], []
+    if "certificazioni" not in not_applicable:
+        cert_items, dv_cert = _build_cert_items(bando, results, cert_profile_empty)
 
     # Blocco 5 — Info operative
-    info_op, dv_info = _build_info_operative(bando)
+    info_op, dv_info = _build_info_operative(bando, not_applicable)
 
     # Blocco 6 — Da verificare
-    dv_general, note_avanzate = _collect_da_verificare(results, bando)
+    dv_general, note_avanzate = _collect_da_verificare(results, bando, not_applicable)
 
-    da_verificare = dv_scad + dv_soa + dv_cert + dv_info + dv_general
+    # I blocchi in attesa non segnalano dati mancanti: arriveranno
+    dv_blocks = [("scadenze", dv_scad), ("soa", dv_soa), ("certificazioni", dv_cert), ("info_operative", dv_info)]
+    da_verificare = [msg for block, msgs in dv_blocks if block not in pending_blocks for msg in msgs]
+    if pending:
+        note_avanzate = []
+    else:
+        da_verificare += dv_general
 
     return BandoCard(
         # Blocco 1
@@ -443,4 +518,9 @@ def build_bando_card(
         # Blocco 6
         da_verificare=da_verificare,
         note_avanzate=note_avanzate,
+
+        pending_blocks=pending_blocks,
+        changed_blocks=changed_blocks,
+        changed_pages=list(changed_pages or []),
+        not_applicable=not_applicable,
     )
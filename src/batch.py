@@ -0,0 +1,375 @@
+"""
+BidPilot — Analisi batch  v1.0
+===============================
+Analisi da riga di comando di una cartella (o lista) di PDF contro un
+profilo aziendale, senza Streamlit:
+
+  python -m src.batch bandi/ --profile config/profilo_azienda.json --out risultati.jsonl
+
+Pipeline a due pool:
+  - pool di processi (--pdf-processes): estrazione testo + chunking di ogni
+    PDF (lavoro CPU, fuori dal GIL), i documenti entrano appena pronti
+  - pool di thread condiviso (--llm-workers): tutte le chiamate LLM di tutti
+    i documenti; il limite vale per il batch intero, non per documento, e il
+    rate limiter del provider è comunque condiviso
+  poi, per documento: analyze → evaluate_all → build_bando_card
+
+Output: un record JSON per riga e per bando (BandoCard, violazioni, trace,
+utilizzo LLM, tempi per fase), scritto appena il documento è concluso.
+Ripresa: i documenti già presenti nel file con status "ok" (stessa chiave
+di contenuto, vedi document_cache.document_key) vengono saltati; quelli in
+errore vengono ritentati. Un'interruzione perde al più i documenti in corso.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from src.analyzer import analyze
+from src.bando_card import build_bando_card
+from src.document_cache import document_key
+from src.parser import (
+    _CATEGORY_SCHEMA,
+    _DEFAULT_CONTEXT_BUDGET,
+    _DEFAULT_LLM_RETRIES,
+    _DEFAULT_LLM_TIMEOUT,
+    _chunk_pdf,
+    _LLMOptions,
+    _parsed_document,
+    _resolve_api_key,
+    _resolve_cache,
+    _run_extraction,
+)
+from src.profile_builder import MinimalProfile, build_from_json
+from src.requirements_engine import evaluate_all
+from src.retrieval import Chunk, Retriever
+
+logger = logging.getLogger("bidpilot.batch")
+
+_DEFAULT_PDF_PROCESSES = max(1, min(4, (os.cpu_count() or 2) - 1))
+_DEFAULT_LLM_WORKERS = 8
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TIPI
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class BatchOptions:
+    """Parametri condivisi da tutti i documenti del batch."""
+    model: str = "gpt-4o-mini"
+    api_key: Optional[str] = None
+    pdf_processes: int = _DEFAULT_PDF_PROCESSES   # 0 = estrazione nel processo principale
+    llm_workers: int = _DEFAULT_LLM_WORKERS
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT
+    retries: int = _DEFAULT_LLM_RETRIES
+    use_cache: bool = True
+    top_n_per_category: int = 6
+    min_score: float = 0.1
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET
+
+
+@dataclass
+class BatchSummary:
+    """Contatori del batch (i record sono nel file JSONL)."""
+    total: int = 0
+    skipped: int = 0          # già analizzati in un'esecuzione precedente
+    ok: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# INPUT / RIPRESA
+# ══════════════════════════════════════════════════════════════════════════════
+
+def collect_pdfs(inputs: Iterable[str]) -> List[str]:
+    """PDF da file e cartelle (ricorsivo), percorsi assoluti senza duplicati, in ordine."""
+    out: List[str] = []
+    for item in inputs:
+        p = Path(item)
+        found = sorted(p.rglob("*.pdf")) + sorted(p.rglob("*.PDF")) if p.is_dir() else [p]
+        for f in found:
+            resolved = str(f.resolve())
+            if resolved not in out:
+                out.append(resolved)
+    return out
+
+
+def completed_keys(out_path: str) -> Set[str]:
+    """Chiavi dei documenti già conclusi con successo (righe troncate ignorate)."""
+    done: Set[str] = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # riga parziale di un'esecuzione interrotta
+            if record.get("status") == "ok" and record.get("document_key"):
+                done.add(record["document_key"])
+    return done
+
+
+def _file_key(path: str, model: str) -> str:
+    with open(path, "rb") as f:
+        return document_key(f.read(), model)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FASI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _prepare(path: str) -> Tuple[List[Chunk], int, float]:
+    """Nel pool di processi: testo + chunk del PDF (estrazione seriale nel worker)."""
+    t0 = time.perf_counter()
+    chunks, pages_count = _chunk_pdf(path, pdf_workers=1)
+    return chunks, pages_count, (time.perf_counter() - t0) * 1000
+
+
+def _analyze_document(
+    path: str,
+    key: str,
+    chunks: List[Chunk],
+    pages_count: int,
+    pdf_ms: float,
+    profile: MinimalProfile,
+    llm: _LLMOptions,
+    options: BatchOptions,
+    executor: ThreadPoolExecutor,
+) -> dict:
+    """Estrazione (chiamate nel pool condiviso) → analyze → evaluate_all → BandoCard."""
+    timings = {"pdf_ms": round(pdf_ms, 1)}
+    t0 = time.perf_counter()
+    run = _run_extraction(
+        chunks, Retriever(chunks), list(_CATEGORY_SCHEMA.keys()), llm,
+        top_n=options.top_n_per_category, min_score=options.min_score,
+        context_budget=options.context_budget, executor=executor,
+    )
+    doc = _parsed_document(run, chunks, pages_count, path)
+    t1 = time.perf_counter()
+    analysis = analyze(doc)
+    results = evaluate_all(analysis.bando, profile.company)
+    card = build_bando_card(
+        bando=analysis.bando, results=results,
+        soa_profile_empty=not profile.has_soa_data, cert_profile_empty=not profile.has_cert_data,
+        skipped_categories=analysis.skipped_categories,
+    )
+    t2 = time.perf_counter()
+    timings.update(
+        extraction_ms=round((t1 - t0) * 1000, 1),
+        analysis_ms=round((t2 - t1) * 1000, 1),
+        total_ms=round(pdf_ms + (t2 - t0) * 1000, 1),
+    )
+    return {
+        "path": path,
+        "document_key": key,
+        "status": "ok",
+        "pages": pages_count,
+        "card": asdict(card),
+        "violations": [asdict(v) for v in analysis.violations],
+        "traces": ([doc.meta_trace.to_dict()] if doc.meta_trace else []) + doc.traces_as_dict(),
+        "usage": doc.usage_summary(),
+        "timings": timings,
+    }
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# BATCH
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _ends_mid_line(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+class _RecordWriter:
+    """Append JSONL thread-safe; flush a ogni record (sopravvive alle interruzioni)."""
+
+    def __init__(self, path: str):
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        if _ends_mid_line(path):
+            self._file.write("\n")   # chiude la riga troncata: il record successivo resta leggibile
+
+    def write(self, record: dict) -> None:
+        record["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def run_batch(
+    paths: List[str],
+    profile: MinimalProfile,
+    out_path: str,
+    options: Optional[BatchOptions] = None,
+) -> BatchSummary:
+    """
+    Analizza i PDF e scrive un record per documento in out_path (append).
+    I documenti già conclusi in out_path vengono saltati (ripresa).
+    """
+    options = options or BatchOptions()
+    api_key = _resolve_api_key(options.api_key, options.model)
+    llm = _LLMOptions(
+        model=options.model, api_key=api_key, timeout=options.timeout, retries=options.retries,
+        cache=_resolve_cache(options.use_cache, None),
+    )
+    summary = BatchSummary(total=len(paths))
+    started = time.perf_counter()
+
+    done = completed_keys(out_path)
+    todo: List[Tuple[str, str]] = []
+    for path in paths:
+        try:
+            key = _file_key(path, options.model)
+        except OSError as exc:
+            summary.failed += 1
+            summary.errors[path] = str(exc)
+            continue
+        if key in done:
+            summary.skipped += 1
+        else:
+            todo.append((path, key))
+    logger.info(f"Batch: {len(todo)} documenti da analizzare, {summary.skipped} già conclusi.")
+
+    writer = _RecordWriter(out_path)
+
+    def _fail(path: str, key: str, exc: BaseException) -> None:
+        logger.error(f"Batch: {path} fallito — {exc}")
+        summary.failed += 1
+        summary.errors[path] = str(exc)
+        writer.write({"path": path, "document_key": key, "status": "error", "error": f"{type(exc).__name__}: {exc}"})
+
+    processes = ProcessPoolExecutor(max_workers=options.pdf_processes) if options.pdf_processes > 0 else None
+    llm_pool = ThreadPoolExecutor(max_workers=max(1, options.llm_workers), thread_name_prefix="bidpilot-llm")
+    # un thread per documento in fase LLM: attende le proprie chiamate nel pool condiviso
+    doc_pool = ThreadPoolExecutor(max_workers=max(1, options.llm_workers), thread_name_prefix="bidpilot-doc")
+    try:
+        prepared: Dict[Future, Tuple[str, str]] = {}
+        for path, key in todo:
+            if processes is None:
+                future: Future = Future()
+                try:
+                    future.set_result(_prepare(path))
+                except Exception as exc:
+                    future.set_exception(exc)
+            else:
+                future = processes.submit(_prepare, path)
+            prepared[future] = (path, key)
+
+        analyzing: Dict[Future, Tuple[str, str]] = {}
+        while prepared or analyzing:
+            finished, _ = wait(list(prepared) + list(analyzing), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in prepared:
+                    path, key = prepared.pop(future)
+                    try:
+                        chunks, pages_count, pdf_ms = future.result()
+                    except Exception as exc:
+                        _fail(path, key, exc)
+                        continue
+                    job = doc_pool.submit(
+                        _analyze_document, path, key, chunks, pages_count, pdf_ms,
+                        profile, llm, options, llm_pool,
+                    )
+                    analyzing[job] = (path, key)
+                else:
+                    path, key = analyzing.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as exc:
+                        _fail(path, key, exc)
+                        continue
+                    writer.write(record)
+                    summary.ok += 1
+                    logger.info(
+                        f"Batch: {summary.ok + summary.failed}/{len(todo)} {Path(path).name} "
+                        f"({record['timings']['total_ms'] / 1000:.1f}s)"
+                    )
+    finally:
+        doc_pool.shutdown(wait=True, cancel_futures=True)
+        llm_pool.shutdown(wait=True, cancel_futures=True)
+        if processes is not None:
+            processes.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+
+    summary.seconds = round(time.perf_counter() - started, 2)
+    return summary
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(
+        prog="python -m src.batch", description="Analisi batch di bandi PDF → JSONL (una BandoCard per riga).",
+    )
+    ap.add_argument("inputs", nargs="+", help="PDF o cartelle di PDF")
+    ap.add_argument("--profile", default="config/profilo_azienda.json", help="profilo aziendale JSON")
+    ap.add_argument("--out", default="bidpilot_batch.jsonl", help="file JSONL di output (append, ripresa)")
+    ap.add_argument("--model", default="gpt-4o-mini")
+    ap.add_argument("--api-key", default=None, help="default: OPENAI_API_KEY / ANTHROPIC_API_KEY")
+    ap.add_argument("--pdf-processes", type=int, default=_DEFAULT_PDF_PROCESSES,
+                    help="processi per l'estrazione PDF (0 = nel processo principale)")
+    ap.add_argument("--llm-workers", type=int, default=_DEFAULT_LLM_WORKERS,
+                    help="chiamate LLM in volo per l'intero batch")
+    ap.add_argument("--no-cache", action="store_true", help="bypass della cache di estrazione")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+    logging.getLogger("bidpilot.batch").setLevel(logging.INFO)
+
+    with open(args.profile, encoding="utf-8") as f:
+        profile = build_from_json(json.load(f))
+    paths = collect_pdfs(args.inputs)
+    if not paths:
+        print("Nessun PDF trovato.", file=sys.stderr)
+        return 2
+
+    options = BatchOptions(
+        model=args.model, api_key=args.api_key, pdf_processes=args.pdf_processes,
+        llm_workers=args.llm_workers, use_cache=not args.no_cache,
+    )
+    try:
+        summary = run_batch(paths, profile, args.out, options)
+    except KeyboardInterrupt:
+        print(f"\nInterrotto: i documenti conclusi sono in {args.out}; rilancia per riprendere.", file=sys.stderr)
+        return 130
+    print(
+        f"{summary.ok} analizzati, {summary.skipped} già conclusi, {summary.failed} in errore "
+        f"su {summary.total} PDF in {summary.seconds:.1f}s → {args.out}"
+    )
+    return 1 if summary.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""
+BidPilot — Cascata di modelli  v1.0
+====================================
+Estrazione a due livelli: ogni categoria parte con un modello economico e
+passa al modello grande solo se analyze() ne segnala i campi.
+
+  1. _run_extraction con il modello piccolo (metadati + tutte le categorie)
+  2. analyze() → GuardrailViolation (evidence mancante, CIG malformato,
+     data non parsabile, SOA fuori formato...)
+  3. le categorie con almeno una violazione — ed estratte davvero dall'LLM,
+     non saltate né risolte dalla pre-estrazione — vengono ri-estratte con il
+     modello grande; i loro campi sostituiscono quelli del modello piccolo
+  4. analyze() finale sul documento unito
+
+Il costo per categoria viene dai token riportati dal provider (trace.cost_usd);
+se il provider non li riporta è stimato dai token di contesto (+ una risposta
+media, _COMPLETION_TOKENS_ESTIMATE). Le risposte dalla cache costano 0.
+escalation_rates() aggrega il tasso di escalation per categoria su più documenti.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.analyzer import AnalysisResult, GuardrailViolation, analyze
+from src.llm_cache import ExtractionCache
+from src.llm_client import provider_for_model
+from src.parser import (
+    _CATEGORY_SCHEMA,
+    _COMPLETION_TOKENS_ESTIMATE,
+    _DEFAULT_CONTEXT_BUDGET,
+    _DEFAULT_LLM_RETRIES,
+    _DEFAULT_LLM_TIMEOUT,
+    _DEFAULT_MAX_WORKERS,
+    ParsedDocument,
+    _chunk_pdf,
+    _deep_merge,
+    _LLMOptions,
+    _parsed_document,
+    _resolve_api_key,
+    _resolve_cache,
+    _run_extraction,
+    _schema_fields,
+)
+from src.pricing import estimate_cost
+from src.retrieval import Chunk, ExtractionTrace, Retriever, chunk_full_text
+
+logger = logging.getLogger("bidpilot.cascade")
+
+# campo di primo livello di BandoRequisiti → categoria che lo estrae
+_FIELD_CATEGORY: Dict[str, str] = {
+    name: category
+    for category, schema in _CATEGORY_SCHEMA.items()
+    for name in schema["fields"]
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# OUTPUT
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class CategoryCascade:
+    """Esito della cascata per una categoria."""
+    category: str
+    model: str                     # modello che ha prodotto i campi finali
+    escalated: bool = False
+    violations: List[GuardrailViolation] = field(default_factory=list)           # modello piccolo
+    residual_violations: List[GuardrailViolation] = field(default_factory=list)  # dopo l'escalation
+    latency_ms: float = 0.0        # somma delle chiamate (piccolo + grande)
+    cost_usd: float = 0.0          # stimato; 0 per cache, pre-estrazione e categorie saltate
+
+
+@dataclass
+class CascadeResult:
+    """Documento unito, analisi finale e contabilità per categoria."""
+    parsed: ParsedDocument
+    analysis: AnalysisResult
+    categories: List[CategoryCascade] = field(default_factory=list)
+
+    @property
+    def escalated(self) -> List[str]:
+        return [c.category for c in self.categories if c.escalated]
+
+    @property
+    def escalation_rate(self) -> float:
+        return round(len(self.escalated) / len(self.categories), 4) if self.categories else 0.0
+
+    @property
+    def cost_usd(self) -> float:
+        return sum(c.cost_usd for c in self.categories)
+
+    @property
+    def latency_ms(self) -> float:
+        return sum(c.latency_ms for c in self.categories)
+
+
+def escalation_rates(results: List[CascadeResult]) -> Dict[str, dict]:
+    """Per categoria su più documenti: documenti, escalation, tasso, costo e latenza medi."""
+    out: Dict[str, dict] = {}
+    for result in results:
+        for c in result.categories:
+            row = out.setdefault(c.category, {"documents": 0, "escalated": 0, "cost_usd": 0.0, "latency_ms": 0.0})
+            row["documents"] += 1
+            row["escalated"] += int(c.escalated)
+            row["cost_usd"] += c.cost_usd
+            row["latency_ms"] += c.latency_ms
+    for row in out.values():
+        n = row["documents"]
+        row["escalation_rate"] = round(row["escalated"] / n, 4)
+        row["avg_cost_usd"] = row["cost_usd"] / n
+        row["avg_latency_ms"] = round(row["latency_ms"] / n, 1)
+    return out
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ESCALATION
+# ══════════════════════════════════════════════════════════════════════════════
+
+def violation_category(violation: GuardrailViolation) -> Optional[str]:
+    """Categoria del campo segnalato ('soa_richieste[OG1].evidence' → 'soa'); None se fuori schema."""
+    base = re.split(r"[\[.]", violation.field, maxsplit=1)[0]
+    if base == "canale_invio":
+        return "piattaforma"
+    return _FIELD_CATEGORY.get(base)
+
+
+def _by_category(violations: List[GuardrailViolation]) -> Dict[str, List[GuardrailViolation]]:
+    out: Dict[str, List[GuardrailViolation]] = {}
+    for v in violations:
+        category = violation_category(v)
+        if category is not None:
+            out.setdefault(category, []).append(v)
+    return out
+
+
+def _trace_cost(trace: ExtractionTrace) -> float:
+    """Costo dai token riportati dal provider; senza, stima dai token di contesto."""
+    if trace.cost_usd is not None:
+        return trace.cost_usd
+    if trace.method != "llm" or trace.cache_status == "hit" or not trace.model:
+        return 0.0
+    cost = estimate_cost(trace.model, trace.tokens_sent, _COMPLETION_TOKENS_ESTIMATE)
+    return cost or 0.0
+
+
+def _cascade(
+    chunks: List[Chunk],
+    retriever: Retriever,
+    categories: List[str],
+    small: _LLMOptions,
+    large: _LLMOptions,
+    pages_count: int,
+    source_path: str,
+    top_n: int,
+    min_score: float,
+    max_workers: int,
+    context_budget: Optional[int],
+) -> CascadeResult:
+    options = dict(top_n=top_n, min_score=min_score, max_workers=max_workers, context_budget=context_budget)
+
+    logger.info(f"  Cascata: estrazione con {small.model}...")
+    first = _run_extraction(chunks, retriever, categories, small, **options)
+    parsed = _parsed_document(first, chunks, pages_count, source_path)
+    analysis = analyze(parsed)
+    flagged = _by_category(analysis.violations)
+    traces = {t.category: t for t in first.traces}
+    escalate = [c for c in categories if c in flagged and traces[c].method == "llm"]
+
+    stats = {
+        c: CategoryCascade(
+            category=c, model=traces[c].model or small.model,
+            violations=flagged.get(c, []),
+            latency_ms=traces[c].latency_ms or 0.0, cost_usd=_trace_cost(traces[c]),
+        )
+        for c in categories
+    }
+    if not escalate:
+        return CascadeResult(parsed=parsed, analysis=analysis, categories=list(stats.values()))
+
+    logger.info(f"  Cascata: violazioni su {escalate} → ri-estrazione con {large.model}.")
+    second = _run_extraction(
+        chunks, retriever, escalate, large,
+        pre_extract=False, classify=False, extract_meta=False, **options,
+    )
+    # I campi del modello piccolo per le categorie escalate vanno tolti, non
+    # solo sovrascritti: _deep_merge non sostituisce un valore con None.
+    dropped = {name for c in escalate for name in _schema_fields(c)}
+    raw_fields = {k: v for k, v in first.raw_fields.items() if k not in dropped}
+    first.raw_fields = _deep_merge(raw_fields, second.raw_fields)
+    first.category_fields.update(second.category_fields)
+    traces.update({t.category: t for t in second.traces})
+    first.traces = [traces[c] for c in categories]
+
+    parsed = _parsed_document(first, chunks, pages_count, source_path)
+    analysis = analyze(parsed)
+    residual = _by_category(analysis.violations)
+    for trace in second.traces:
+        entry = stats[trace.category]
+        entry.model = large.model
+        entry.escalated = True
+        entry.residual_violations = residual.get(trace.category, [])
+        entry.latency_ms += trace.latency_ms or 0.0
+        entry.cost_usd += _trace_cost(trace)
+    logger.info(
+        f"  Cascata: {len(escalate)}/{len(categories)} categorie escalate, "
+        f"violazioni residue {sum(len(v) for v in residual.values())}."
+    )
+    return CascadeResult(parsed=parsed, analysis=analysis, categories=list(stats.values()))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ENTRY POINT
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _llm_pair(
+    model: str,
+    api_key: Optional[str],
+    escalation_model: str,
+    escalation_api_key: Optional[str],
+    timeout: Optional[float],
+    retries: int,
+    cache: Optional[ExtractionCache],
+) -> tuple:
+    api_key = _resolve_api_key(api_key, model)
+    if escalation_api_key is None and provider_for_model(escalation_model) == provider_for_model(model):
+        escalation_api_key = api_key
+    escalation_api_key = _resolve_api_key(escalation_api_key, escalation_model)
+    small = _LLMOptions(model=model, api_key=api_key, timeout=timeout, retries=retries, cache=cache)
+    large = _LLMOptions(
+        model=escalation_model, api_key=escalation_api_key, timeout=timeout, retries=retries, cache=cache,
+    )
+    return small, large
+
+
+def cascade_pdf(
+    path: str,
+    model: str = "gpt-4o-mini",
+    escalation_model: str = "gpt-4o",
+    api_key: Optional[str] = None,
+    escalation_api_key: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    top_n_per_category: int = 6,
+    min_score: float = 0.1,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT,
+    retries: int = _DEFAULT_LLM_RETRIES,
+    use_cache: bool = True,
+    cache: Optional[ExtractionCache] = None,
+    scorer: str = "log_tf",
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+    pdf_workers: Optional[int] = None,
+) -> CascadeResult:
+    """
+    Come parse_pdf + analyze, ma con la cascata model → escalation_model.
+    escalation_api_key: None = stessa chiave se il provider è lo stesso,
+    altrimenti dalle variabili d'ambiente.
+    """
+    small, large = _llm_pair(
+        model, api_key, escalation_model, escalation_api_key, timeout, retries,
+        _resolve_cache(use_cache, cache),
+    )
+    path = str(Path(path).resolve())
+    logger.info(f"cascade_pdf: {path}")
+
+    chunks, pages_count = _chunk_pdf(path, pdf_workers)
+    return _cascade(
+        chunks, Retriever(chunks, scorer=scorer),
+        categories or list(_CATEGORY_SCHEMA.keys()), small, large, pages_count, path,
+        top_n=top_n_per_category, min_score=min_score, max_workers=max_workers,
+        context_budget=context_budget,
+    )
+
+
+def cascade_text(
+    text: str,
+    model: str = "gpt-4o-mini",
+    escalation_model: str = "gpt-4o",
+    api_key: Optional[str] = None,
+    escalation_api_key: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    top_n_per_category: int = 6,
+    min_score: float = 0.1,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT,
+    retries: int = _DEFAULT_LLM_RETRIES,
+    use_cache: bool = True,
+    cache: Optional[ExtractionCache] = None,
+    scorer: str = "log_tf",
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+) -> CascadeResult:
+    """Variante di cascade_pdf su testo già estratto (come parse_text)."""
+    small, large = _llm_pair(
+        model, api_key, escalation_model, escalation_api_key, timeout, retries,
+        _resolve_cache(use_cache, cache),
+    )
+    chunks = chunk_full_text(text)
+    return _cascade(
+        chunks, Retriever(chunks, scorer=scorer),
+        categories or list(_CATEGORY_SCHEMA.keys()), small, large, 0, "<text>",
+        top_n=top_n_per_category, min_score=min_score, max_workers=max_workers,
+        context_budget=context_budget,
+    )
@@ -0,0 +1,189 @@
+"""
+BidPilot — Context Packer  v1.0
+================================
+Impacchetta il contesto di una categoria entro un budget di token.
+
+Prima ogni categoria riceveva i top-N chunk interi (fino a 6.000 caratteri
+l'uno): ~9k token anche quando la parte rilevante erano poche righe.
+Il packer seleziona invece finestre di paragrafo/frase attorno ai termini
+che hanno fatto matchare il chunk (ScoredChunk.matched_terms):
+
+  1. ogni chunk è diviso in segmenti (paragrafi; i paragrafi lunghi in frasi)
+  2. ogni segmento che contiene un termine matchato apre una finestra
+     [segmento-1, segmento+1]; finestre sovrapposte vengono fuse
+  3. segmenti identici già visti (overlap tra sub-chunk) vengono scartati
+  4. le finestre entrano per priorità finché c'è budget: prima la finestra
+     migliore di ogni chunk (per score del chunk; a parità di peso la più
+     corta), poi le altre; nell'output
+     tornano in ordine di documento
+
+Se il contesto completo sta già nel budget viene inviato invariato.
+I marker [CHUNK id | pagina n] restano, così l'evidence è sempre tracciabile.
+
+Conteggio token con tiktoken (se installato), altrimenti stima len // 4.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.retrieval import RetrievalResult, ScoredChunk, _normalize, build_context_string
+from src.tracing import traced
+
+logger = logging.getLogger("bidpilot.context_packer")
+
+_ELISION = "[…]"
+_SENTENCE_SPLIT_CHARS = 600        # paragrafi più lunghi vengono divisi in frasi
+_WINDOW_RADIUS = 1                 # segmenti di contesto prima/dopo il match
+_CHUNK_SEPARATOR = "\n\n---\n\n"   # come build_context_string
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TOKEN COUNTING
+# ══════════════════════════════════════════════════════════════════════════════
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    """Encoding tiktoken per il modello (cl100k_base per modelli non OpenAI); None se assente."""
+    try:
+        import tiktoken  # type: ignore
+    except ModuleNotFoundError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Token del testo per il modello dato (stima len // 4 senza tiktoken)."""
+    enc = _encoding(model)
+    if enc is None:
+        return len(text) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PACKING
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class PackedContext:
+    """Contesto pronto per il prompt + contabilità dei token."""
+    text: str
+    tokens_sent: int
+    tokens_full: int        # token del contesto non impacchettato
+    windows: int = 0        # finestre incluse (0 = contesto completo)
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_full - self.tokens_sent)
+
+
+def _segments(text: str) -> List[str]:
+    """Paragrafi (separati da riga vuota); i paragrafi lunghi divisi in frasi."""
+    out: List[str] = []
+    for para in re.split(r"\n\s*\n", text):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) <= _SENTENCE_SPLIT_CHARS:
+            out.append(para)
+        else:
+            out.extend(s for s in re.split(r"(?<=[.;:])\s+", para) if s.strip())
+    return out
+
+
+def _windows(segments: List[str], terms: List[str]) -> List[Tuple[int, int, float]]:
+    """
+    Finestre fuse (start, end esclusivo, peso) attorno ai segmenti con match.
+    Peso = termini distinti del segmento migliore, multi-parola x2 (come lo scorer):
+    una finestra lunga di boilerplate non supera un paragrafo denso.
+    """
+    hits: List[Tuple[int, float]] = []
+    for i, seg in enumerate(segments):
+        seg_norm = _normalize(seg)
+        n = sum(2.0 if " " in t else 1.0 for t in terms if t in seg_norm)
+        if n:
+            hits.append((i, n))
+    merged: List[Tuple[int, int, float]] = []
+    for i, n in hits:
+        start, end = max(0, i - _WINDOW_RADIUS), min(len(segments), i + _WINDOW_RADIUS + 1)
+        if merged and start <= merged[-1][1]:
+            s0, _, n0 = merged[-1]
+            merged[-1] = (s0, end, max(n0, n))
+        else:
+            merged.append((start, end, n))
+    return merged
+
+
+@traced("pack_context")
+def pack_context(
+    result: RetrievalResult,
+    budget_tokens: Optional[int],
+    model: str = "gpt-4o-mini",
+) -> PackedContext:
+    """
+    Costruisce il contesto di una categoria entro budget_tokens.
+    budget_tokens=None → contesto completo (comportamento di build_context_string).
+    """
+    full = build_context_string(result, include_chunk_id=True)
+    tokens_full = count_tokens(full, model)
+    if budget_tokens is None or tokens_full <= budget_tokens:
+        return PackedContext(text=full, tokens_sent=tokens_full, tokens_full=tokens_full)
+
+    # Candidati: (priorità, posizione, chunk, segmenti della finestra)
+    # Priorità: (0 = finestra migliore del chunk, -score chunk, -peso finestra)
+    candidates: List[Tuple[Tuple[int, float, float], Tuple[int, int], ScoredChunk, List[str]]] = []
+    for rank, sc in enumerate(result.chunks):
+        terms = [_normalize(t) for t in sc.matched_terms]
+        segments = _segments(sc.chunk.text)
+        windows = _windows(segments, terms) or [(0, len(segments), 0.0)]  # match a cavallo di paragrafi
+        # a parità di peso vince la finestra più corta (più densa e più facile da far stare nel budget)
+        best = max(range(len(windows)), key=lambda w: (
+            windows[w][2], -sum(len(s) for s in segments[windows[w][0]:windows[w][1]])))
+        for w, (start, end, weight) in enumerate(windows):
+            priority = (0 if w == best else 1, -sc.score, -weight)
+            candidates.append((priority, (rank, start), sc, segments[start:end]))
+
+    seen: Set[str] = set()
+    selected: Dict[str, List[Tuple[int, str]]] = {}
+    used = 0
+    for _, (rank, start), sc, segments in sorted(candidates, key=lambda c: (c[0], c[1])):
+        kept = [seg for seg in segments if _normalize(seg) not in seen]
+        if not kept:
+            continue
+        text = "\n\n".join(kept)
+        header_cost = 0 if sc.chunk.chunk_id in selected else count_tokens(
+            f"[CHUNK {sc.chunk.chunk_id} | pagina {sc.chunk.page + 1}]\n", model)
+        cost = count_tokens(text, model) + header_cost + 2
+        if used + cost > budget_tokens:
+            if used:
+                continue
+            # Prima finestra più grande dell'intero budget: troncata
+            text = text[: max(0, (budget_tokens - header_cost) * 4)]
+            cost = budget_tokens
+        seen.update(_normalize(seg) for seg in kept)
+        selected.setdefault(sc.chunk.chunk_id, []).append((start, text))
+        used += cost
+
+    parts = []
+    for sc in result.chunks:   # ordine di documento (come il RetrievalResult)
+        windows = sorted(selected.get(sc.chunk.chunk_id, []))
+        if windows:
+            header = f"[CHUNK {sc.chunk.chunk_id} | pagina {sc.chunk.page + 1}]"
+            body = f"\n{_ELISION}\n".join(text for _, text in windows)
+            parts.append(f"{header}\n{body}")
+    text = _CHUNK_SEPARATOR.join(parts)
+    n_windows = sum(len(w) for w in selected.values())
+    packed = PackedContext(
+        text=text, tokens_sent=count_tokens(text, model), tokens_full=tokens_full, windows=n_windows,
+    )
+    logger.debug(
+        f"Context packer '{result.category}': {packed.tokens_full} → {packed.tokens_sent} token "
+        f"({n_windows} finestre)."
+    )
+    return packed
@@ -0,0 +1,154 @@
+"""
+BidPilot — Classificazione documento  v1.0
+==========================================
+Primo passaggio economico (regex, nessuna chiamata LLM) sulle pagine di
+apertura: document_type, procedure_family, is_qualification_system.
+
+Serve a decidere quali categorie di _CATEGORY_SCHEMA sono davvero usate a
+valle e a non estrarre le altre:
+
+  - richiesta_preventivo   → evaluate_all salta L4–L16 e le certificazioni:
+                             SOA, certificazioni, DGUE e forme di
+                             partecipazione non servono
+  - sistema_qualificazione → evaluate_all valuta solo D11–D20 (campi fuori
+                             da _CATEGORY_SCHEMA): restano scadenze e
+                             piattaforma per la BandoCard
+
+La BandoCard mostra i blocchi di queste categorie come "non applicabili a
+questo tipo di documento" (skipped_for), non come dati mancanti.
+
+La classificazione guarda solo l'intestazione (primi _TITLE_CHARS caratteri):
+"sistema di qualificazione" o "preventivo" citati nel corpo di un
+disciplinare non bastano. Segnali contrastanti (es. "disciplinare di gara"
+e "richiesta di preventivo" nella stessa intestazione) → confident=False,
+nessuna categoria saltata.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from src.retrieval import Chunk
+
+_TITLE_CHARS = 1_500
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PATTERN
+# ══════════════════════════════════════════════════════════════════════════════
+
+# (document_type, pattern) — valutati tutti: più tipi trovati → ambiguo
+_DOCUMENT_TYPE_PATTERNS = [
+    ("sistema_qualificazione", re.compile(
+        r"sistema\s+di\s+qualificazione|albo\s+(?:dei\s+)?fornitori\s+qualificati", re.I)),
+    ("richiesta_preventivo", re.compile(
+        r"richiesta\s+(?:di\s+)?preventiv|preventivo\s+(?:di\s+spesa|per\s+l['’]affidamento)", re.I)),
+    ("verbale_esito", re.compile(
+        r"verbale\s+(?:di\s+)?(?:gara|aggiudicazione|seduta)|esito\s+(?:di\s+)?gara", re.I)),
+    ("avviso_manifestazione", re.compile(
+        r"manifestazion[ei]\s+(?:di\s+)?interesse|avviso\s+esplorativo|indagine\s+di\s+mercato", re.I)),
+    ("lettera_invito", re.compile(r"lettera\s+(?:di\s+)?invito", re.I)),
+    ("disciplinare", re.compile(r"disciplinare\s+di\s+gara|bando\s+di\s+gara", re.I)),
+]
+
+# (procedure_family, pattern) — il primo che matcha vince (dal più specifico)
+_PROCEDURE_FAMILY_PATTERNS = [
+    ("negoziata_senza_bando", re.compile(
+        r"procedura\s+negoziata\s+senza\s+(?:previa\s+)?(?:pubblicazione\s+(?:di\s+un\s+|del\s+)?)?bando", re.I)),
+    ("negoziata", re.compile(r"procedura\s+negoziata", re.I)),
+    ("aperta", re.compile(r"procedura\s+aperta", re.I)),
+    ("affidamento_diretto", re.compile(r"affidamento\s+diretto", re.I)),
+    ("accordo_quadro", re.compile(r"accordo\s+quadro", re.I)),
+    ("dialogo_competitivo", re.compile(r"dialogo\s+competitivo", re.I)),
+]
+
+# Categorie NON consumate a valle per tipo di documento (vedi docstring del modulo)
+_SKIPPED_CATEGORIES: Dict[str, List[str]] = {
+    "richiesta_preventivo": ["soa", "certificazioni", "dgue", "forme_partecipazione"],
+    "sistema_qualificazione": [
+        "anac_cig", "importo", "soa", "certificazioni", "dgue", "forme_partecipazione",
+    ],
+}
+
+
+def skipped_for(document_type: Optional[str]) -> List[str]:
+    """Categorie non usate a valle per un document_type (vuota se nessuna)."""
+    return list(_SKIPPED_CATEGORIES.get(document_type or "", []))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TIPI
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class DocumentClass:
+    """Esito della classificazione: tipo, famiglia procedurale e segnali trovati."""
+    document_type: Optional[str] = None     # None = nessun segnale o segnali contrastanti
+    procedure_family: Optional[str] = None
+    confident: bool = False
+    evidence: List[str] = field(default_factory=list)
+
+    @property
+    def is_qualification_system(self) -> bool:
+        return self.confident and self.document_type == "sistema_qualificazione"
+
+    def skipped_categories(self, categories: List[str]) -> List[str]:
+        """Categorie (in ordine di categories) che il documento non usa a valle."""
+        if not self.confident:
+            return []
+        skip = set(skipped_for(self.document_type))
+        return [c for c in categories if c in skip]
+
+    def fields(self) -> dict:
+        """Campi BandoRequisiti da unire ai raw_fields (solo se la classificazione è certa)."""
+        out: Dict[str, object] = {}
+        if self.confident:
+            out["document_type"] = self.document_type
+            out["is_qualification_system"] = self.is_qualification_system
+        if self.procedure_family:
+            out["procedure_family"] = self.procedure_family
+        return out
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLASSIFICAZIONE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _snippet(text: str, m: "re.Match") -> str:
+    return " ".join(text[max(0, m.start() - 40): m.end() + 40].split())
+
+
+def classify_document(chunks: List[Chunk]) -> DocumentClass:
+    """Classifica il documento dall'intestazione (primi _TITLE_CHARS caratteri dei chunk)."""
+    title = ""
+    for chunk in chunks:
+        title += chunk.text + "\n"
+        if len(title) >= _TITLE_CHARS:
+            break
+    title = title[:_TITLE_CHARS]
+
+    result = DocumentClass()
+    found: List[str] = []
+    for doc_type, regex in _DOCUMENT_TYPE_PATTERNS:
+        m = regex.search(title)
+        if m:
+            found.append(doc_type)
+            result.evidence.append(_snippet(title, m))
+    # "bando di gara" accompagna spesso gli altri tipi: conta solo se è l'unico
+    specific = [t for t in found if t != "disciplinare"] or found
+    if len(specific) == 1:
+        result.document_type = specific[0]
+        result.confident = not (specific[0] != "disciplinare" and _disciplinare_heading(title))
+
+    for family, regex in _PROCEDURE_FAMILY_PATTERNS:
+        m = regex.search(title)
+        if m:
+            result.procedure_family = family
+            result.evidence.append(_snippet(title, m))
+            break
+    return result
+
+
+def _disciplinare_heading(title: str) -> bool:
+    """'Disciplinare di gara' come intestazione esplicita: il documento resta un disciplinare."""
+    return re.search(r"disciplinare\s+di\s+gara", title, re.I) is not None
@@ -0,0 +1,234 @@
+"""
+BidPilot — Document Result Cache  v1.0
+=======================================
+Cache dell'AnalysisResult per documento, indicizzata per hash del contenuto PDF.
+
+L'output di parse_pdf + analyze dipende solo dal PDF (e dal modello/template),
+non dal profilo aziendale. Con questa cache cambiare SOA/certificazioni/regioni
+nella sidebar ri-esegue solo evaluate_all + build_bando_card (puri, millisecondi).
+
+Due livelli:
+  - in-process: LRU in memoria, condivisa tra le sessioni Streamlit del processo
+  - su disco:   un file pickle per documento in <cache_dir>/documents/, con
+                eviction LRU (mtime, aggiornato a ogni lettura) limitata in
+                byte come ExtractionCache (BIDPILOT_DOCUMENT_CACHE_MAX_MB,
+                default 256)
+
+Chiave = sha256(bytes PDF) + modello + _PROMPT_VERSION + opzioni di retrieval
+(_ANALYSIS_OPTIONS: top_n, min_score, scorer, context_budget), le stesse che
+analyze_pdf passa a parse_pdf / reanalyze_pdf. Le altre opzioni di parse_pdf
+(grouped, pre_extract, classify) non sono esposte da analyze_pdf e restano ai
+default in entrambe le strade: non possono differire tra due voci.
+
+Ogni AnalysisResult calcolato qui porta il DocumentSnapshot del documento
+(hash per pagina, campi per categoria): con previous= una nuova versione
+dello stesso bando ri-estrae solo le categorie toccate (incremental.py).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Optional
+
+from src.analyzer import AnalysisResult, analyze
+from src.llm_cache import cache_dir
+from src.incremental import DocumentSnapshot, diff_snapshots, reanalyze_pdf
+from src.parser import _DEFAULT_CONTEXT_BUDGET, _PROMPT_VERSION, Progress, parse_pdf
+from src.tracing import span
+
+logger = logging.getLogger("bidpilot.document_cache")
+
+_DEFAULT_MEMORY_ITEMS = 32
+_DEFAULT_MAX_MB = 256
+
+# Opzioni di retrieval con cui analyze_pdf estrae (parte della chiave)
+_ANALYSIS_OPTIONS = {
+    "top_n_per_category": 6,
+    "min_score": 0.1,
+    "scorer": "log_tf",
+    "context_budget": _DEFAULT_CONTEXT_BUDGET,
+}
+
+
+# Versione dei campi di AnalysisResult nel pickle: cambia → i risultati vecchi non si rileggono
+_RESULT_FORMAT = 2
+
+
+def document_key(pdf_bytes: bytes, model: str, options: Optional[dict] = None) -> str:
+    """
+    Chiave di cache per un PDF: dipende dal contenuto, non dal nome file, e
+    dalle opzioni di retrieval (default _ANALYSIS_OPTIONS).
+    """
+    h = hashlib.sha256(pdf_bytes)
+    h.update(f"\x00{model}\x00{_PROMPT_VERSION}\x00{_RESULT_FORMAT}\x00".encode("utf-8"))
+    h.update(json.dumps(options or _ANALYSIS_OPTIONS, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _default_max_bytes() -> int:
+    return int(os.environ.get("BIDPILOT_DOCUMENT_CACHE_MAX_MB", _DEFAULT_MAX_MB)) * 1024 * 1024
+
+
+class DocumentCache:
+    """LRU in memoria + persistenza pickle su disco (LRU per mtime, max_bytes) per AnalysisResult."""
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        memory_items: int = _DEFAULT_MEMORY_ITEMS,
+        max_bytes: Optional[int] = None,
+    ):
+        self.directory = directory or os.path.join(cache_dir(), "documents")
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes if max_bytes is not None else _default_max_bytes()
+        self._memory: "OrderedDict[str, AnalysisResult]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[AnalysisResult]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except Exception as exc:
+            # Voce illeggibile (classi cambiate, file troncato): trattata come miss
+            logger.warning(f"DocumentCache: voce {key[:12]} non leggibile ({exc}), ignorata.")
+            return None
+        self._touch(path)
+        self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: AnalysisResult) -> None:
+        self._remember(key, result)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._evict(keep=key)
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        """Aggiorna l'mtime: è l'ordine LRU dell'eviction su disco."""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self, keep: str) -> None:
+        """Rimuove i file meno usati di recente finché la directory rientra in max_bytes."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".pkl"):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:   # rimosso da un altro processo
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.name[:-4]))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._memory.pop(key, None)
+            total -= size
+            evicted += 1
+        logger.debug(f"DocumentCache: rimosse {evicted} voci (LRU).")
+
+    def _remember(self, key: str, result: AnalysisResult) -> None:
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+
+_default_cache: Optional[DocumentCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_document_cache() -> DocumentCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = DocumentCache()
+    return _default_cache
+
+
+def analyze_pdf(
+    path: str,
+    api_key: Optional[str] = None,
+    model: str = "gpt-4o-mini",
+    use_cache: bool = True,
+    cache: Optional[DocumentCache] = None,
+    on_progress: Optional[Progress] = None,
+    previous: Optional[DocumentSnapshot] = None,
+) -> AnalysisResult:
+    """
+    parse_pdf + analyze con cache per contenuto del PDF.
+    Lo stesso file (anche rinominato o ri-caricato) non viene mai ri-estratto.
+    on_progress: avanzamento di parse_pdf; da cache un solo evento {"stage": "cache"}.
+    previous: snapshot della versione precedente → ri-analisi incrementale
+    (result.diff); in cache il risultato va senza diff, che vale solo rispetto a
+    previous: su un hit il diff è ricalcolato dagli snapshot (diff_snapshots).
+    """
+    if not use_cache:
+        return _analyze(path, api_key, model, on_progress, previous)
+
+    cache = cache or get_default_document_cache()
+    with span("document_cache.lookup") as s:
+        with open(path, "rb") as f:
+            key = document_key(f.read(), model)
+        result = cache.get(key)
+        s.set(hit=result is not None)
+    if result is not None:
+        logger.info(f"analyze_pdf: {path} servito dalla cache documenti ({key[:12]}).")
+        if on_progress is not None:
+            on_progress({"stage": "cache", "hit": True, "document_key": key})
+        if previous is not None and result.snapshot is not None:
+            result = replace(result, diff=diff_snapshots(result.snapshot, previous))
+        return result
+
+    result = _analyze(path, api_key, model, on_progress, previous)
+    cache.put(key, replace(result, diff=None))
+    return result
+
+
+def _analyze(
+    path: str,
+    api_key: Optional[str],
+    model: str,
+    on_progress: Optional[Progress],
+    previous: Optional[DocumentSnapshot],
+) -> AnalysisResult:
+    if previous is not None:
+        return reanalyze_pdf(path, previous, model=model, api_key=api_key, on_progress=on_progress,
+                             **_ANALYSIS_OPTIONS)
+    doc = parse_pdf(path, model=model, api_key=api_key, on_progress=on_progress, **_ANALYSIS_OPTIONS)
+    result = analyze(doc)
+    result.snapshot = DocumentSnapshot.from_parsed(doc, model)
+    return result
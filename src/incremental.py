@@ -0,0 +1,300 @@
+"""
+BidPilot — Ri-analisi incrementale  v1.0
+=========================================
+Le stazioni appaltanti pubblicano spesso rettifiche del disciplinare in cui
+cambiano poche pagine. Invece di ripagare l'intera pipeline:
+
+  1. ogni analisi conserva un DocumentSnapshot: hash per pagina, campi
+     grezzi per categoria e hash dei chunk che ogni categoria ha letto
+  2. la nuova versione viene confrontata pagina per pagina (per contenuto:
+     una pagina inserita non rende "modificate" quelle che seguono)
+  3. per ogni categoria si rifà il retrieval (gratuito) sulla nuova versione:
+     se legge gli stessi chunk di prima i suoi campi vengono riusati, se un
+     chunk è cambiato la categoria viene ri-estratta; lo stesso per i metadati
+     (chunk di apertura). Pre-estrazione e classificazione sono ricalcolate.
+  4. VersionDiff riporta pagine modificate, categorie ri-estratte/riusate e
+     categorie con campi diversi, che la BandoCard evidenzia.
+
+Il confronto vale solo tra analisi con lo stesso modello e _PROMPT_VERSION;
+altrimenti tutte le categorie sono ri-estratte (il diff delle pagine resta).
+Se meno di min_unchanged delle pagine è invariato si tratta di un altro
+documento: analisi completa, nessun diff.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src.analyzer import AnalysisResult, analyze
+from src.parser import (
+    _CATEGORY_SCHEMA,
+    _DEFAULT_CONTEXT_BUDGET,
+    _DEFAULT_LLM_RETRIES,
+    _DEFAULT_LLM_TIMEOUT,
+    _DEFAULT_MAX_WORKERS,
+    _PROMPT_VERSION,
+    ParsedDocument,
+    Progress,
+    _chunk_pdf,
+    _deep_merge,
+    _ExtractionRun,
+    _LLMOptions,
+    _parsed_document,
+    _resolve_api_key,
+    _resolve_cache,
+    _run_extraction,
+)
+from src.llm_cache import ExtractionCache
+from src.retrieval import Chunk, ExtractionTrace, Retriever, build_trace
+from src.tracing import traced
+
+logger = logging.getLogger("bidpilot.incremental")
+
+_DEFAULT_MIN_UNCHANGED = 0.5
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def page_hashes(chunks: List[Chunk], pages_count: int) -> List[str]:
+    """Hash del testo chunkato di ogni pagina (pagine senza testo incluse)."""
+    pages: Dict[int, List[str]] = {}
+    for c in chunks:
+        pages.setdefault(c.page, []).append(c.text)
+    total = max(pages_count, max(pages, default=-1) + 1)
+    return [_hash("\n".join(pages.get(p, []))) for p in range(total)]
+
+
+def diff_pages(old: List[str], new: List[str]) -> Tuple[List[int], int]:
+    """
+    Pagine (1-based) della nuova versione assenti nella precedente e numero
+    di pagine precedenti eliminate (non sostituite da una nuova o modificata).
+    Confronto per contenuto, non per posizione.
+    """
+    available = Counter(old)
+    changed = []
+    for i, h in enumerate(new):
+        if available[h] > 0:
+            available[h] -= 1
+        else:
+            changed.append(i + 1)
+    return changed, max(0, sum(available.values()) - len(changed))
+
+
+def _meta_chunks(chunks: List[Chunk]) -> List[Chunk]:
+    return chunks[:max(2, len(chunks) // 5)]   # come _extract_meta
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SNAPSHOT + DIFF
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class DocumentSnapshot:
+    """Quanto serve di un'analisi per ri-analizzarne una nuova versione."""
+    model: str
+    page_hashes: List[str]
+    category_fields: Dict[str, dict]          # campi grezzi per categoria, "meta" inclusa
+    chunk_hashes: Dict[str, List[str]]        # categoria → hash dei chunk letti (estrazioni LLM riuscite o riusate)
+    prompt_version: str = _PROMPT_VERSION
+
+    @classmethod
+    def from_parsed(cls, doc: ParsedDocument, model: str) -> "DocumentSnapshot":
+        text = {c.chunk_id: c.text for c in doc.chunks}
+        traces = [doc.trace_for(c) for c in ["meta", *_CATEGORY_SCHEMA]]
+        chunk_hashes = {
+            t.category: [_hash(text[cid]) for cid in t.top_chunks if cid in text]
+            for t in traces
+            if t is not None and t.method in ("llm", "reused") and not t.error
+        }
+        return cls(
+            model=model,
+            page_hashes=page_hashes(doc.chunks, doc.pages_count),
+            category_fields=dict(doc.category_fields),
+            chunk_hashes=chunk_hashes,
+        )
+
+
+@dataclass
+class VersionDiff:
+    """Differenze di una nuova versione rispetto all'analisi precedente."""
+    changed_pages: List[int]                  # pagine (1-based) nuove o modificate
+    removed_pages: int                        # pagine della versione precedente eliminate
+    reextracted: List[str] = field(default_factory=list)
+    reused: List[str] = field(default_factory=list)
+    changed_categories: List[str] = field(default_factory=list)   # campi diversi dalla versione precedente
+
+    @property
+    def unchanged(self) -> bool:
+        return not (self.changed_pages or self.removed_pages or self.changed_categories)
+
+
+def _same_document(hashes: List[str], changed_pages: List[int], min_unchanged: float) -> bool:
+    return len(hashes) > 0 and 1 - len(changed_pages) / len(hashes) >= min_unchanged
+
+
+def _changed_categories(fields: Dict[str, dict], previous: Dict[str, dict]) -> List[str]:
+    return [c for c in ["meta", *_CATEGORY_SCHEMA] if fields.get(c, {}) != previous.get(c, {})]
+
+
+def diff_snapshots(
+    current: DocumentSnapshot,
+    previous: DocumentSnapshot,
+    min_unchanged: float = _DEFAULT_MIN_UNCHANGED,
+) -> Optional[VersionDiff]:
+    """
+    Diff tra due snapshot già calcolati (nuova versione servita dalla cache
+    documenti): solo hash e campi, nessuna estrazione → reextracted/reused vuoti.
+    None se è un documento diverso.
+    """
+    changed_pages, removed = diff_pages(previous.page_hashes, current.page_hashes)
+    if not _same_document(current.page_hashes, changed_pages, min_unchanged):
+        return None
+    return VersionDiff(
+        changed_pages=changed_pages, removed_pages=removed,
+        changed_categories=_changed_categories(current.category_fields, previous.category_fields),
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# RI-ANALISI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _reused_trace(category: str, chunks: List[Chunk], total: int, retriever: Optional[Retriever] = None,
+                  top_n: int = 6, min_score: float = 0.1) -> ExtractionTrace:
+    """Trace di una categoria riusata: chunk della nuova versione, 0 token."""
+    if retriever is None:   # metadati
+        trace = ExtractionTrace(
+            category=category, top_chunks=[c.chunk_id for c in chunks], top_scores=[0.0] * len(chunks),
+            top_pages=[c.page + 1 for c in chunks], total_available=total, tokens_sent=0,
+        )
+    else:
+        trace = build_trace(category, retriever.retrieve(category, top_n=top_n, min_score=min_score))
+        trace.tokens_sent = 0
+    trace.method = "reused"
+    return trace
+
+
+def _offset_progress(on_progress: Optional[Progress], offset: int, total: int) -> Optional[Progress]:
+    """Rinumera gli eventi di _run_extraction dopo quelli delle categorie riusate."""
+    if on_progress is None:
+        return None
+
+    def report(event: dict) -> None:
+        if event.get("stage") == "category":
+            event = {**event, "done": event["done"] + offset, "total": total}
+        on_progress(event)
+    return report
+
+
+@traced("reanalyze_pdf")
+def reanalyze_pdf(
+    path: str,
+    previous: DocumentSnapshot,
+    model: str = "gpt-4o-mini",
+    api_key: Optional[str] = None,
+    top_n_per_category: int = 6,
+    min_score: float = 0.1,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT,
+    retries: int = _DEFAULT_LLM_RETRIES,
+    use_cache: bool = True,
+    cache: Optional[ExtractionCache] = None,
+    scorer: str = "log_tf",
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+    pdf_workers: Optional[int] = None,
+    min_unchanged: float = _DEFAULT_MIN_UNCHANGED,
+    on_progress: Optional[Progress] = None,
+) -> AnalysisResult:
+    """
+    Come parse_pdf + analyze, riusando le categorie il cui contesto non è
+    cambiato rispetto a `previous`. Il risultato porta snapshot (per la
+    versione successiva) e diff (None se è un documento diverso).
+    """
+    llm = _LLMOptions(
+        model=model, api_key=_resolve_api_key(api_key, model), timeout=timeout, retries=retries,
+        cache=_resolve_cache(use_cache, cache),
+    )
+    path = str(Path(path).resolve())
+    logger.info(f"reanalyze_pdf: {path}")
+
+    chunks, pages_count = _chunk_pdf(path, pdf_workers)
+    if on_progress is not None:
+        on_progress({"stage": "pages", "pages": pages_count, "chunks": len(chunks)})
+    retriever = Retriever(chunks, scorer=scorer)
+    categories = list(_CATEGORY_SCHEMA.keys())
+    options = dict(top_n=top_n_per_category, min_score=min_score, max_workers=max_workers,
+                   context_budget=context_budget)
+
+    hashes = page_hashes(chunks, pages_count)
+    changed_pages, removed = diff_pages(previous.page_hashes, hashes)
+    same_document = _same_document(hashes, changed_pages, min_unchanged)
+    comparable = same_document and previous.model == model and previous.prompt_version == _PROMPT_VERSION
+
+    # Categorie che leggono gli stessi chunk di prima → campi riusati
+    reused: List[str] = []
+    if comparable:
+        text_hashes = {c.chunk_id: _hash(c.text) for c in chunks}
+        for cat in categories:
+            if cat not in previous.chunk_hashes:
+                continue
+            result = retriever.retrieve(cat, top_n=top_n_per_category, min_score=min_score)
+            if [text_hashes[sc.chunk.chunk_id] for sc in result.chunks] == previous.chunk_hashes[cat]:
+                reused.append(cat)
+        meta_chunks = _meta_chunks(chunks)
+        if previous.chunk_hashes.get("meta") == [_hash(c.text) for c in meta_chunks]:
+            reused.insert(0, "meta")
+    rerun = [c for c in categories if c not in reused]
+    logger.info(
+        f"  Pagine modificate {changed_pages or 'nessuna'}, {removed} rimosse: "
+        f"riuso {reused or 'nessuna categoria'}, ri-estrazione {rerun}."
+    )
+
+    total = len(categories) + 1
+    for i, cat in enumerate(reused, 1):
+        if on_progress is not None:
+            on_progress({"stage": "category", "category": cat, "method": "reused", "cache": None,
+                         "done": i, "total": total, "fields": previous.category_fields.get(cat, {})})
+    run = _run_extraction(
+        chunks, retriever, rerun, llm, extract_meta="meta" not in reused,
+        on_progress=_offset_progress(on_progress, len(reused), total), **options,
+    )
+
+    # Unione nell'ordine di _run_extraction: classificazione → metadati → pre-estrazione → categorie
+    fields = dict(run.category_fields)
+    traces = {t.category: t for t in run.traces}
+    for cat in reused:
+        fields[cat] = previous.category_fields.get(cat, {})
+    meta_trace = run.meta_trace
+    if "meta" in reused:
+        meta_trace = _reused_trace("meta", _meta_chunks(chunks), len(chunks))
+    for cat in reused:
+        if cat != "meta":
+            traces[cat] = _reused_trace(cat, chunks, len(chunks), retriever, top_n_per_category, min_score)
+
+    raw = run.classification.fields() if run.classification is not None else {}
+    raw = _deep_merge(raw, fields.get("meta", {}))
+    if run.pre_extraction is not None:
+        raw = _deep_merge(raw, run.pre_extraction.meta_fields())
+    for cat in categories:
+        raw = _deep_merge(raw, fields.get(cat, {}))
+
+    merged = _ExtractionRun(
+        raw_fields=raw, meta_trace=meta_trace, traces=[traces[c] for c in categories], prompt_groups=[],
+        pre_extraction=run.pre_extraction, classification=run.classification, category_fields=fields,
+    )
+    parsed = _parsed_document(merged, chunks, pages_count, path)
+    result = analyze(parsed)
+    result.snapshot = DocumentSnapshot.from_parsed(parsed, model)
+    if same_document:
+        result.diff = VersionDiff(
+            changed_pages=changed_pages, removed_pages=removed,
+            reextracted=([] if "meta" in reused else ["meta"]) + rerun, reused=reused,
+            changed_categories=_changed_categories(fields, previous.category_fields),
+        )
+    return result
@@ -0,0 +1,565 @@
+"""
+BidPilot — Job queue  v1.0
+===========================
+Coda persistente delle analisi, condivisa dal servizio HTTP (service.py) e
+dall'app Streamlit (analisi in background con avanzamento e annullamento).
+
+  JobStore     SQLite (come llm_cache): un job = input, stato, eventi di
+               avanzamento, risultato JSON o errore. Sopravvive ai riavvii:
+               i job "running" di un processo terminato tornano "queued".
+               Ogni job in esecuzione porta il processo che lo esegue
+               (owner = host:pid) e un heartbeat: i job di un processo
+               ancora vivo (es. il servizio mentre l'app riparte) non
+               vengono toccati.
+  JobQueue     pool di worker (thread) che prelevano i job in ordine di
+               arrivo; un solo processo "caldo" condivide backend LLM,
+               rate limiter, cache di estrazione e cache documenti.
+  analysis_runner()  il job di BidPilot: analyze_pdf (parse_pdf + analyze,
+               con cache per contenuto) → evaluate_all → build_bando_card
+               (+ DecisionReport).
+  partial_card()  BandoCard parziale dagli eventi di un job in corso: i
+               blocchi compaiono man mano che le categorie sono estratte.
+
+Stati: queued → running → done | failed | cancelled.
+L'annullamento è cooperativo: un job in coda viene annullato subito, uno in
+esecuzione al prossimo evento di avanzamento (JobCancelled): pagine estratte,
+categoria conclusa, valutazione. Le chiamate LLM non ancora partite saltano.
+
+Configurazione via env:
+  BIDPILOT_JOBS_DB   file SQLite della coda (default: <cache_dir>/jobs.sqlite)
+                     del servizio HTTP; l'app Streamlit usa un file proprio
+                     (app_jobs.sqlite): i suoi job dipendono dal context in memoria.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.analyzer import analyze
+from src.bando_card import BandoCard, build_bando_card
+from src.decision_engine import produce_decision_report
+from src.document_cache import DocumentCache, analyze_pdf, document_key
+from src.llm_cache import cache_dir
+from src.parser import _CATEGORY_SCHEMA, ParsedDocument, _deep_merge
+from src.profile_builder import MinimalProfile, build_from_json
+from src.requirements_engine import evaluate_all
+
+logger = logging.getLogger("bidpilot.jobs")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL_STATUSES = (DONE, FAILED, CANCELLED)
+_POLL_SECONDS = 1.0
+_HEARTBEAT_SECONDS = 10.0
+_STALE_SECONDS = 60.0    # senza heartbeat da più di così il processo owner è considerato morto
+
+
+class JobCancelled(Exception):
+    """Sollevata dal report di avanzamento quando il job è stato annullato."""
+
+
+def default_jobs_db() -> str:
+    return os.environ.get("BIDPILOT_JOBS_DB") or os.path.join(cache_dir(), "jobs.sqlite")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# STORE
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class Job:
+    """Un'analisi in coda, in corso o conclusa."""
+    id: str
+    status: str
+    input_path: str
+    options: Dict[str, Any] = field(default_factory=dict)
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    events: List[dict] = field(default_factory=list)   # avanzamento, in ordine
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    owner: Optional[str] = None          # "host:pid" del processo che lo esegue
+    heartbeat_at: Optional[float] = None
+    # solo in memoria, mai nello store: chiave API, profilo già costruito...
+    context: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+    def status_dict(self) -> dict:
+        """Stato senza il risultato (endpoint di polling)."""
+        out = asdict(self)
+        out.pop("result")
+        out.pop("context")
+        out["finished"] = self.finished
+        return out
+
+
+_COLUMNS = (
+    "id", "status", "input_path", "options", "created_at", "started_at",
+    "finished_at", "events", "result", "error", "cancel_requested", "owner", "heartbeat_at",
+)
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """
+    False solo se l'owner è certamente morto: pid inesistente sullo stesso
+    host. Altri host (o Windows, dove os.kill non sonda) → decide l'heartbeat.
+    """
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or os.name == "nt" or not pid.isdigit():
+        return True
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:   # es. PermissionError: esiste, di un altro utente
+        return True
+    return True
+
+
+class JobStore:
+    """Job su SQLite; tutte le transizioni di stato sono atomiche."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_jobs_db()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " input_path TEXT NOT NULL,"
+                " options TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " events TEXT NOT NULL DEFAULT '[]',"
+                " result TEXT,"
+                " error TEXT,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " owner TEXT,"
+                " heartbeat_at REAL)"
+            )
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in existing:   # store creato da una versione precedente
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+
+    @staticmethod
+    def _row_to_job(row: tuple) -> Job:
+        data = dict(zip(_COLUMNS, row))
+        return Job(
+            id=data["id"], status=data["status"], input_path=data["input_path"],
+            options=json.loads(data["options"]), created_at=data["created_at"],
+            started_at=data["started_at"], finished_at=data["finished_at"],
+            events=json.loads(data["events"]),
+            result=json.loads(data["result"]) if data["result"] else None,
+            error=data["error"], cancel_requested=bool(data["cancel_requested"]),
+            owner=data["owner"], heartbeat_at=data["heartbeat_at"],
+        )
+
+    def submit(self, input_path: str, options: Optional[dict] = None, job_id: Optional[str] = None) -> Job:
+        job = Job(
+            id=job_id or uuid.uuid4().hex, status=QUEUED, input_path=input_path,
+            options=options or {}, created_at=time.time(),
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs(id, status, input_path, options, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job.id, job.status, job.input_path, json.dumps(job.options, ensure_ascii=False), job.created_at),
+            )
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Job]:
+        query = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+        args: tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            args = (status,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(query, args + (limit,)).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def claim_next(self) -> Optional[Job]:
+        """
+        Primo job in coda → running, intestato a questo processo (owner).
+        Atomico anche tra processi sullo stesso file: l'UPDATE vale solo se
+        il job è ancora "queued"; se un altro processo l'ha preso tra SELECT
+        e UPDATE si riprova col successivo.
+        """
+        while True:
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                cur = self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, owner = ?, heartbeat_at = ?"
+                    " WHERE id = ? AND status = ?",
+                    (RUNNING, now, self.owner, now, row[0], QUEUED),
+                )
+            if cur.rowcount == 1:
+                return self.get(row[0])
+
+    def heartbeat(self, job_ids: List[str]) -> None:
+        """Rinnova heartbeat_at dei job che questo processo sta eseguendo."""
+        if not job_ids:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                [(now, job_id, self.owner, RUNNING) for job_id in job_ids],
+            )
+
+    def add_event(self, job_id: str, event: dict) -> bool:
+        """Accoda un evento di avanzamento; restituisce True se è stato chiesto l'annullamento."""
+        event = {"t": round(time.time(), 3), **event}
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT events, cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            events = json.loads(row[0])
+            events.append(event)
+            self._conn.execute(
+                "UPDATE jobs SET events = ? WHERE id = ?", (json.dumps(events, ensure_ascii=False), job_id)
+            )
+        return bool(row[1])
+
+    def finish(self, job_id: str, result: dict) -> None:
+        self._close(job_id, DONE, result=json.dumps(result, ensure_ascii=False, default=str))
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._close(job_id, FAILED, error=error)
+
+    def mark_cancelled(self, job_id: str) -> None:
+        self._close(job_id, CANCELLED)
+
+    def _close(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, time.time(), result, error, job_id),
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """Annulla subito un job in coda; per uno in esecuzione lo segnala al worker. Nuovo stato."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == QUEUED:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?", (CANCELLED, time.time(), job_id)
+                )
+                return CANCELLED
+            if row[0] == RUNNING:
+                self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return row[0]
+
+    def requeue_interrupted(self, stale_after: float = _STALE_SECONDS) -> int:
+        """
+        Job rimasti "running" da un processo terminato → di nuovo in coda.
+        Terminato = pid inesistente sullo stesso host (vedi _owner_alive) o
+        nessun heartbeat da stale_after secondi; i job di un processo vivo restano suoi.
+        """
+        limit = time.time() - stale_after
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, owner, heartbeat_at FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+            dead = [job_id for job_id, owner, beat in rows if not _owner_alive(owner) or (beat or 0) < limit]
+            requeued = 0
+            for job_id in dead:
+                requeued += self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL, events = '[]', owner = NULL,"
+                    " heartbeat_at = NULL WHERE id = ? AND status = ?",
+                    (QUEUED, job_id, RUNNING),
+                ).rowcount
+        return requeued
+
+
+def progress_summary(events: List[dict]) -> dict:
+    """
+    Eventi di un job → stato per la UI: fase corrente, pagine, categorie
+    concluse e frazione completata (0–1, pagine 10%, categorie 80%, valutazione 10%).
+    """
+    out: Dict[str, Any] = {"stage": "in coda", "pages": None, "categories": [], "total": 0, "fraction": 0.0}
+    for event in events:
+        stage = event.get("stage")
+        if stage == "analysis" and event.get("state") == "started":
+            out.update(stage="estrazione testo", fraction=0.02)
+        elif stage == "pages":
+            out.update(stage="estrazione campi", pages=event["pages"], fraction=0.1)
+        elif stage == "category":
+            out["categories"].append(event["category"])
+            out["total"] = event["total"]
+            out["fraction"] = 0.1 + 0.8 * event["done"] / max(event["total"], 1)
+        elif stage == "cache":
+            out.update(stage="dalla cache documenti", fraction=0.9)
+        elif stage == "analysis" and event.get("state") == "done":
+            out.update(stage="valutazione requisiti", fraction=0.9)
+        elif stage in ("evaluation", "decision_report"):
+            out.update(stage="conclusa", fraction=1.0)
+    return out
+
+
+def partial_fields(events: List[dict]) -> Tuple[dict, List[str]]:
+    """
+    Campi grezzi delle categorie già concluse (classificazione, metadati, poi
+    ordine dello schema, come il merge finale) + categorie concluse.
+    """
+    by_category = {e["category"]: e.get("fields") or {} for e in events if e.get("stage") == "category"}
+    order = ["meta", *_CATEGORY_SCHEMA]
+    raw: dict = {}
+    for event in events:
+        if event.get("stage") == "classification":
+            raw = _deep_merge(raw, event.get("fields") or {})
+    for category in order:
+        if category in by_category:
+            raw = _deep_merge(raw, by_category[category])
+    return raw, [c for c in order if c in by_category]
+
+
+def partial_card(events: List[dict], profile: MinimalProfile) -> Optional[BandoCard]:
+    """
+    BandoCard dalle categorie concluse finora; None prima della prima.
+    I blocchi che attendono altre categorie sono in card.pending_blocks.
+    """
+    raw, done = partial_fields(events)
+    if not done:
+        return None
+    skipped = [c for e in events if e.get("stage") == "classification" for c in e.get("skipped") or []]
+    doc = ParsedDocument(raw_fields=raw, chunks=[], traces=[], pages_count=0, source_path="<parziale>")
+    bando = analyze(doc).bando
+    return build_bando_card(
+        bando=bando, results=evaluate_all(bando, profile.company),
+        soa_profile_empty=not profile.has_soa_data, cert_profile_empty=not profile.has_cert_data,
+        pending_categories=[c for c in ["meta", *_CATEGORY_SCHEMA] if c not in done],
+        skipped_categories=skipped,
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# WORKER POOL
+# ══════════════════════════════════════════════════════════════════════════════
+
+# runner(job, report) → risultato JSON; report(evento) solleva JobCancelled se annullato
+Runner = Callable[[Job, Callable[[dict], None]], dict]
+
+
+class JobQueue:
+    """Worker che eseguono i job dello store con `runner`, in ordine di arrivo."""
+
+    def __init__(self, store: JobStore, runner: Runner, workers: int = 2):
+        self.store = store
+        self.runner = runner
+        self.workers = max(1, workers)
+        self._wake = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._contexts: Dict[str, Dict[str, Any]] = {}
+        self._running: set = set()
+        self._running_lock = threading.Lock()
+
+    def start(self) -> "JobQueue":
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            logger.info(f"Job queue: {requeued} job interrotti rimessi in coda.")
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"bidpilot-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        beat = threading.Thread(target=self._heartbeat_loop, name="bidpilot-job-heartbeat", daemon=True)
+        beat.start()
+        self._threads.append(beat)
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Nessun nuovo job; attende quelli in corso (al più timeout secondi per worker)."""
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def submit(
+        self,
+        input_path: str,
+        options: Optional[dict] = None,
+        job_id: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> Job:
+        """context: oggetti per il runner che non vanno persistiti (persi se il processo riparte)."""
+        job_id = job_id or uuid.uuid4().hex
+        if context:
+            self._contexts[job_id] = context
+        job = self.store.submit(input_path, options, job_id)
+        with self._wake:
+            self._wake.notify()
+        return job
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        status = self.store.request_cancel(job_id)
+        if status == CANCELLED:
+            self._contexts.pop(job_id, None)
+        return status
+
+    def _loop(self) -> None:
+        while not self._stopping.is_set():
+            job = self.store.claim_next()
+            if job is None:
+                with self._wake:
+                    self._wake.wait(_POLL_SECONDS)   # anche job inseriti da un altro processo
+                continue
+            self._run(job)
+
+    def _heartbeat_loop(self) -> None:
+        """Heartbeat dei job in corso; intanto riprende quelli di processi morti nel frattempo."""
+        while not self._stopping.wait(_HEARTBEAT_SECONDS):
+            with self._running_lock:
+                running = list(self._running)
+            try:
+                self.store.heartbeat(running)
+                if self.store.requeue_interrupted():
+                    with self._wake:
+                        self._wake.notify_all()
+            except sqlite3.Error as exc:
+                logger.warning(f"Job queue: heartbeat fallito — {exc}")
+
+    def _run(self, job: Job) -> None:
+        with self._running_lock:
+            self._running.add(job.id)
+        try:
+            self._execute(job)
+        finally:
+            with self._running_lock:
+                self._running.discard(job.id)
+
+    def _execute(self, job: Job) -> None:
+        job.context = self._contexts.pop(job.id, {})
+
+        def report(event: dict) -> None:
+            if self.store.add_event(job.id, event):
+                raise JobCancelled(job.id)
+
+        logger.info(f"Job {job.id[:8]}: avvio ({job.input_path}).")
+        try:
+            result = self.runner(job, report)
+        except JobCancelled:
+            logger.info(f"Job {job.id[:8]}: annullato.")
+            self.store.mark_cancelled(job.id)
+        except Exception as exc:
+            logger.exception(f"Job {job.id[:8]}: fallito.")
+            self.store.fail(job.id, f"{type(exc).__name__}: {exc}")
+        else:
+            self.store.finish(job.id, result)
+            logger.info(f"Job {job.id[:8]}: concluso.")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# JOB DI ANALISI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def analysis_runner(
+    profile_dict: dict,
+    api_key: Optional[str] = None,
+    model: str = "gpt-4o-mini",
+    use_cache: bool = True,
+    document_cache: Optional[DocumentCache] = None,
+    require_context: bool = False,
+) -> Runner:
+    """
+    Runner di BidPilot: PDF → BandoCard + DecisionReport (JSON).
+    options del job: "model" e "profile" (dict profilo_azienda) sovrascrivono
+    i default del servizio; "decision_report": False lo salta.
+    context del job: "api_key" e "profile" (MinimalProfile) dalla sessione che
+    lo ha inviato, "previous" (DocumentSnapshot) per ri-analizzare una nuova
+    versione dello stesso bando (result["changes"]). Il risultato riporta document_key: con use_cache l'analisi
+    completa (AnalysisResult) resta nella cache documenti sotto quella chiave.
+
+    Con require_context=True un job senza context (processo riavviato: il
+    context non è persistito) fallisce invece di girare con la chiave da env
+    e il profilo di default.
+    """
+    def run(job: Job, report: Callable[[dict], None]) -> dict:
+        if require_context and not job.context:
+            raise RuntimeError(
+                "Sessione dell'analisi non più disponibile (app riavviata): ricaricare il PDF."
+            )
+        options = job.options
+        job_model = options.get("model") or model
+        profile = job.context.get("profile") or build_from_json(options.get("profile") or profile_dict)
+
+        report({"stage": "analysis", "state": "started"})
+        analysis = analyze_pdf(
+            job.input_path, api_key=job.context.get("api_key") or api_key, model=job_model,
+            use_cache=use_cache, cache=document_cache, on_progress=report,
+            previous=job.context.get("previous"),
+        )
+        report({"stage": "analysis", "state": "done", "violations": len(analysis.violations)})
+
+        results = evaluate_all(analysis.bando, profile.company)
+        diff = analysis.diff
+        card = build_bando_card(
+            bando=analysis.bando, results=results,
+            soa_profile_empty=not profile.has_soa_data, cert_profile_empty=not profile.has_cert_data,
+            changed_categories=diff.changed_categories if diff else None,
+            changed_pages=diff.changed_pages if diff else None,
+            skipped_categories=analysis.skipped_categories,
+        )
+        report({"stage": "evaluation", "state": "done", "requirements": len(results)})
+
+        with open(job.input_path, "rb") as f:
+            key = document_key(f.read(), job_model)
+        out = {
+            "document_key": key,
+            "card": asdict(card),
+            "violations": [asdict(v) for v in analysis.violations],
+            "warnings": list(analysis.warnings),
+            "changes": asdict(diff) if diff else None,
+        }
+        if options.get("decision_report", True):
+            out["decision_report"] = produce_decision_report(analysis.bando, profile.company).model_dump(mode="json")
+            report({"stage": "decision_report", "state": "done"})
+        return out
+
+    return run
@@ -0,0 +1,320 @@
+"""
+BidPilot — JSON Repair  v1.0
+=============================
+Parsing tollerante delle risposte LLM. Prima un JSON leggermente rotto
+faceva perdere l'intera categoria (ValueError → {}), e l'utente doveva
+rilanciare l'analisi a pagamento. Qui, in ordine:
+
+  1. json.loads diretto (caso normale)
+  2. testo prima/dopo il JSON ("Ecco il risultato: {...} Spero sia utile")
+  3. normalizzazione in un passaggio, attenta alle stringhe:
+     virgole finali, virgole mancanti tra elementi, virgolette non escapate
+     dentro i valori, a capo letterali nelle stringhe, True/False/None
+  4. JSON troncato: chiude stringa e parentesi aperte; se non basta taglia
+     l'ultimo elemento parziale e riprova
+
+Se nulla funziona → MalformedJSONError (sottoclasse di ValueError, porta la
+risposta grezza): il parser fa UN solo re-prompt mirato come ultima risorsa.
+
+conform_to_schema() allinea poi i tipi allo schema della categoria
+(liste, booleani, importi) senza scartare chiavi sconosciute.
+
+Contatori di processo (parsed / repaired / failed / reprompt_ok /
+reprompt_failed) in json_repair_stats().
+"""
+from __future__ import annotations
+
+import json
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.pre_extract import parse_italian_amount
+
+logger = logging.getLogger("bidpilot.json_repair")
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.MULTILINE)
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_WORD_RE = re.compile(r"[A-Za-z_]+")
+_MAX_TRUNCATION_CUTS = 20
+
+
+class MalformedJSONError(ValueError):
+    """JSON non riparabile localmente; raw = risposta originale dell'LLM."""
+
+    def __init__(self, message: str, raw: str):
+        super().__init__(message)
+        self.raw = raw
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CONTATORI
+# ══════════════════════════════════════════════════════════════════════════════
+
+_EVENTS = ("parsed", "repaired", "failed", "reprompt_ok", "reprompt_failed")
+_stats: Dict[str, int] = dict.fromkeys(_EVENTS, 0)
+_stats_lock = threading.Lock()
+
+
+def record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def json_repair_stats() -> Dict[str, float]:
+    """Contatori + tassi di riparazione locale e di re-prompt sulle risposte ricevute."""
+    with _stats_lock:
+        out: Dict[str, float] = dict(_stats)
+    total = out["parsed"] + out["repaired"] + out["failed"]
+    out["repair_rate"] = round(out["repaired"] / total, 4) if total else 0.0
+    out["reprompt_rate"] = round((out["reprompt_ok"] + out["reprompt_failed"]) / total, 4) if total else 0.0
+    return out
+
+
+def reset_json_repair_stats() -> None:
+    with _stats_lock:
+        for event in _EVENTS:
+            _stats[event] = 0
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PARSING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def parse_llm_json(raw: str) -> Any:
+    """JSON della risposta LLM, riparato se necessario. Raises MalformedJSONError."""
+    text = _FENCE_RE.sub("", raw.strip()).strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as exc:
+        first_error = exc
+    else:
+        record("parsed")
+        return data
+
+    data, fixes = repair_json(text)
+    if data is None:
+        record("failed")
+        raise MalformedJSONError(f"LLM non ha restituito JSON valido: {first_error}", raw=raw)
+    record("repaired")
+    logger.info(f"JSON riparato localmente ({', '.join(fixes)}).")
+    return data
+
+
+def repair_json(text: str) -> Tuple[Optional[Any], List[str]]:
+    """(dati, riparazioni applicate); dati=None se il testo non è riparabile."""
+    fixes: List[str] = []
+    starts = [p for p in (text.find("{"), text.find("[")) if p >= 0]
+    if not starts:
+        return None, fixes
+    start = min(starts)
+    if start > 0:
+        fixes.append("testo prima del JSON")
+    text = text[start:]
+
+    data = _raw_decode(text, fixes)
+    if data is not None:
+        return data, fixes
+
+    text, normalized = _normalize(text)
+    fixes.extend(normalized)
+    data = _raw_decode(text, fixes)
+    if data is not None:
+        return data, fixes
+
+    data = _close_truncated(text)
+    if data is not None:
+        fixes.append("JSON troncato chiuso")
+        return data, fixes
+    return None, fixes
+
+
+def _raw_decode(text: str, fixes: List[str]) -> Optional[Any]:
+    """Primo valore JSON del testo; il resto (prosa dopo il JSON) viene ignorato."""
+    try:
+        data, end = json.JSONDecoder().raw_decode(text)
+    except json.JSONDecodeError:
+        return None
+    if text[end:].strip():
+        fixes.append("testo dopo il JSON")
+    return data
+
+
+def _next_significant(text: str, i: int) -> Tuple[str, bool]:
+    """(primo carattere non spazio da i, c'è un a capo prima)."""
+    newline = False
+    while i < len(text) and text[i] in " \t\r\n":
+        newline = newline or text[i] == "\n"
+        i += 1
+    return (text[i] if i < len(text) else ""), newline
+
+
+def _normalize(text: str) -> Tuple[str, List[str]]:
+    """Un passaggio carattere per carattere, distinguendo dentro/fuori stringa."""
+    out: List[str] = []
+    fixes: List[str] = []
+    in_str = False
+    last = ""          # ultimo carattere significativo emesso fuori stringa
+    i, n = 0, len(text)
+
+    def fix(name: str) -> None:
+        if name not in fixes:
+            fixes.append(name)
+
+    while i < n:
+        ch = text[i]
+        if in_str:
+            if ch == "\\" and i + 1 < n:
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == '"':
+                nxt, newline = _next_significant(text, i + 1)
+                if nxt in ("", ",", "}", "]", ":") or newline:
+                    in_str = False
+                    last = '"'
+                    out.append(ch)
+                else:
+                    fix("virgolette non escapate")
+                    out.append('\\"')
+            elif ch == "\n":
+                fix("a capo nelle stringhe")
+                out.append("\\n")
+            elif ch == "\t":
+                out.append("\\t")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in '"{[' and (last in ('"', "}", "]") or last.isalnum()):
+            fix("virgole mancanti")
+            out.append(",")
+        if ch == '"':
+            in_str = True
+            out.append(ch)
+        elif ch == ",":
+            nxt, _ = _next_significant(text, i + 1)
+            if nxt in ("}", "]"):
+                fix("virgole finali")
+            else:
+                out.append(ch)
+                last = ch
+        elif ch.isascii() and ch.isalpha() and not (i > 0 and text[i - 1].isalnum()):
+            word = _WORD_RE.match(text, i).group(0)
+            i += len(word)
+            if word in _PY_LITERALS:
+                fix("letterali Python")
+                word = _PY_LITERALS[word]
+            out.append(word)
+            last = word[-1]
+            continue
+        else:
+            out.append(ch)
+            if not ch.isspace():
+                last = ch
+        i += 1
+    return "".join(out), fixes
+
+
+def _scan(text: str) -> Tuple[List[str], bool, List[int]]:
+    """(parentesi aperte, stringa aperta, posizioni delle virgole fuori stringa)."""
+    stack: List[str] = []
+    commas: List[int] = []
+    in_str = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_str:
+            if ch == "\\":
+                i += 1
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+        elif ch == ",":
+            commas.append(i)
+        i += 1
+    return stack, in_str, commas
+
+
+def _close_truncated(text: str) -> Optional[Any]:
+    """Chiude stringa e parentesi aperte; se non basta taglia all'ultima virgola e riprova."""
+    for _ in range(_MAX_TRUNCATION_CUTS):
+        stack, in_str, commas = _scan(text)
+        candidate = text + ('"' if in_str else "")
+        candidate = candidate.rstrip().rstrip(",")
+        if candidate.endswith(":"):
+            candidate += " null"
+        candidate += "".join(reversed(stack))
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+        if not commas:
+            return None
+        text = text[:commas[-1]]
+    return None
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# VALIDAZIONE SU SCHEMA
+# ══════════════════════════════════════════════════════════════════════════════
+
+_TRUE = {"true", "yes", "sì", "si", "1"}
+_FALSE = {"false", "no", "0"}
+# '450.000' / '1.234.567,89': punto delle migliaia, non decimale
+_ITALIAN_AMOUNT_RE = re.compile(r"^-?\d{1,3}(?:\.\d{3})+(?:,\d+)?$")
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """'€ 1.234,56' / '€ 450.000' / '1234.56' / 1234 → float; non numerico → None."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    s = re.sub(r"[^\d,.\-]", "", value)
+    if _ITALIAN_AMOUNT_RE.match(s):
+        return parse_italian_amount(s)
+    if "," in s:
+        s = s.replace(".", "").replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def conform_to_schema(fields: Any, schema: Dict[str, Any]) -> dict:
+    """
+    Allinea i tipi dei campi noti allo schema (descrizioni di _CATEGORY_SCHEMA):
+    liste di oggetti, liste di stringhe, booleani "true/false", importi float.
+    Le chiavi fuori schema restano invariate. Raises ValueError se non è un oggetto.
+    """
+    if isinstance(fields, list) and len(fields) == 1 and isinstance(fields[0], dict):
+        fields = fields[0]
+    if not isinstance(fields, dict):
+        raise ValueError(f"Risposta LLM non è un oggetto JSON: {type(fields).__name__}")
+    out = dict(fields)
+    for key, spec in schema.items():
+        if key not in out or out[key] is None:
+            continue
+        value = out[key]
+        if isinstance(spec, list):   # lista di oggetti (scadenze, soa_richieste)
+            items = value if isinstance(value, list) else [value]
+            out[key] = [item for item in items if isinstance(item, dict)]
+        elif "lista" in spec:
+            if isinstance(value, str):
+                out[key] = [value] if value.strip() else []
+            elif not isinstance(value, list):
+                out[key] = []
+        elif spec.startswith("true/false") and isinstance(value, str):
+            low = value.strip().lower()
+            out[key] = True if low in _TRUE else False if low in _FALSE else None
+        elif "float" in spec and not isinstance(value, (int, float)):
+            out[key] = _to_float(value)
+    return out
@@ -0,0 +1,133 @@
+"""
+BidPilot — Extraction Cache  v1.0
+==================================
+Cache persistente delle risposte LLM per categoria.
+
+Chiave = sha256(modello, versione template prompt, categoria, contesto recuperato).
+Se il contesto di una categoria non cambia (ri-upload dello stesso disciplinare,
+modifica del profilo, rettifica che tocca altre pagine) la risposta viene
+riletta da disco invece di ripagare la chiamata.
+
+Storage: un file SQLite con eviction LRU limitata in byte (max_bytes).
+Si memorizzano solo risposte JSON valide: gli errori non vengono mai cachati.
+
+Configurazione via env:
+  BIDPILOT_CACHE_DIR        directory della cache (default: data/cache)
+  BIDPILOT_CACHE_MAX_MB     dimensione massima su disco (default: 64)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger("bidpilot.llm_cache")
+
+_DEFAULT_CACHE_DIR = os.path.join("data", "cache")
+_DEFAULT_MAX_MB = 64
+
+
+def cache_dir() -> str:
+    """Directory radice delle cache su disco (condivisa con document_cache)."""
+    return os.environ.get("BIDPILOT_CACHE_DIR") or _DEFAULT_CACHE_DIR
+
+
+class ExtractionCache:
+    """Cache LRU su SQLite: chiave hex → risposta JSON (dict)."""
+
+    def __init__(self, path: str, max_bytes: int = _DEFAULT_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_access ON extractions(last_access)"
+            )
+
+    @staticmethod
+    def make_key(model: str, prompt_version: str, category: str, context: str) -> str:
+        h = hashlib.sha256()
+        for part in (model, prompt_version, category, context):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE extractions SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+        return json.loads(row[0])
+
+    def put(self, key: str, value: dict) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions(key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, size, time.time()),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """Rimuove le voci meno usate di recente finché la cache rientra in max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM extractions ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.debug(f"ExtractionCache: rimosse {evicted} voci (LRU).")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM extractions")
+
+
+_default_cache: Optional[ExtractionCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> ExtractionCache:
+    """Cache di processo in <cache_dir>/extractions.sqlite, creata al primo uso."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            max_mb = int(os.environ.get("BIDPILOT_CACHE_MAX_MB", _DEFAULT_MAX_MB))
+            _default_cache = ExtractionCache(
+                os.path.join(cache_dir(), "extractions.sqlite"),
+                max_bytes=max_mb * 1024 * 1024,
+            )
+    return _default_cache
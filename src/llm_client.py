@@ -0,0 +1,258 @@
+"""
+BidPilot — LLM Client Layer  v1.0
+==================================
+Registry dei backend LLM condivisi a livello di processo.
+
+Prima ogni prompt creava un nuovo client OpenAI/Anthropic, cioè un nuovo pool
+HTTP e un nuovo handshake TLS. Qui un backend viene creato una sola volta per
+coppia (provider, api_key) e riusato da tutte le categorie, tutti i documenti
+e tutte le sessioni Streamlit dello stesso processo: le connessioni keep-alive
+restano aperte nel pool httpx del client. I retry interni degli SDK sono
+disattivati (max_retries=0): ogni nuovo tentativo passa dal rate limiter
+condiviso in parser._call_llm_with_retry.
+
+Provider:
+  - "openai"    → modelli gpt-* / o* (predefinito)
+  - "anthropic" → modelli claude-*
+  - "local"     → modelli local / local-*: stand-in offline, nessuna rete.
+                  Usato da test e benchmark; la risposta è prodotta da un
+                  `responder(prompt, model) -> str` configurabile.
+
+Nuovi provider (o stand-in diversi) si collegano con register_backend().
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("bidpilot.llm_client")
+
+# Dimensionamento del pool HTTP condiviso per client (keep-alive)
+_POOL_MAX_CONNECTIONS = 32
+_POOL_MAX_KEEPALIVE = 16
+_POOL_KEEPALIVE_EXPIRY = 120.0   # secondi
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TIPI
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class LLMUsage:
+    """Token riportati dal provider per una singola chiamata."""
+    input_tokens: int = 0      # prompt completo (istruzioni + schema + contesto), cache inclusa
+    output_tokens: int = 0
+    cached_tokens: int = 0     # quota di input_tokens servita dalla prompt cache del provider
+    estimated: bool = False    # True = stima locale (stand-in), non conteggio del provider
+
+
+@dataclass
+class LLMResponse:
+    """Risposta grezza di un backend: testo completo + modello che l'ha prodotto."""
+    text: str
+    model: str
+    usage: Optional[LLMUsage] = None   # None = il provider non ha riportato l'utilizzo
+
+
+def _http_client() -> Any:
+    """
+    httpx.Client con limiti di pool espliciti, condiviso dal client SDK.
+    Restituisce None se httpx non è disponibile (l'SDK usa il suo default).
+    """
+    try:
+        import httpx  # type: ignore
+    except ModuleNotFoundError:
+        return None
+    return httpx.Client(limits=httpx.Limits(
+        max_connections=_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=_POOL_KEEPALIVE_EXPIRY,
+    ))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# BACKEND
+# ══════════════════════════════════════════════════════════════════════════════
+
+class OpenAIBackend:
+    """Client OpenAI persistente (chat completions in modalità JSON)."""
+
+    def __init__(self, api_key: Optional[str]):
+        try:
+            from openai import OpenAI  # type: ignore
+        except ModuleNotFoundError as exc:
+            raise RuntimeError(
+                "Dipendenza mancante: modulo 'openai' non installato. "
+                "Installa i requirements del progetto (es. `pip install -r requirements.txt`)."
+            ) from exc
+        kwargs: Dict[str, Any] = {"api_key": api_key, "max_retries": 0}   # retry solo in _call_llm_with_retry
+        http_client = _http_client()
+        if http_client is not None:
+            kwargs["http_client"] = http_client
+        self._client = OpenAI(**kwargs)
+
+    def complete(self, prompt: str, model: str, timeout: Optional[float] = None) -> LLMResponse:
+        client = self._client.with_options(timeout=timeout) if timeout is not None else self._client
+        response = client.chat.completions.create(
+            model=model,
+            temperature=0,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": "Rispondi sempre e solo con JSON valido."},
+                {"role": "user", "content": prompt},
+            ],
+        )
+        return LLMResponse(
+            text=response.choices[0].message.content or "", model=model, usage=_openai_usage(response),
+        )
+
+
+class AnthropicBackend:
+    """Client Anthropic persistente (messages API)."""
+
+    def __init__(self, api_key: Optional[str]):
+        try:
+            import anthropic  # type: ignore
+        except ModuleNotFoundError as exc:
+            raise RuntimeError(
+                "Modello Claude richiesto ma modulo 'anthropic' non installato. "
+                "Installa `anthropic` o usa un modello OpenAI (es. gpt-4o-mini)."
+            ) from exc
+        kwargs: Dict[str, Any] = {"api_key": api_key, "max_retries": 0}   # retry solo in _call_llm_with_retry
+        http_client = _http_client()
+        if http_client is not None:
+            kwargs["http_client"] = http_client
+        self._client = anthropic.Anthropic(**kwargs)
+
+    def complete(self, prompt: str, model: str, timeout: Optional[float] = None) -> LLMResponse:
+        client = self._client.with_options(timeout=timeout) if timeout is not None else self._client
+        message = client.messages.create(
+            model=model,
+            max_tokens=2048,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        return LLMResponse(text=message.content[0].text, model=model, usage=_anthropic_usage(message))
+
+
+def _openai_usage(response: Any) -> Optional[LLMUsage]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return LLMUsage(
+        input_tokens=usage.prompt_tokens or 0,
+        output_tokens=usage.completion_tokens or 0,
+        cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+    )
+
+
+def _anthropic_usage(message: Any) -> Optional[LLMUsage]:
+    """input_tokens di Anthropic esclude letture e scritture della cache: qui sono sommate."""
+    usage = getattr(message, "usage", None)
+    if usage is None:
+        return None
+    cached = getattr(usage, "cache_read_input_tokens", 0) or 0
+    created = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    return LLMUsage(
+        input_tokens=(usage.input_tokens or 0) + cached + created,
+        output_tokens=usage.output_tokens or 0,
+        cached_tokens=cached,
+    )
+
+
+def _empty_responder(prompt: str, model: str) -> str:
+    return "{}"
+
+
+class LocalBackend:
+    """
+    Stand-in offline: nessuna rete, nessuna API key.
+    `responder(prompt, model)` produce il testo della risposta; `latency`
+    (secondi) simula il tempo di rete per benchmark realistici.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        responder: Optional[Callable[[str, str], str]] = None,
+        latency: float = 0.0,
+    ):
+        self.responder = responder or _empty_responder
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def complete(self, prompt: str, model: str, timeout: Optional[float] = None) -> LLMResponse:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.responder(prompt, model)
+        # stima 4 caratteri/token: lo stand-in non ha un tokenizer
+        usage = LLMUsage(input_tokens=len(prompt) // 4, output_tokens=len(text) // 4, estimated=True)
+        return LLMResponse(text=text, model=model, usage=usage)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# REGISTRY
+# ══════════════════════════════════════════════════════════════════════════════
+
+_BACKEND_FACTORIES: Dict[str, Callable[[Optional[str]], Any]] = {
+    "openai": OpenAIBackend,
+    "anthropic": AnthropicBackend,
+    "local": LocalBackend,
+}
+
+_backends: Dict[Tuple[str, Optional[str]], Any] = {}
+_backends_lock = threading.Lock()
+
+
+def provider_for_model(model: str) -> str:
+    """Deduce il provider dal nome del modello."""
+    if model.startswith("claude"):
+        return "anthropic"
+    if model == "local" or model.startswith("local-"):
+        return "local"
+    return "openai"
+
+
+def register_backend(provider: str, factory: Callable[[Optional[str]], Any]) -> None:
+    """
+    Registra (o sostituisce) la factory di un provider.
+    factory(api_key) deve restituire un oggetto con complete(prompt, model, timeout).
+    Le istanze già create per quel provider vengono scartate.
+    """
+    with _backends_lock:
+        _BACKEND_FACTORIES[provider] = factory
+        for key in [k for k in _backends if k[0] == provider]:
+            del _backends[key]
+
+
+def get_backend(provider: str, api_key: Optional[str]) -> Any:
+    """
+    Restituisce il backend condiviso per (provider, api_key), creandolo al
+    primo uso. Thread-safe: le estrazioni concorrenti ottengono la stessa istanza.
+    """
+    key = (provider, api_key)
+    backend = _backends.get(key)
+    if backend is not None:
+        return backend
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            factory = _BACKEND_FACTORIES.get(provider)
+            if factory is None:
+                raise ValueError(f"Provider LLM sconosciuto: '{provider}'.")
+            backend = factory(api_key)
+            _backends[key] = backend
+            logger.debug(f"Creato backend LLM condiviso per provider '{provider}'.")
+    return backend
+
+
+def reset_backends() -> None:
+    """Chiude il registry (test / cambio configurazione): i backend verranno ricreati."""
+    with _backends_lock:
+        _backends.clear()
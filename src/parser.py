@@ -9,36 +9,72 @@ Implementa:
 
 Flusso:
   parse_pdf(path) → ParsedDocument
-    ├─ _extract_pages(path)        → List[str] (testo per pagina)
+    ├─ _extract_pages(path)        → List[str] (testo per pagina, range in parallelo)
     ├─ chunk_by_page(pages)        → List[Chunk]
     ├─ Retriever(chunks)
-    ├─ per categoria → retrieve → build_context_string
+    ├─ classify_document(chunks)   → tipo documento; salta le categorie non usate a valle
+    ├─ per categoria → retrieve → pack_context (budget di token, context_packer.py)
     ├─ _llm_extract_category(category, context) → dict parziale
     └─ _merge_extractions(parts)   → BandoRequisiti (raw, pre-guardrail)
 
+Ogni chiamata passa dalla cache di estrazione (llm_cache.py): stesso modello,
+stesso template e stesso contesto → risposta riletta da disco, nessun costo.
+Le chiamate effettive passano dal rate limiter condiviso del provider
+(rate_limiter.py: RPM/TPM, cooldown sui 429, retry con jitter).
+
+Le chiamate LLM (metadati + una per categoria) sono indipendenti tra loro:
+_run_extraction le esegue in un pool di thread limitato (max_workers) e le
+unisce sempre nell'ordine di _CATEGORY_SCHEMA, così il risultato non dipende
+da quale chiamata termina prima.
+
+Modalità grouped (opt-in): le categorie che recuperano gli stessi chunk
+(es. tabella SOA/importi) condividono un solo prompt con schema unito, così
+ogni chunk è pagato una volta; se il JSON non è valido si torna ai prompt
+per categoria. Il risparmio è in ParsedDocument.grouping_tokens_saved.
+
+Modalità stream (opt-in, parse_pdf(stream=True)): le pagine escono dal
+backend PDF a blocchi, vengono chunkate e indicizzate incrementalmente e la
+chiamata dei metadati parte appena è pronto il primo 20% delle pagine:
+estrazione (I/O + CPU) e rete si sovrappongono invece di susseguirsi.
+
 Il documento ParsedDocument porta anche le ExtractionTrace per il debug.
+Con BIDPILOT_TRACE attivo ogni fase emette uno span di temporizzazione (tracing.py).
 """
 from __future__ import annotations
 
 import json
 import logging
 import os
-import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from src.retrieval import (
     Chunk,
     ExtractionTrace,
     Retriever,
     RetrievalResult,
-    build_context_string,
+    ScoredChunk,
     build_trace,
     chunk_by_page,
     chunk_full_text,
+    chunk_page,
     CATEGORY_KEYWORDS,
 )
+from src.context_packer import count_tokens, pack_context
+from src.llm_cache import ExtractionCache, get_default_cache
+from src.llm_client import LLMUsage, get_backend, provider_for_model
+from src.doc_classifier import DocumentClass, classify_document
+from src.json_repair import MalformedJSONError, conform_to_schema, parse_llm_json
+from src.json_repair import record as record_json_event
+from src.pre_extract import SCAN_GROUPS, PreExtraction, pre_extract_fields
+from src.pricing import estimate_cost
+from src.rate_limiter import backoff_delay, get_limiter, is_rate_limit, is_retryable, retry_after
+from src.tracing import span, traced
 
 logger = logging.getLogger("bidpilot.parser")
 
@@ -55,10 +91,88 @@ class ParsedDocument:
     traces: List[ExtractionTrace]     # A5: log di tracciamento per categoria
     pages_count: int
     source_path: str
+    meta_trace: Optional[ExtractionTrace] = None   # trace della chiamata metadati
+    prompt_groups: List[List[str]] = field(default_factory=list)   # modalità grouped: categorie per prompt
+    grouping_tokens_saved: int = 0                 # token risparmiati dai prompt raggruppati
+    pre_extraction: Optional[PreExtraction] = None # candidati regex (CIG, CUP, CPV, importi, date)
+    classification: Optional[DocumentClass] = None # tipo documento dalle pagine di apertura
+    category_fields: Dict[str, dict] = field(default_factory=dict)  # campi grezzi per categoria (+ "meta")
 
     def trace_for(self, category: str) -> Optional[ExtractionTrace]:
+        if category == "meta":
+            return self.meta_trace
         return next((t for t in self.traces if t.category == category), None)
 
+    def _all_traces(self) -> List[ExtractionTrace]:
+        return ([self.meta_trace] if self.meta_trace else []) + self.traces
+
+    @property
+    def cache_hits(self) -> int:
+        """Chiamate LLM evitate grazie alla cache di estrazione."""
+        return sum(1 for t in self._all_traces() if t.cache_status == "hit")
+
+    @property
+    def cache_misses(self) -> int:
+        """Chiamate LLM effettuate dopo una ricerca in cache senza esito."""
+        return sum(1 for t in self._all_traces() if t.cache_status == "miss")
+
+    @property
+    def tokens_sent(self) -> int:
+        """Token di contesto inviati all'LLM (metadati + categorie)."""
+        return sum(t.tokens_sent for t in self._all_traces())
+
+    @property
+    def tokens_saved(self) -> int:
+        """Token di contesto risparmiati dal context packer rispetto ai chunk interi."""
+        return sum(t.tokens_full - t.tokens_sent for t in self._all_traces() if t.tokens_full is not None)
+
+    @property
+    def input_tokens(self) -> int:
+        """Token di input riportati dal provider (prompt completi, retry e re-prompt inclusi)."""
+        return sum(t.input_tokens or 0 for t in self._all_traces())
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(t.output_tokens or 0 for t in self._all_traces())
+
+    @property
+    def cached_tokens(self) -> int:
+        """Token di input serviti dalla prompt cache del provider."""
+        return sum(t.cached_tokens or 0 for t in self._all_traces())
+
+    @property
+    def llm_calls(self) -> int:
+        """Richieste effettive al provider (le risposte dalla cache di estrazione non contano)."""
+        return sum(t.llm_calls for t in self._all_traces())
+
+    @property
+    def cost_usd(self) -> Optional[float]:
+        """Costo stimato del documento; None se nessuna chiamata ha un prezzo noto."""
+        costs = [t.cost_usd for t in self._all_traces() if t.cost_usd is not None]
+        return sum(costs) if costs else None
+
+    def usage_summary(self) -> dict:
+        """Utilizzo aggregato del documento (dimensionamento di capacità e budget)."""
+        cost = self.cost_usd
+        return {
+            "llm_calls": self.llm_calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "provider_latency_ms": round(sum(t.provider_latency_ms or 0.0 for t in self._all_traces()), 1),
+            "cost_usd": round(cost, 6) if cost is not None else None,
+        }
+
+    @property
+    def llm_calls_skipped(self) -> int:
+        """Categorie risolte dalla pre-estrazione deterministica (nessuna chiamata LLM)."""
+        return sum(1 for t in self.traces if t.method == "deterministic")
+
+    @property
+    def skipped_categories(self) -> List[str]:
+        """Categorie non estratte perché il tipo di documento non le usa a valle."""
+        return [t.category for t in self.traces if t.method == "skipped"]
+
     def traces_as_dict(self) -> List[dict]:
         return [t.to_dict() for t in self.traces]
 
@@ -67,60 +181,191 @@ class ParsedDocument:
 # PDF TEXT EXTRACTION
 # ══════════════════════════════════════════════════════════════════════════════
 
-def _extract_pages_pymupdf(path: str) -> Tuple[List[str], int]:
+# Estrazione parallela per range di pagine (ProcessPool: pdfplumber/PyMuPDF sono CPU-bound)
+_PDF_PARALLEL_MIN_PAGES = 40    # sotto questa soglia si estrae in serie (avvio processi > guadagno)
+_PDF_MIN_PAGES_PER_WORKER = 15
+_PDF_MAX_WORKERS = 8
+_STREAM_BATCH_PAGES = 8         # pagine per blocco nel parse in streaming
+
+
+def _page_count_pymupdf(path: str) -> int:
+    import fitz  # type: ignore
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def _extract_range_pymupdf(path: str, start: int, end: int) -> List[str]:
     """Usa PyMuPDF (fitz) — preferito per accuratezza su PDF complessi."""
     import fitz  # type: ignore
-    doc = fitz.open(path)
-    pages = []
-    for page in doc:
-        text = page.get_text("text", sort=True)
-        pages.append(text)
-    doc.close()
-    return pages, len(pages)
+    with fitz.open(path) as doc:
+        return [doc.load_page(i).get_text("text", sort=True) for i in range(start, end)]
 
 
-def _extract_pages_pdfplumber(path: str) -> Tuple[List[str], int]:
+def _page_count_pdfplumber(path: str) -> int:
+    import pdfplumber  # type: ignore
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def _extract_range_pdfplumber(path: str, start: int, end: int) -> List[str]:
     """Fallback: pdfplumber."""
     import pdfplumber  # type: ignore
-    pages = []
     with pdfplumber.open(path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-            pages.append(text)
-    return pages, len(pages)
+        return [pdf.pages[i].extract_text() or "" for i in range(start, end)]
 
 
-def _extract_pages_pypdf(path: str) -> Tuple[List[str], int]:
+def _page_count_pypdf(path: str) -> int:
+    from pypdf import PdfReader  # type: ignore
+    return len(PdfReader(path).pages)
+
+
+def _extract_range_pypdf(path: str, start: int, end: int) -> List[str]:
     """Fallback di ultima istanza: PyPDF2/pypdf."""
     from pypdf import PdfReader  # type: ignore
     reader = PdfReader(path)
-    pages = [page.extract_text() or "" for page in reader.pages]
-    return pages, len(pages)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+# (nome, conteggio pagine, estrazione range [start, end)) in ordine di preferenza.
+# Le funzioni sono top-level: vengono eseguite anche nei processi worker.
+_PDF_BACKENDS: List[Tuple[str, Any, Any]] = [
+    ("pymupdf", _page_count_pymupdf, _extract_range_pymupdf),
+    ("pdfplumber", _page_count_pdfplumber, _extract_range_pdfplumber),
+    ("pypdf", _page_count_pypdf, _extract_range_pypdf),
+]
+
+
+def _pdf_workers(requested: Optional[int], pages_count: int) -> int:
+    """Numero di processi: esplicito, oppure automatico da CPU e numero di pagine."""
+    if pages_count < _PDF_PARALLEL_MIN_PAGES:
+        return 1
+    if requested is not None:
+        return max(1, requested)
+    return max(1, min(os.cpu_count() or 1, _PDF_MAX_WORKERS, pages_count // _PDF_MIN_PAGES_PER_WORKER))
+
+
+def _extract_range_parallel(extract_range: Any, path: str, pages_count: int, workers: int) -> List[str]:
+    """
+    Ogni worker apre il file e estrae un range contiguo di pagine; i range
+    vengono riassemblati in ordine. Qualsiasi errore del pool → estrazione seriale.
+    """
+    step = -(-pages_count // workers)   # ceil
+    ranges = [(start, min(start + step, pages_count)) for start in range(0, pages_count, step)]
+    try:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            parts = list(pool.map(extract_range, [path] * len(ranges), *zip(*ranges)))
+    except Exception as exc:
+        logger.warning(f"Estrazione parallela non riuscita ({exc}); ripiego su estrazione seriale.")
+        return extract_range(path, 0, pages_count)
+    return [page for part in parts for page in part]
 
 
-def _extract_pages(path: str) -> Tuple[List[str], int]:
+@traced("_extract_pages")
+def _extract_pages(path: str, workers: Optional[int] = None) -> Tuple[List[str], int]:
     """
     Prova in ordine: PyMuPDF → pdfplumber → pypdf.
     Restituisce (pages, count) dove pages è lista di stringhe per pagina.
+
+    workers: processi per l'estrazione (None = automatico, 1 = seriale).
+    I file sotto _PDF_PARALLEL_MIN_PAGES pagine sono sempre estratti in serie.
+    """
+    for name, page_count, extract_range in _PDF_BACKENDS:
+        try:
+            pages_count = page_count(path)
+            n_workers = _pdf_workers(workers, pages_count)
+            if n_workers > 1:
+                logger.info(f"  Estrazione testo ({name}): {pages_count} pagine su {n_workers} processi.")
+                pages = _extract_range_parallel(extract_range, path, pages_count, n_workers)
+            else:
+                pages = extract_range(path, 0, pages_count)
+            return pages, pages_count
+        except ImportError:
+            continue
+        except Exception as exc:
+            logger.warning(f"Estrazione {name} fallita su {path}: {exc}")
+            continue
+    raise RuntimeError(
+        f"Impossibile estrarre testo da {path}: nessuna libreria PDF disponibile. "
+        "Installare PyMuPDF: pip install pymupdf"
+    )
+
+
+def _extract_range_fallback(path: str, start: int, end: int, skip: str) -> List[str]:
+    """Range [start, end) con i backend diversi da skip (errore a metà del parse in streaming)."""
+    for name, _, extract_range in _PDF_BACKENDS:
+        if name == skip:
+            continue
+        try:
+            return extract_range(path, start, end)
+        except ImportError:
+            continue
+        except Exception as exc:
+            logger.warning(f"Estrazione {name} fallita su {path} (pagine {start + 1}-{end}): {exc}")
+    raise RuntimeError(f"Impossibile estrarre le pagine {start + 1}-{end} da {path}.")
+
+
+def _stream_pages(path: str, workers: Optional[int] = None) -> Tuple[int, Iterator[Tuple[int, List[str]]]]:
     """
-    for fn in (_extract_pages_pymupdf, _extract_pages_pdfplumber, _extract_pages_pypdf):
+    Come _extract_pages, ma restituisce (pages_count, iteratore di (prima pagina, testi))
+    a blocchi di _STREAM_BATCH_PAGES pagine, in ordine: il chiamante può chunkare e
+    indicizzare le prime pagine mentre le successive sono ancora in estrazione.
+    Con più processi i blocchi sono estratti in parallelo e consegnati in ordine.
+    """
+    for name, page_count, extract_range in _PDF_BACKENDS:
         try:
-            return fn(path)
+            pages_count = page_count(path)
         except ImportError:
             continue
         except Exception as exc:
-            logger.warning(f"{fn.__name__} fallito su {path}: {exc}")
+            logger.warning(f"Estrazione {name} fallita su {path}: {exc}")
             continue
+        n_workers = _pdf_workers(workers, pages_count)
+        logger.info(f"  Estrazione testo in streaming ({name}): {pages_count} pagine, {n_workers} processi.")
+        return pages_count, _iter_batches(path, name, extract_range, pages_count, n_workers)
     raise RuntimeError(
         f"Impossibile estrarre testo da {path}: nessuna libreria PDF disponibile. "
         "Installare PyMuPDF: pip install pymupdf"
     )
 
 
+def _iter_batches(
+    path: str, name: str, extract_range: Any, pages_count: int, workers: int,
+) -> Iterator[Tuple[int, List[str]]]:
+    ranges = [
+        (start, min(start + _STREAM_BATCH_PAGES, pages_count))
+        for start in range(0, pages_count, _STREAM_BATCH_PAGES)
+    ]
+    if workers <= 1:
+        for start, end in ranges:
+            try:
+                yield start, extract_range(path, start, end)
+            except Exception as exc:
+                logger.warning(f"Estrazione {name} fallita su {path} (pagine {start + 1}-{end}): {exc}")
+                yield start, _extract_range_fallback(path, start, end, skip=name)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(extract_range, path, start, end) for start, end in ranges]
+        for (start, end), future in zip(ranges, futures):
+            try:
+                yield start, future.result()
+            except Exception as exc:
+                logger.warning(f"Estrazione {name} fallita su {path} (pagine {start + 1}-{end}): {exc}")
+                yield start, _extract_range_fallback(path, start, end, skip=name)
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # LLM CALLER
 # ══════════════════════════════════════════════════════════════════════════════
 
+# Parametri dell'estrazione concorrente (sovrascrivibili da parse_pdf / parse_text)
+_DEFAULT_MAX_WORKERS = 4        # chiamate LLM in volo contemporaneamente
+_DEFAULT_LLM_TIMEOUT = 60.0     # secondi per singola chiamata
+_DEFAULT_LLM_RETRIES = 1        # tentativi aggiuntivi su errori transitori
+_RETRY_BASE_DELAY = 1.0         # secondi; raddoppia a ogni tentativo (con jitter)
+_RATE_LIMIT_RETRIES = 5         # tentativi minimi su 429 (il cooldown è condiviso)
+_COMPLETION_TOKENS_ESTIMATE = 500   # token di risposta stimati per il bucket TPM
+_DEFAULT_CONTEXT_BUDGET = 2500  # token di contesto per categoria (None = chunk interi)
+
 # Mappa categoria → schema JSON atteso dall'LLM (subset di BandoRequisiti)
 # Usato per costruire il prompt di estrazione per categoria.
 _CATEGORY_SCHEMA: Dict[str, dict] = {
@@ -233,15 +478,38 @@ _META_SCHEMA = {
 }
 
 
+# Versione dei template di prompt: fa parte della chiave della cache di estrazione.
+# Va incrementata a ogni modifica di _build_*_prompt o degli schemi qui sopra.
+_PROMPT_VERSION = "2.0"
+_FIX_PROMPT_MAX_CHARS = 4_000   # risposta rotta riportata nel re-prompt
+
+
 def _build_extraction_prompt(category: str, context: str) -> str:
     """
     Costruisce il prompt per l'estrazione di una categoria.
     Regola centrale (B): se un campo evidence è null → il campo corrispondente DEVE essere null.
     """
     schema = _CATEGORY_SCHEMA.get(category, {})
-    schema_json = json.dumps(schema.get("fields", {}), ensure_ascii=False, indent=2)
     description = schema.get("description", f"Estrai le informazioni su '{category}'.")
+    return _render_extraction_prompt(description, schema.get("fields", {}), context)
+
+
+def _build_group_prompt(categories: List[str], context: str) -> str:
+    """
+    Prompt unico per più categorie che condividono i chunk: stesse regole,
+    schema = unione dei campi delle categorie (le chiavi non si sovrappongono).
+    """
+    description = "Estrai in un unico oggetto JSON le informazioni di queste categorie:\n" + "\n".join(
+        f"- {_CATEGORY_SCHEMA[c]['description']}" for c in categories
+    )
+    fields: Dict[str, Any] = {}
+    for c in categories:
+        fields.update(_CATEGORY_SCHEMA[c]["fields"])
+    return _render_extraction_prompt(description, fields, context)
+
 
+def _render_extraction_prompt(description: str, fields: Dict[str, Any], context: str) -> str:
+    schema_json = json.dumps(fields, ensure_ascii=False, indent=2)
     return f"""Sei un assistente specializzato nell'estrazione strutturata da bandi di gara italiani.
 
 ## TASK
@@ -266,6 +534,16 @@ def _build_extraction_prompt(category: str, context: str) -> str:
 ## OUTPUT (solo JSON, nessun markdown):"""
 
 
+def _build_fix_prompt(prompt: str, broken: str) -> str:
+    """Re-prompt di correzione: prompt originale + risposta non valida (troncata)."""
+    return f"""{prompt}
+
+ATTENZIONE: la tua risposta precedente non era JSON valido (malformata o troncata):
+{broken[:_FIX_PROMPT_MAX_CHARS]}
+
+Restituisci di nuovo la risposta COMPLETA come un unico oggetto JSON valido, senza testo aggiuntivo."""
+
+
 def _build_meta_prompt(context: str) -> str:
     schema_json = json.dumps(_META_SCHEMA["fields"], ensure_ascii=False, indent=2)
     return f"""Sei un assistente specializzato nell'estrazione strutturata da bandi di gara italiani.
@@ -287,119 +565,653 @@ def _build_meta_prompt(context: str) -> str:
 ## OUTPUT (solo JSON):"""
 
 
-def _call_llm(prompt: str, model: str, api_key: str) -> dict:
-    """
-    Chiama l'LLM e restituisce il JSON estratto.
-    Supporta Anthropic (modelli claude-*) e OpenAI (fallback/predefinito).
-    Raises ValueError se il JSON non è parsabile.
-    """
-    raw: str
+# Trace che raccoglie l'utilizzo delle chiamate del thread corrente: la
+# imposta _llm_extract, la aggiorna _call_llm (retry e re-prompt inclusi).
+_usage_local = threading.local()
+
+
+@contextmanager
+def _usage_trace(trace: ExtractionTrace) -> Iterator[ExtractionTrace]:
+    previous = getattr(_usage_local, "trace", None)
+    _usage_local.trace = trace
+    try:
+        yield trace
+    finally:
+        _usage_local.trace = previous
 
-    if model.startswith("claude"):
-        try:
-            import anthropic  # type: ignore
-        except ModuleNotFoundError as exc:
-            raise RuntimeError(
-                "Modello Claude richiesto ma modulo 'anthropic' non installato. "
-                "Installa `anthropic` o usa un modello OpenAI (es. gpt-4o-mini)."
-            ) from exc
-
-        client = anthropic.Anthropic(api_key=api_key)
-        message = client.messages.create(
-            model=model,
-            max_tokens=2048,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        raw = message.content[0].text.strip()
-    else:
-        try:
-            from openai import OpenAI  # type: ignore
-        except ModuleNotFoundError as exc:
-            raise RuntimeError(
-                "Dipendenza mancante: modulo 'openai' non installato. "
-                "Installa i requirements del progetto (es. `pip install -r requirements.txt`)."
-            ) from exc
-
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model,
-            temperature=0,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": "Rispondi sempre e solo con JSON valido."},
-                {"role": "user", "content": prompt},
-            ],
-        )
-        raw = (response.choices[0].message.content or "").strip()
 
-    # Rimuovi eventuali ```json ... ``` se il modello li aggiunge
-    raw = re.sub(r"^```(?:json)?\s*", "", raw, flags=re.MULTILINE)
-    raw = re.sub(r"\s*```$", "", raw, flags=re.MULTILINE)
-    raw = raw.strip()
+def _record_usage(usage: Optional[LLMUsage], latency_ms: float) -> None:
+    trace = getattr(_usage_local, "trace", None)
+    if trace is None:
+        return
+    trace.llm_calls += 1
+    trace.provider_latency_ms = (trace.provider_latency_ms or 0.0) + latency_ms
+    if usage is not None:
+        trace.input_tokens = (trace.input_tokens or 0) + usage.input_tokens
+        trace.output_tokens = (trace.output_tokens or 0) + usage.output_tokens
+        trace.cached_tokens = (trace.cached_tokens or 0) + usage.cached_tokens
 
+
+def _call_llm(prompt: str, model: str, api_key: str, timeout: Optional[float] = None) -> dict:
+    """
+    Chiama l'LLM e restituisce il JSON estratto.
+    Il provider (OpenAI, Anthropic claude-*, stand-in local-*) è scelto dal nome
+    del modello; il client è condiviso tramite il registry di llm_client.
+    timeout: secondi massimi per la singola richiesta (None = default del client).
+    Il JSON passa da json_repair (virgole, virgolette, troncamenti, prosa).
+    Raises MalformedJSONError (ValueError) se non è riparabile.
+    Token e latenza riportati dal provider vanno nella trace della chiamata
+    in corso nel thread (vedi _usage_trace), anche se il JSON è poi scartato.
+    """
+    backend = get_backend(provider_for_model(model), api_key)
+    started = time.perf_counter()
+    with span("_call_llm", model=model) as s:
+        response = backend.complete(prompt, model=model, timeout=timeout)
+        if response.usage is not None:
+            s.set(input_tokens=response.usage.input_tokens, output_tokens=response.usage.output_tokens)
+    _record_usage(response.usage, (time.perf_counter() - started) * 1000)
+    raw = response.text
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError as exc:
+        return parse_llm_json(raw)
+    except MalformedJSONError:
         logger.error(f"JSON non valido dall'LLM per prompt (troncato): {prompt[:200]}")
         logger.error(f"Risposta raw: {raw[:500]}")
-        raise ValueError(f"LLM non ha restituito JSON valido: {exc}") from exc
+        raise
+
+
+def _call_llm_with_retry(
+    prompt: str,
+    model: str,
+    api_key: str,
+    timeout: Optional[float] = None,
+    retries: int = _DEFAULT_LLM_RETRIES,
+) -> dict:
+    """
+    _call_llm attraverso il rate limiter condiviso del provider, con retry per
+    errori transitori (timeout, rete, 5xx) e backoff esponenziale con jitter;
+    le altre eccezioni (KeyError, TypeError, …) sono bug e non si ritentano.
+    Non ritenta su ValueError (JSON non valido: a temperature 0 la risposta
+    sarebbe la stessa), RuntimeError (dipendenza mancante) né sugli errori 4xx
+    non ritentabili (vedi rate_limiter.is_retryable).
+    Un 429 apre un cooldown condiviso (Retry-After se presente) e ha un budget
+    di tentativi proprio (almeno _RATE_LIMIT_RETRIES): sotto carico la
+    categoria attende il limite del provider invece di degradare a {}.
+    Dopo i tentativi falliti rilancia l'ultima eccezione.
+    """
+    limiter = get_limiter(provider_for_model(model), api_key)
+    tokens = count_tokens(prompt, model) + _COMPLETION_TOKENS_ESTIMATE
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        try:
+            result = _call_llm(prompt, model=model, api_key=api_key, timeout=timeout)
+        except (ValueError, RuntimeError):
+            raise
+        except Exception as exc:
+            rate_limited = is_rate_limit(exc)
+            budget = max(retries, _RATE_LIMIT_RETRIES) if rate_limited else retries
+            if not is_retryable(exc) or attempt >= budget:
+                limiter.record_failure()
+                raise
+            delay = backoff_delay(attempt, _RETRY_BASE_DELAY, retry_after(exc))
+            logger.warning(f"Chiamata LLM fallita ({exc}); nuovo tentativo tra {delay:.1f}s.")
+            if rate_limited:
+                limiter.record_rate_limited(delay)   # l'attesa avviene nel prossimo acquire
+            else:
+                limiter.record_retry()
+                time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.record_success()
+        return result
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # EXTRACTION PIPELINE
 # ══════════════════════════════════════════════════════════════════════════════
 
+@dataclass(frozen=True)
+class _LLMOptions:
+    """Parametri condivisi da tutte le chiamate LLM di un documento."""
+    model: str
+    api_key: str
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT
+    retries: int = _DEFAULT_LLM_RETRIES
+    cache: Optional[ExtractionCache] = None   # None = cache disabilitata
+
+
+def _llm_extract(
+    prompt: str,
+    cache_category: str,
+    context: str,
+    llm: _LLMOptions,
+    trace: ExtractionTrace,
+) -> dict:
+    """
+    Chiamata LLM passando dalla cache di estrazione (se attiva).
+    La chiave dipende da modello, _PROMPT_VERSION, categoria e contesto:
+    un contesto invariato non genera mai una seconda chiamata a pagamento.
+    Annota l'esito ("hit"/"miss") in trace.cache_status e, per le chiamate
+    effettive, token riportati dal provider, latenza e costo stimato.
+    """
+    trace.model = llm.model
+    key = None
+    if llm.cache is not None:
+        key = llm.cache.make_key(llm.model, _PROMPT_VERSION, cache_category, context)
+        cached = llm.cache.get(key)
+        if cached is not None:
+            trace.cache_status = "hit"
+            return cached
+        trace.cache_status = "miss"
+
+    call = dict(model=llm.model, api_key=llm.api_key, timeout=llm.timeout, retries=llm.retries)
+    started = time.perf_counter()
+    try:
+        with _usage_trace(trace), span("llm_extract", category=cache_category, model=llm.model):
+            try:
+                fields = _call_llm_with_retry(prompt, **call)
+            except MalformedJSONError as exc:
+                # Ultima risorsa: un solo re-prompt con la risposta rotta
+                logger.warning(f"'{cache_category}': JSON non riparabile, re-prompt di correzione.")
+                try:
+                    fields = _call_llm_with_retry(_build_fix_prompt(prompt, exc.raw), **call)
+                except ValueError:
+                    record_json_event("reprompt_failed")
+                    raise
+                record_json_event("reprompt_ok")
+    finally:
+        trace.latency_ms = (time.perf_counter() - started) * 1000
+        if trace.input_tokens is not None:
+            trace.cost_usd = estimate_cost(
+                llm.model, trace.input_tokens, trace.output_tokens or 0,
+                cached_tokens=trace.cached_tokens or 0,
+            )
+    fields = conform_to_schema(fields, _schema_fields(cache_category))
+    if key is not None:
+        llm.cache.put(key, fields)
+    return fields
+
+
+def _schema_fields(cache_category: str) -> Dict[str, Any]:
+    """Schema dei campi per categoria, "meta" o gruppo ("soa+importo")."""
+    if cache_category == "meta":
+        return _META_SCHEMA["fields"]
+    fields: Dict[str, Any] = {}
+    for cat in cache_category.split("+"):
+        fields.update(_CATEGORY_SCHEMA.get(cat, {}).get("fields", {}))
+    return fields
+
+
 def _extract_category(
     category: str,
     retriever: Retriever,
-    model: str,
-    api_key: str,
+    llm: _LLMOptions,
     top_n: int = 6,
     min_score: float = 0.1,
+    context_budget: Optional[int] = None,
 ) -> Tuple[dict, ExtractionTrace]:
     """
     Retrieval + LLM extraction per una singola categoria.
     Restituisce (fields_dict, trace).
     """
     result: RetrievalResult = retriever.retrieve(category, top_n=top_n, min_score=min_score)
-    trace = build_trace(category, result)
-
     if not result.chunks:
         logger.info(f"Categoria '{category}': nessun chunk rilevante trovato (score < {min_score}).")
+    return _extract_retrieved(category, result, llm, context_budget)
+
+
+def _extract_retrieved(
+    category: str,
+    result: RetrievalResult,
+    llm: _LLMOptions,
+    context_budget: Optional[int] = None,
+) -> Tuple[dict, ExtractionTrace]:
+    """
+    LLM extraction di una categoria a partire dal suo RetrievalResult.
+
+    Con context_budget il contesto è impacchettato dal context packer (finestre
+    attorno ai termini matchati); trace.tokens_sent/tokens_full ne riportano l'effetto.
+
+    Se la chiamata fallisce anche dopo i retry la categoria degrada a {}
+    (i campi restano None → UNKNOWN) e l'errore viene annotato nella trace.
+    """
+    trace = build_trace(category, result)
+    if not result.chunks:
         return {}, trace
 
-    context = build_context_string(result, include_chunk_id=True)
+    packed = pack_context(result, context_budget, model=llm.model)
+    context = packed.text
+    trace.tokens_sent = packed.tokens_sent
+    trace.tokens_full = packed.tokens_full
     prompt = _build_extraction_prompt(category, context)
 
     try:
-        fields = _call_llm(prompt, model=model, api_key=api_key)
+        fields = _llm_extract(prompt, category, context, llm, trace)
     except ValueError as exc:
         logger.warning(f"Categoria '{category}': LLM fallito — {exc}. Restituisco dict vuoto.")
         fields = {}
+    except RuntimeError:
+        raise
+    except Exception as exc:
+        logger.warning(f"Categoria '{category}': chiamata LLM non riuscita dopo {llm.retries + 1} tentativi — {exc}.")
+        trace.error = str(exc)
+        fields = {}
 
     return fields, trace
 
 
+# ── Modalità raggruppata: un prompt per categorie che condividono chunk ──────
+
+_GROUP_MIN_OVERLAP = 0.5      # quota dei chunk della categoria già presenti nel gruppo
+_GROUP_MAX_CATEGORIES = 3     # categorie massime per prompt (schema e risposta restano brevi)
+
+
+def _group_categories(results: Dict[str, RetrievalResult], categories: List[str]) -> List[List[str]]:
+    """
+    Raggruppa le categorie che condividono chunk (es. la tabella SOA/importi
+    recuperata da soa, importo e forme_partecipazione).
+    Greedy nell'ordine di categories: una categoria entra nel primo gruppo che
+    contiene già almeno _GROUP_MIN_OVERLAP dei suoi chunk. Le categorie senza
+    chunk o senza schema restano da sole.
+    """
+    groups: List[Tuple[List[str], set]] = []
+    for cat in categories:
+        ids = {sc.chunk.chunk_id for sc in results[cat].chunks}
+        target = None
+        if ids and cat in _CATEGORY_SCHEMA:
+            target = next(
+                (g for g in groups
+                 if g[1] and g[0][0] in _CATEGORY_SCHEMA and len(g[0]) < _GROUP_MAX_CATEGORIES
+                 and len(ids & g[1]) >= _GROUP_MIN_OVERLAP * len(ids)),
+                None,
+            )
+        if target is None:
+            groups.append(([cat], set(ids)))
+        else:
+            target[0].append(cat)
+            target[1].update(ids)
+    return [members for members, _ in groups]
+
+
+def _merge_results(group: List[str], results: Dict[str, RetrievalResult]) -> RetrievalResult:
+    """Unione dei chunk del gruppo, ognuno una sola volta (score massimo, termini uniti)."""
+    by_id: Dict[str, ScoredChunk] = {}
+    for cat in group:
+        for sc in results[cat].chunks:
+            seen = by_id.get(sc.chunk.chunk_id)
+            if seen is None:
+                by_id[sc.chunk.chunk_id] = ScoredChunk(sc.chunk, sc.score, list(sc.matched_terms))
+            else:
+                seen.score = max(seen.score, sc.score)
+                seen.matched_terms += [t for t in sc.matched_terms if t not in seen.matched_terms]
+    return RetrievalResult(
+        category="+".join(group),
+        chunks=sorted(by_id.values(), key=lambda x: x.chunk.char_start),
+        total_chunks_considered=results[group[0]].total_chunks_considered,
+    )
+
+
+def _split_group_fields(group: List[str], fields: dict) -> List[dict]:
+    """Ripartisce la risposta del gruppo per categoria secondo _CATEGORY_SCHEMA."""
+    parts = [{k: v for k, v in fields.items() if k in _CATEGORY_SCHEMA[c]["fields"]} for c in group]
+    known = {k for c in group for k in _CATEGORY_SCHEMA[c]["fields"]}
+    parts[0].update({k: v for k, v in fields.items() if k not in known})
+    return parts
+
+
+def _extract_group(
+    group: List[str],
+    results: Dict[str, RetrievalResult],
+    llm: _LLMOptions,
+    context_budget: Optional[int] = None,
+) -> Tuple[List[Tuple[dict, ExtractionTrace]], int]:
+    """
+    Una chiamata LLM per un gruppo di categorie: ogni chunk condiviso è inviato
+    una sola volta, con lo schema unito delle categorie.
+    Restituisce ([(fields, trace)] nell'ordine del gruppo, token risparmiati
+    rispetto ai prompt separati). Ogni categoria conserva la sua trace: il
+    primo membro porta i token inviati, gli altri 0; tutti hanno trace.group.
+
+    Se il JSON del gruppo non è valido si ripiega sui prompt per categoria
+    (i token del tentativo raggruppato sono contati come risparmio negativo).
+    """
+    if len(group) == 1:
+        return [_extract_retrieved(group[0], results[group[0]], llm, context_budget)], 0
+
+    budget = context_budget * len(group) if context_budget is not None else None
+    packed = pack_context(_merge_results(group, results), budget, model=llm.model)
+    traces: List[ExtractionTrace] = []
+    standalone = 0
+    for cat in group:
+        solo = pack_context(results[cat], context_budget, model=llm.model)
+        standalone += solo.tokens_sent
+        trace = build_trace(cat, results[cat])
+        trace.tokens_full = solo.tokens_full
+        trace.tokens_sent = 0
+        trace.group = list(group)
+        traces.append(trace)
+    leader = traces[0]
+    leader.tokens_sent = packed.tokens_sent
+    label = "+".join(group)
+
+    try:
+        fields = _llm_extract(_build_group_prompt(group, packed.text), label, packed.text, llm, leader)
+    except ValueError as exc:
+        logger.warning(f"Gruppo '{label}': JSON non valido ({exc}); ripiego sui prompt per categoria.")
+        return [_extract_retrieved(c, results[c], llm, context_budget) for c in group], -packed.tokens_sent
+    except RuntimeError:
+        raise
+    except Exception as exc:
+        logger.warning(f"Gruppo '{label}': chiamata LLM non riuscita dopo {llm.retries + 1} tentativi — {exc}.")
+        for trace in traces:
+            trace.error = str(exc)
+        return [({}, trace) for trace in traces], standalone - packed.tokens_sent
+
+    for trace in traces[1:]:
+        trace.cache_status = leader.cache_status
+    return list(zip(_split_group_fields(group, fields), traces)), standalone - packed.tokens_sent
+
+
+def _default_meta_count(chunks: List[Chunk]) -> int:
+    """Chunk di apertura letti per i metadati: il primo ~20% del documento."""
+    return max(2, len(chunks) // 5)
+
+
+def _pre_extract_scopes(
+    chunks: List[Chunk],
+    retriever: Retriever,
+    top_n: int,
+    min_score: float,
+) -> Dict[str, List[Chunk]]:
+    """
+    Chunk da scansionare per ogni gruppo della pre-estrazione: quelli che
+    l'LLM leggerebbe per la stessa categoria (retrieval) e, per CUP e CPV,
+    l'apertura del documento letta dai metadati. Tutti i gruppi vengono
+    scansionati a prescindere dalle categorie richieste, così la stessa
+    PreExtraction serve anche allo stadio 2 di screening.
+    """
+    scopes: Dict[str, List[Chunk]] = {"meta": chunks[:_default_meta_count(chunks)]}
+    for group in SCAN_GROUPS:
+        if group != "meta":
+            result = retriever.retrieve(group, top_n=top_n, min_score=min_score)
+            scopes[group] = [sc.chunk for sc in result.chunks]
+    return scopes
+
+
 def _extract_meta(
     chunks: List[Chunk],
-    model: str,
-    api_key: str,
-) -> dict:
+    llm: _LLMOptions,
+    n_meta: Optional[int] = None,
+) -> Tuple[dict, ExtractionTrace]:
     """
     Estrae i metadati generali dal primo ~20% dei chunk (apertura documento).
     Non usa retrieval: l'oggetto e la SA sono quasi sempre nell'intestazione.
+    Restituisce (fields_dict, trace) con trace.category == "meta".
+
+    n_meta: chunk da usare (default 20% di chunks); il parse in streaming
+    passa i chunk delle prime pagine prima che il documento sia completo.
     """
-    n_meta = max(2, len(chunks) // 5)
+    if n_meta is None:
+        n_meta = _default_meta_count(chunks)
     meta_chunks = chunks[:n_meta]
+    trace = ExtractionTrace(
+        category="meta",
+        top_chunks=[c.chunk_id for c in meta_chunks],
+        top_scores=[0.0] * len(meta_chunks),
+        top_pages=[c.page + 1 for c in meta_chunks],
+        total_available=len(chunks),
+        tokens_sent=sum(c.token_estimate for c in meta_chunks),
+    )
     context = "\n\n---\n\n".join(
         f"[CHUNK {c.chunk_id} | pagina {c.page + 1}]\n{c.text}"
         for c in meta_chunks
     )
     prompt = _build_meta_prompt(context)
     try:
-        return _call_llm(prompt, model=model, api_key=api_key)
+        return _llm_extract(prompt, "meta", context, llm, trace), trace
     except ValueError:
-        return {}
+        return {}, trace
+    except RuntimeError:
+        raise
+    except Exception as exc:
+        logger.warning(f"Metadati: chiamata LLM non riuscita dopo {llm.retries + 1} tentativi — {exc}.")
+        trace.error = str(exc)
+        return {}, trace
+
+
+@dataclass
+class _ExtractionRun:
+    """Esito di _run_extraction (campi uniti + trace + contabilità dei prompt)."""
+    raw_fields: dict
+    meta_trace: Optional[ExtractionTrace]
+    traces: List[ExtractionTrace]
+    prompt_groups: List[List[str]]
+    grouping_tokens_saved: int = 0
+    pre_extraction: Optional[PreExtraction] = None
+    classification: Optional[DocumentClass] = None
+    category_fields: Dict[str, dict] = field(default_factory=dict)   # per categoria, "meta" inclusa
+
+
+def _skipped_trace(category: str, total_chunks: int) -> ExtractionTrace:
+    """Trace di una categoria saltata dalla classificazione: nessun chunk, 0 token."""
+    return ExtractionTrace(
+        category=category, top_chunks=[], top_scores=[], top_pages=[],
+        total_available=total_chunks, tokens_sent=0, method="skipped",
+    )
+
+
+def _deterministic_trace(category: str, pre: PreExtraction, total_chunks: int) -> ExtractionTrace:
+    """Trace di una categoria risolta dalla pre-estrazione: chunk/pagine dell'evidence, 0 token."""
+    evidence = []
+    for m in pre.evidence_for(category):
+        if all(m.chunk_id != e.chunk_id for e in evidence):
+            evidence.append(m)
+    return ExtractionTrace(
+        category=category,
+        top_chunks=[m.chunk_id for m in evidence],
+        top_scores=[1.0] * len(evidence),
+        top_pages=[m.page for m in evidence],
+        total_available=total_chunks,
+        tokens_sent=0,
+        method="deterministic",
+    )
+
+
+# on_progress(evento): avanzamento per chi mostra l'analisi mentre procede
+# (jobs.py, app). Eventi: {"stage": "pages", ...} a testo estratto,
+# {"stage": "category", "category", "method", "done", "total", "fields"} per
+# categoria (fields = campi grezzi della sola categoria, per l'anteprima),
+# {"stage": "classification", "fields"} con i campi di DocumentClass.fields().
+# È sempre chiamato dal thread del chiamante: un'eccezione (es. job annullato)
+# interrompe l'estrazione e annulla le chiamate non ancora partite.
+Progress = Callable[[dict], None]
+
+
+def _await_jobs(
+    meta_future: Future,
+    group_futures: List[Future],
+    groups: List[List[str]],
+    report: Callable[[str, dict, Optional[ExtractionTrace]], None],
+) -> Tuple[Tuple[dict, Optional[ExtractionTrace]], List[Tuple[List[Tuple[dict, ExtractionTrace]], int]]]:
+    """Attende metadati e gruppi segnalando ognuno appena concluso; esiti nell'ordine originale."""
+    pending = {meta_future: None, **{f: i for i, f in enumerate(group_futures)}}
+    try:
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                if index is None:
+                    report("meta", *future.result())
+                else:
+                    for cat, (fields, trace) in zip(groups[index], future.result()[0]):
+                        report(cat, fields, trace)
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
+    return meta_future.result(), [f.result() for f in group_futures]
+
+
+@traced("_run_extraction")
+def _run_extraction(
+    chunks: List[Chunk],
+    retriever: Retriever,
+    categories: List[str],
+    llm: _LLMOptions,
+    top_n: int,
+    min_score: float,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+    grouped: bool = False,
+    pre_extract: bool = True,
+    pre_extraction: Optional[PreExtraction] = None,
+    classify: bool = True,
+    extract_meta: bool = True,
+    meta_future: Optional[Future] = None,
+    executor: Optional[Executor] = None,
+    on_progress: Optional[Progress] = None,
+) -> _ExtractionRun:
+    """
+    Esegue metadati + estrazione per categoria e unisce i risultati.
+
+    Con max_workers > 1 le chiamate LLM partono insieme (al più max_workers
+    in volo): la latenza del documento è circa quella della chiamata più lenta
+    invece della somma. Il merge avviene comunque nell'ordine deterministico
+    metadati → categories, identico all'esecuzione sequenziale.
+
+    Con grouped=True le categorie che condividono chunk sono estratte con un
+    solo prompt (vedi _extract_group); il merge resta per categoria.
+
+    Con pre_extract=True le categorie che la pre-estrazione regex risolve in
+    modo univoco (anac_cig, importo) non vanno all'LLM; CUP e CPV univoci
+    sovrascrivono quelli dei metadati. Le regex scansionano solo i chunk che
+    il retrieval seleziona per ciascuna categoria (vedi _pre_extract_scopes);
+    con pre_extraction si riusa una scansione già fatta sugli stessi chunk
+    (stadio 2 di screening) e pre_extract è ignorato.
+
+    Con classify=True le categorie che il tipo di documento non usa a valle
+    (es. SOA in una richiesta di preventivo) non vengono estratte: trace con
+    method="skipped" (vedi doc_classifier).
+
+    Con extract_meta=False non parte la chiamata dei metadati (meta_trace=None):
+    la usa la modalità a stadi di screening.py. Con meta_future i metadati
+    sono già stati avviati (parse in streaming) e se ne attende solo l'esito.
+
+    Con executor le chiamate vanno nel pool condiviso passato dal chiamante
+    (batch su più documenti: il pool limita le chiamate in volo di tutti i
+    documenti insieme) e max_workers è ignorato.
+
+    Con on_progress ogni categoria (e i metadati) viene segnalata appena
+    conclusa, nell'ordine di completamento (vedi Progress).
+    """
+    total = len(categories) + (1 if extract_meta or meta_future is not None else 0)
+    completed = 0
+
+    def _report(category: str, fields: dict, trace: Optional[ExtractionTrace]) -> None:
+        nonlocal completed
+        if trace is None or on_progress is None:
+            return
+        completed += 1
+        on_progress({
+            "stage": "category", "category": category, "method": trace.method,
+            "cache": trace.cache_status, "done": completed, "total": total, "fields": fields,
+        })
+
+    doc_class = classify_document(chunks) if classify else None
+    by_category: Dict[str, Tuple[dict, ExtractionTrace]] = {}
+    skipped = doc_class.skipped_categories(categories) if doc_class is not None else []
+    for cat in skipped:
+        by_category[cat] = ({}, _skipped_trace(cat, len(chunks)))
+    if skipped:
+        logger.info(f"  Documento '{doc_class.document_type}': categorie non usate a valle {skipped} saltate.")
+    if doc_class is not None and on_progress is not None:
+        on_progress({"stage": "classification", "fields": doc_class.fields(), "skipped": skipped})
+
+    pre = pre_extraction
+    if pre is None and pre_extract:
+        pre = pre_extract_fields(chunks, _pre_extract_scopes(chunks, retriever, top_n, min_score))
+    for cat in categories:
+        if cat in by_category:
+            continue
+        fields = pre.category_fields(cat) if pre is not None else None
+        if fields is not None:
+            by_category[cat] = (fields, _deterministic_trace(cat, pre, len(chunks)))
+    llm_categories = [cat for cat in categories if cat not in by_category]
+    if by_category:
+        logger.info(f"  Pre-estrazione deterministica: {list(by_category)} senza chiamata LLM.")
+    for cat, (fields, trace) in by_category.items():
+        _report(cat, fields, trace)
+
+    if grouped:
+        results = {cat: retriever.retrieve(cat, top_n=top_n, min_score=min_score) for cat in llm_categories}
+        groups = _group_categories(results, llm_categories)
+    else:
+        groups = [[cat] for cat in llm_categories]
+
+    def _group_job(group: List[str]) -> Tuple[List[Tuple[dict, ExtractionTrace]], int]:
+        logger.info(f"  Estrazione categoria: {'+'.join(group)}...")
+        if grouped:
+            return _extract_group(group, results, llm, context_budget=context_budget)
+        return [_extract_category(
+            group[0], retriever, llm, top_n=top_n, min_score=min_score, context_budget=context_budget,
+        )], 0
+
+    def _meta_job() -> Tuple[dict, Optional[ExtractionTrace]]:
+        if meta_future is not None:
+            return meta_future.result()
+        return _extract_meta(chunks, llm) if extract_meta else ({}, None)
+
+    if executor is not None:
+        meta_pending = executor.submit(_meta_job)
+        group_futures = [executor.submit(_group_job, g) for g in groups]
+        (meta_fields, meta_trace), group_results = _await_jobs(meta_pending, group_futures, groups, _report)
+    elif max_workers <= 1:
+        meta_fields, meta_trace = _meta_job()
+        _report("meta", meta_fields, meta_trace)
+        group_results = []
+        for g in groups:
+            group_results.append(_group_job(g))
+            for cat, (fields, trace) in zip(g, group_results[-1][0]):
+                _report(cat, fields, trace)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bidpilot-llm") as pool:
+            meta_future = pool.submit(_meta_job)
+            group_futures = [pool.submit(_group_job, g) for g in groups]
+            (meta_fields, meta_trace), group_results = _await_jobs(meta_future, group_futures, groups, _report)
+
+    saved = 0
+    for group, (outcomes, group_saved) in zip(groups, group_results):
+        by_category.update(zip(group, outcomes))
+        saved += group_saved
+
+    raw_fields = _deep_merge(doc_class.fields(), meta_fields) if doc_class is not None else meta_fields
+    if pre is not None:
+        raw_fields = _deep_merge(raw_fields, pre.meta_fields())
+    traces: List[ExtractionTrace] = []
+    for cat in categories:
+        cat_fields, trace = by_category[cat]
+        traces.append(trace)
+        raw_fields = _deep_merge(raw_fields, cat_fields)
+        logger.info(
+            f"    {trace.category} → {len(cat_fields)} campi estratti, "
+            f"{len(trace.top_chunks)} chunk usati, "
+            f"~{trace.tokens_sent} token"
+            + (f" (su {trace.tokens_full})" if trace.tokens_full and trace.tokens_full > trace.tokens_sent else "")
+            + (f" (prompt condiviso: {'+'.join(trace.group)})" if trace.group else "")
+            + (" (cache)" if trace.cache_status == "hit" else "")
+            + (" (deterministico)" if trace.method == "deterministic" else "")
+            + (" (saltata)" if trace.method == "skipped" else "")
+        )
+    if grouped:
+        logger.info(f"  Prompt raggruppati: {groups} — token risparmiati: {saved}")
+    category_fields = {cat: by_category[cat][0] for cat in categories}
+    if meta_trace is not None:
+        category_fields["meta"] = meta_fields
+    return _ExtractionRun(
+        raw_fields=raw_fields, meta_trace=meta_trace, traces=traces,
+        prompt_groups=groups if grouped else [], grouping_tokens_saved=saved,
+        pre_extraction=pre, classification=doc_class, category_fields=category_fields,
+    )
 
 
 def _deep_merge(base: dict, override: dict) -> dict:
@@ -423,6 +1235,87 @@ def _deep_merge(base: dict, override: dict) -> dict:
 # ENTRY POINT
 # ══════════════════════════════════════════════════════════════════════════════
 
+def _stream_extraction(
+    path: str,
+    categories: List[str],
+    llm: _LLMOptions,
+    scorer: str = "log_tf",
+    pdf_workers: Optional[int] = None,
+    **options: Any,
+) -> Tuple[List[Chunk], Retriever, int, _ExtractionRun]:
+    """
+    Parse in pipeline: i blocchi di pagine escono da _stream_pages e vengono
+    subito chunkati (chunk_page) e indicizzati (Retriever.add_chunks).
+    Appena è pronto il primo 20% delle pagine parte la chiamata dei metadati,
+    che procede in rete mentre il resto del PDF è ancora in estrazione;
+    le categorie partono a documento completo (il retrieval vede tutti i chunk).
+
+    Chunk, indice e categorie sono identici al parse non in streaming; il
+    contesto dei metadati sono i chunk del primo 20% delle pagine (invece del
+    20% dei chunk) e può quindi differire di qualche chunk.
+    """
+    pages_count, batches = _stream_pages(path, workers=pdf_workers)
+    meta_pages = max(1, -(-pages_count // 5))   # ceil(20%)
+    retriever = Retriever([], scorer=scorer)
+    texts: List[str] = []
+    offset = 0
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bidpilot-meta") as meta_pool:
+        meta_future: Optional[Future] = None
+        for start, batch in batches:
+            new_chunks: List[Chunk] = []
+            for i, text in enumerate(batch):
+                new_chunks.extend(chunk_page(start + i, text, offset))
+                offset += len(text) + 1
+            texts.extend(batch)
+            retriever.add_chunks(new_chunks)
+            if meta_future is None and len(texts) >= meta_pages:
+                meta_chunks = [c for c in retriever.chunks if c.page < meta_pages]
+                if len(meta_chunks) < 2:
+                    meta_chunks = retriever.chunks[:2]
+                if meta_chunks and len(texts) < pages_count:
+                    logger.info(
+                        f"  Metadati avviati dopo {len(texts)}/{pages_count} pagine "
+                        f"({len(meta_chunks)} chunk)."
+                    )
+                    meta_future = meta_pool.submit(
+                        _extract_meta, list(meta_chunks), llm, len(meta_chunks),
+                    )
+        logger.info(f"  Estratte {pages_count} pagine, generati {len(retriever.chunks)} chunk.")
+        if options.get("on_progress") is not None:
+            options["on_progress"]({"stage": "pages", "pages": pages_count, "chunks": len(retriever.chunks)})
+
+        if not retriever.chunks:
+            # Fallback su testo completo se chunk vuoti
+            retriever = Retriever(chunk_full_text("\n".join(texts)), scorer=scorer)
+        chunks = retriever.chunks
+        if meta_future is None:
+            meta_future = meta_pool.submit(_extract_meta, chunks, llm)
+        logger.info(f"  Estrazione {len(categories)} categorie (metadati già in volo)...")
+        run = _run_extraction(chunks, retriever, categories, llm, meta_future=meta_future, **options)
+    if run.meta_trace is not None:
+        run.meta_trace.total_available = len(chunks)
+    return chunks, retriever, pages_count, run
+
+
+def _resolve_api_key(api_key: Optional[str], model: str) -> str:
+    """API key esplicita o da env; lo stand-in locale non ne richiede una."""
+    api_key = api_key or os.environ.get("OPENAI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
+    if provider_for_model(model) == "local":
+        return api_key or "local"
+    if not api_key:
+        raise ValueError(
+            "API key non trovata. Passa api_key= o imposta OPENAI_API_KEY (o ANTHROPIC_API_KEY)."
+        )
+    return api_key
+
+
+def _resolve_cache(use_cache: bool, cache: Optional[ExtractionCache]) -> Optional[ExtractionCache]:
+    if not use_cache:
+        return None
+    return cache if cache is not None else get_default_cache()
+
+
+@traced("parse_pdf")
 def parse_pdf(
     path: str,
     model: str = "gpt-4o-mini",
@@ -430,6 +1323,19 @@ def parse_pdf(
     categories: Optional[List[str]] = None,
     top_n_per_category: int = 6,
     min_score: float = 0.1,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT,
+    retries: int = _DEFAULT_LLM_RETRIES,
+    use_cache: bool = True,
+    cache: Optional[ExtractionCache] = None,
+    scorer: str = "log_tf",
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+    grouped: bool = False,
+    pre_extract: bool = True,
+    pdf_workers: Optional[int] = None,
+    classify: bool = True,
+    stream: bool = False,
+    on_progress: Optional[Progress] = None,
 ) -> ParsedDocument:
     """
     Pipeline principale: PDF → ParsedDocument (raw fields + traces).
@@ -438,67 +1344,106 @@ def parse_pdf(
 
     Args:
         path: percorso al file PDF
-        model: modello LLM da usare (es. gpt-4o-mini o claude-*)
+        model: modello LLM da usare (es. gpt-4o-mini, claude-* o local per lo stand-in offline)
         api_key: API key provider (default: OPENAI_API_KEY, poi ANTHROPIC_API_KEY)
         categories: lista di categorie da estrarre (default: tutte)
         top_n_per_category: chunk massimi per categoria
         min_score: soglia minima di score per il retrieval
+        max_workers: chiamate LLM concorrenti (1 = sequenziale)
+        timeout: timeout in secondi per singola chiamata LLM
+        retries: tentativi aggiuntivi per chiamata su errori transitori
+        use_cache: False = bypass della cache di estrazione (ogni chiamata va all'LLM)
+        cache: istanza di ExtractionCache da usare (default: cache di processo su disco)
+        scorer: scorer del retrieval, "log_tf" (default) o "bm25" (vedi Retriever)
+        context_budget: token di contesto per categoria (None = chunk interi, nessun packing)
+        grouped: True = un solo prompt per le categorie che condividono chunk
+                 (fallback ai prompt per categoria se il JSON non è valido)
+        pre_extract: True = CIG/importi univoci estratti via regex senza chiamata LLM
+        pdf_workers: processi per l'estrazione del testo (None = automatico, 1 = seriale)
+        classify: True = salta le categorie che il tipo di documento non usa a valle
+        stream: True = parse in pipeline (vedi _stream_extraction): chunking e
+                indicizzazione procedono mentre le pagine vengono estratte e i
+                metadati partono appena è pronto il primo 20% delle pagine
+        on_progress: callback di avanzamento (pagine estratte, ogni categoria conclusa)
     """
-    api_key = api_key or os.environ.get("OPENAI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise ValueError(
-            "API key non trovata. Passa api_key= o imposta OPENAI_API_KEY (o ANTHROPIC_API_KEY)."
-        )
+    api_key = _resolve_api_key(api_key, model)
 
     path = str(Path(path).resolve())
     logger.info(f"parse_pdf: {path}")
 
-    # 1. Estrai testo per pagina
-    pages, pages_count = _extract_pages(path)
-    logger.info(f"  Estratte {pages_count} pagine.")
+    cats = categories or list(_CATEGORY_SCHEMA.keys())
+    llm = _LLMOptions(
+        model=model, api_key=api_key, timeout=timeout, retries=retries,
+        cache=_resolve_cache(use_cache, cache),
+    )
+    options = dict(
+        top_n=top_n_per_category, min_score=min_score, max_workers=max_workers,
+        context_budget=context_budget, grouped=grouped, pre_extract=pre_extract,
+        classify=classify, on_progress=on_progress,
+    )
+
+    if stream:
+        # 1-5 in pipeline: pagine → chunk → indice, metadati avviati sulle prime pagine
+        chunks, retriever, pages_count, run = _stream_extraction(
+            path, cats, llm, scorer=scorer, pdf_workers=pdf_workers, **options,
+        )
+        _log_index_stats(retriever)
+        return _parsed_document(run, chunks, pages_count, path)
+
+    # 1-2. Estrai testo per pagina + chunking
+    chunks, pages_count = _chunk_pdf(path, pdf_workers)
+    if on_progress is not None:
+        on_progress({"stage": "pages", "pages": pages_count, "chunks": len(chunks)})
+
+    # 3. Retrieval engine
+    retriever = Retriever(chunks, scorer=scorer)
+    _log_index_stats(retriever)
+
+    # 4-5. Metadati (prime pagine) + estrazione per categoria
+    logger.info(f"  Estrazione metadati + {len(cats)} categorie (max {max_workers} in parallelo)...")
+    run = _run_extraction(chunks, retriever, cats, llm, **options)
+
+    return _parsed_document(run, chunks, pages_count, path)
+
 
-    # 2. Chunking
+def _chunk_pdf(path: str, pdf_workers: Optional[int] = None) -> Tuple[List[Chunk], int]:
+    """Testo per pagina → chunk (fallback su testo completo se i chunk per pagina sono vuoti)."""
+    pages, pages_count = _extract_pages(path, workers=pdf_workers)
+    logger.info(f"  Estratte {pages_count} pagine.")
     chunks = chunk_by_page(pages)
     if not chunks:
         # Fallback su testo completo se chunk vuoti
         full_text = "\n".join(pages)
         chunks = chunk_full_text(full_text)
     logger.info(f"  Generati {len(chunks)} chunk.")
+    return chunks, pages_count
 
-    # 3. Retrieval engine
-    retriever = Retriever(chunks)
 
-    # 4. Metadati (senza retrieval, prime pagine)
-    logger.info("  Estrazione metadati (prime pagine)...")
-    raw_fields = _extract_meta(chunks, model=model, api_key=api_key)
+def _log_index_stats(retriever: Retriever) -> None:
+    stats = retriever.index_stats()
+    logger.info(
+        f"  Indice: {stats['terms']} termini, {stats['postings']} postings, "
+        f"{stats['memory_bytes'] // 1024} KiB ({stats['build_ms']} ms)."
+    )
 
-    # 5. Estrazione per categoria
-    cats = categories or list(_CATEGORY_SCHEMA.keys())
-    traces: List[ExtractionTrace] = []
-
-    for cat in cats:
-        logger.info(f"  Estrazione categoria: {cat}...")
-        cat_fields, trace = _extract_category(
-            cat, retriever, model=model, api_key=api_key,
-            top_n=top_n_per_category, min_score=min_score,
-        )
-        traces.append(trace)
-        raw_fields = _deep_merge(raw_fields, cat_fields)
-        logger.info(
-            f"    → {len(cat_fields)} campi estratti, "
-            f"{len(trace.top_chunks)} chunk usati, "
-            f"~{trace.tokens_sent} token"
-        )
 
+def _parsed_document(run: _ExtractionRun, chunks: List[Chunk], pages_count: int, path: str) -> ParsedDocument:
     return ParsedDocument(
-        raw_fields=raw_fields,
+        raw_fields=run.raw_fields,
         chunks=chunks,
-        traces=traces,
+        traces=run.traces,
         pages_count=pages_count,
         source_path=path,
+        meta_trace=run.meta_trace,
+        prompt_groups=run.prompt_groups,
+        grouping_tokens_saved=run.grouping_tokens_saved,
+        pre_extraction=run.pre_extraction,
+        classification=run.classification,
+        category_fields=run.category_fields,
     )
 
 
+@traced("parse_text")
 def parse_text(
     text: str,
     model: str = "gpt-4o-mini",
@@ -506,34 +1451,36 @@ def parse_text(
     categories: Optional[List[str]] = None,
     top_n_per_category: int = 6,
     min_score: float = 0.1,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT,
+    retries: int = _DEFAULT_LLM_RETRIES,
+    use_cache: bool = True,
+    cache: Optional[ExtractionCache] = None,
+    scorer: str = "log_tf",
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+    grouped: bool = False,
+    pre_extract: bool = True,
+    classify: bool = True,
 ) -> ParsedDocument:
     """
     Variante: accetta testo già estratto invece di un PDF.
     Usata nei test golden (evita dipendenza da file PDF reali).
     """
-    api_key = api_key or os.environ.get("OPENAI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise ValueError("API key non trovata (OPENAI_API_KEY / ANTHROPIC_API_KEY).")
+    api_key = _resolve_api_key(api_key, model)
 
     chunks = chunk_full_text(text)
-    retriever = Retriever(chunks)
-    raw_fields = _extract_meta(chunks, model=model, api_key=api_key)
+    retriever = Retriever(chunks, scorer=scorer)
 
     cats = categories or list(_CATEGORY_SCHEMA.keys())
-    traces: List[ExtractionTrace] = []
-
-    for cat in cats:
-        cat_fields, trace = _extract_category(
-            cat, retriever, model=model, api_key=api_key,
-            top_n=top_n_per_category, min_score=min_score,
-        )
-        traces.append(trace)
-        raw_fields = _deep_merge(raw_fields, cat_fields)
-
-    return ParsedDocument(
-        raw_fields=raw_fields,
-        chunks=chunks,
-        traces=traces,
-        pages_count=0,
-        source_path="<text>",
+    llm = _LLMOptions(
+        model=model, api_key=api_key, timeout=timeout, retries=retries,
+        cache=_resolve_cache(use_cache, cache),
+    )
+    run = _run_extraction(
+        chunks, retriever, cats, llm,
+        top_n=top_n_per_category, min_score=min_score, max_workers=max_workers,
+        context_budget=context_budget, grouped=grouped, pre_extract=pre_extract,
+        classify=classify,
     )
+
+    return _parsed_document(run, chunks, 0, "<text>")
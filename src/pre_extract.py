@@ -0,0 +1,279 @@
+"""
+BidPilot — Pre-estrazione deterministica  v1.0
+===============================================
+Estrae con regex compilate i campi con formato rigido, prima dell'LLM:
+
+  - CIG  (10 alfanumerici dopo "CIG" / "Codice Identificativo Gara")
+  - CUP  (15 caratteri dopo "CUP")
+  - CPV  (8 cifre + check digit dopo "CPV")
+  - importi in formato italiano ("€ 1.234.567,89", "450.000,00 euro")
+    classificati dall'etichetta più vicina che li precede nella stessa riga
+  - date (15/03/2027, 15 marzo 2027) con eventuale ora ("ore 12:00")
+
+Ogni valore porta evidence ESATTA (la riga del testo), pagina e offset nel
+documento. Se per una categoria il risultato è univoco (anac_cig, importo)
+parse_pdf non chiama l'LLM: la trace ha method="deterministic".
+Valori multipli discordanti (es. più lotti, più CIG) → ambiguo → LLM.
+
+Le date non bastano a saltare la categoria "scadenze" (tipo e obbligatorietà
+della scadenza richiedono il modello): sono esposte in PreExtraction.dates.
+
+Con scopes ogni gruppo di pattern (SCAN_GROUPS) scansiona solo i chunk che il
+retrieval seleziona per la sua categoria, cioè quelli che l'LLM leggerebbe al
+suo posto: su un disciplinare di 1000 pagine le regex toccano qualche decina
+di chunk invece di tutti. Univocità e ambiguità valgono quindi sullo stesso
+contesto della chiamata LLM che la pre-estrazione sostituisce.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from src.retrieval import Chunk
+from src.tracing import traced
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PATTERN
+# ══════════════════════════════════════════════════════════════════════════════
+
+_CIG_RE = re.compile(
+    r"(?:\bCIG\b|(?i:codice\s+identificativo\s+(?:di\s+)?gara))[^\n]{0,80}?\b((?=[A-Z]*\d)[A-Z0-9]{10})\b"
+)
+_CUP_RE = re.compile(r"\bCUP\b[^\n]{0,40}?\b([A-Z]\d{2}[A-Z][A-Z0-9]{11})\b")
+_CPV_RE = re.compile(r"\bCPV\b[^\n]{0,60}?\b(\d{8}-\d)\b")
+
+_AMOUNT = r"(\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+,\d{2})"
+_AMOUNT_RE = re.compile(
+    rf"(?:€|(?i:euro|eur)\b)\s*{_AMOUNT}|{_AMOUNT}\s*(?:€|(?i:euro)\b)"
+)
+# Etichette degli importi: la più vicina che precede l'importo nella stessa riga
+_AMOUNT_LABELS = [
+    ("oneri_sicurezza", re.compile(r"oneri\s+(?:\w+\s+){0,3}sicurezza", re.I)),
+    ("importo_base_gara", re.compile(
+        r"(?:importo\s+(?:\w+\s+){0,2})?(?:a|posto\s+a)\s+base\s+(?:di\s+gara|d['’]asta|dell['’]appalto)"
+        r"|base\s+d['’]asta", re.I)),
+    ("importo_lavori", re.compile(r"importo\s+(?:dei|per\s+i)\s+lavori", re.I)),
+    ("importo_totale", re.compile(r"importo\s+(?:complessivo|totale)", re.I)),
+]
+
+_MONTHS = {
+    "gennaio": 1, "febbraio": 2, "marzo": 3, "aprile": 4, "maggio": 5, "giugno": 6,
+    "luglio": 7, "agosto": 8, "settembre": 9, "ottobre": 10, "novembre": 11, "dicembre": 12,
+}
+_DATE_RE = re.compile(
+    r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b"
+    r"|\b(\d{1,2})\s+(" + "|".join(_MONTHS) + r")\s+(\d{4})\b",
+    re.I,
+)
+_HOUR_RE = re.compile(r"\bore\s+(\d{1,2})[:.](\d{2})\b", re.I)
+
+# Contributo ANAC: citato → "yes"; citato con negazione → ambiguo (decide l'LLM)
+_ANAC_CONTRIB_RE = re.compile(r"contribut\w*[^\n]{0,80}?\bANAC\b|\bANAC\b[^\n]{0,80}?contribut\w*", re.I)
+_NEGATION_RE = re.compile(r"\bnon\s+(?:è\s+)?(?:dovut|richiest|previst)|\besent", re.I)
+_FVOE_RE = re.compile(r"\bFVOE\b|fascicolo\s+virtuale", re.I)
+
+_EVIDENCE_MAX_CHARS = 240
+
+# Gruppo di pattern → campi prodotti; il nome del gruppo è la categoria di
+# retrieval che ne seleziona i chunk ("meta" = chunk di apertura dei metadati)
+SCAN_GROUPS: Dict[str, List[str]] = {
+    "anac_cig": ["codice_cig", "anac_contributo", "fvoe"],
+    "meta": ["codice_cup", "cpv"],
+    "importo": ["importo_base_gara", "importo_lavori", "oneri_sicurezza", "importo_totale"],
+    "scadenze": ["dates"],
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TIPI
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class FieldMatch:
+    """Un valore trovato nel testo, con evidence esatta e posizione."""
+    field: str
+    value: Any
+    evidence: str
+    chunk_id: str
+    page: int        # 1-indexed
+    offset: int      # offset assoluto nel documento
+
+
+@dataclass
+class PreExtraction:
+    """Esito della pre-estrazione: tutti i candidati per campo."""
+    matches: Dict[str, List[FieldMatch]] = field(default_factory=dict)
+    dates: List[Dict[str, Any]] = field(default_factory=list)
+
+    def add(self, match: FieldMatch) -> None:
+        self.matches.setdefault(match.field, []).append(match)
+
+    def unique(self, name: str) -> Optional[FieldMatch]:
+        """Il match del campo se tutti i candidati hanno lo stesso valore, altrimenti None."""
+        found = self.matches.get(name, [])
+        if not found or len({m.value for m in found}) > 1:
+            return None
+        return found[0]
+
+    def is_ambiguous(self, name: str) -> bool:
+        return len({m.value for m in self.matches.get(name, [])}) > 1
+
+    def evidence_for(self, category: str) -> List[FieldMatch]:
+        """Match che hanno deciso la categoria (per la trace)."""
+        names = {
+            "anac_cig": ["codice_cig"],
+            "importo": ["importo_base_gara", "importo_lavori", "oneri_sicurezza", "importo_totale"],
+        }.get(category, [])
+        return [self.matches[n][0] for n in names if self.unique(n)]
+
+    def category_fields(self, category: str) -> Optional[dict]:
+        """
+        Campi completi della categoria se la pre-estrazione è univoca,
+        altrimenti None (la categoria va all'LLM).
+        """
+        if category == "anac_cig":
+            cig = self.unique("codice_cig")
+            if cig is None or self.is_ambiguous("anac_contributo"):
+                return None
+            contributo = self.unique("anac_contributo")
+            return {
+                "codice_cig": cig.value,
+                "cig_evidence": cig.evidence,
+                "anac_contributo_richiesto": contributo.value if contributo else "unknown",
+                "fvoe_required": bool(self.matches.get("fvoe")),
+            }
+        if category == "importo":
+            names = ["importo_base_gara", "importo_lavori", "oneri_sicurezza", "importo_totale"]
+            base = self.unique("importo_base_gara") or self.unique("importo_lavori")
+            if base is None or any(self.is_ambiguous(n) for n in names):
+                return None
+            fields: Dict[str, Any] = {}
+            for n in names:
+                m = self.unique(n)
+                fields[n] = m.value if m else None
+            fields["importo_evidence"] = base.evidence
+            return fields
+        return None
+
+    def meta_fields(self) -> dict:
+        """CUP e CPV univoci (sovrascrivono la risposta LLM dei metadati)."""
+        out = {}
+        for name, key in (("codice_cup", "codice_cup"), ("cpv", "cpv")):
+            m = self.unique(name)
+            if m is not None:
+                out[key] = m.value
+        return out
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ESTRAZIONE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def parse_italian_amount(text: str) -> float:
+    """'1.234.567,89' → 1234567.89"""
+    return float(text.replace(".", "").replace(",", "."))
+
+
+def _line_at(text: str, pos: int) -> tuple:
+    start = text.rfind("\n", 0, pos) + 1
+    end = text.find("\n", pos)
+    return start, len(text) if end == -1 else end
+
+
+def _evidence(text: str, pos: int) -> str:
+    """Riga del testo che contiene pos (troncata attorno al match se lunga)."""
+    start, end = _line_at(text, pos)
+    if end - start > _EVIDENCE_MAX_CHARS:
+        start = max(start, pos - _EVIDENCE_MAX_CHARS // 2)
+        end = min(end, start + _EVIDENCE_MAX_CHARS)
+    return text[start:end].strip()
+
+
+def _amount_label(text: str, line_start: int, pos: int) -> Optional[str]:
+    """Etichetta la cui occorrenza termina più vicino a pos (stessa riga, prima dell'importo)."""
+    before = text[line_start:pos]
+    best, best_end = None, -1
+    for name, regex in _AMOUNT_LABELS:
+        for m in regex.finditer(before):
+            if m.end() > best_end:
+                best, best_end = name, m.end()
+    return best
+
+
+@traced("pre_extract_fields")
+def pre_extract_fields(chunks: List[Chunk], scopes: Optional[Dict[str, List[Chunk]]] = None) -> PreExtraction:
+    """
+    Scansione deterministica dei chunk (≈1 ms per pagina con tutti i gruppi).
+    scopes: gruppo di SCAN_GROUPS → chunk da scansionare per quel gruppo
+    (gruppi assenti: nessuna scansione); None = tutti i gruppi su tutti i chunk.
+    """
+    pre = PreExtraction()
+    if scopes is None:
+        plan = [(chunk, set(SCAN_GROUPS)) for chunk in chunks]
+    else:
+        groups: Dict[str, set] = {}
+        selected: Dict[str, Chunk] = {}
+        for group, scoped in scopes.items():
+            for chunk in scoped:
+                groups.setdefault(chunk.chunk_id, set()).add(group)
+                selected[chunk.chunk_id] = chunk
+        # ordine di documento, come la scansione completa
+        plan = [(c, groups[c.chunk_id]) for c in sorted(selected.values(), key=lambda c: c.char_start)]
+    for chunk, chunk_groups in plan:
+        _scan_chunk(pre, chunk, chunk_groups)
+    return pre
+
+
+def _scan_chunk(pre: PreExtraction, chunk: Chunk, groups: Iterable[str]) -> None:
+    """Applica al chunk i pattern dei gruppi indicati."""
+    text = chunk.text
+    groups = set(groups)
+
+    def add(name: str, value: Any, pos: int) -> None:
+        pre.add(FieldMatch(
+            field=name, value=value, evidence=_evidence(text, pos),
+            chunk_id=chunk.chunk_id, page=chunk.page + 1, offset=chunk.char_start + pos,
+        ))
+
+    if "anac_cig" in groups:
+        for m in _CIG_RE.finditer(text):
+            add("codice_cig", m.group(1), m.start(1))
+        for m in _ANAC_CONTRIB_RE.finditer(text):
+            start, end = _line_at(text, m.start())
+            add("anac_contributo", "no" if _NEGATION_RE.search(text[start:end]) else "yes", m.start())
+        for m in _FVOE_RE.finditer(text):
+            add("fvoe", True, m.start())
+
+    if "meta" in groups:
+        for m in _CUP_RE.finditer(text):
+            add("codice_cup", m.group(1), m.start(1))
+        for m in _CPV_RE.finditer(text):
+            add("cpv", m.group(1), m.start(1))
+
+    if "importo" in groups:
+        prev_end: Dict[int, int] = {}   # line_start → fine dell'ultimo importo nella riga
+        for m in _AMOUNT_RE.finditer(text):
+            line_start, _ = _line_at(text, m.start())
+            label = _amount_label(text, prev_end.get(line_start, line_start), m.start())
+            prev_end[line_start] = m.end()
+            if label:
+                add(label, parse_italian_amount(m.group(1) or m.group(2)), m.start())
+
+    if "scadenze" in groups:
+        for m in _DATE_RE.finditer(text):
+            if m.group(1):
+                day, month, year = int(m.group(1)), int(m.group(2)), int(m.group(3))
+            else:
+                day, month, year = int(m.group(4)), _MONTHS[m.group(5).lower()], int(m.group(6))
+            if not (1 <= day <= 31 and 1 <= month <= 12):
+                continue
+            start, end = _line_at(text, m.start())
+            hour = _HOUR_RE.search(text, start, end)
+            pre.dates.append({
+                "data": f"{year:04d}-{month:02d}-{day:02d}",
+                "ora": f"{int(hour.group(1)):02d}:{hour.group(2)}" if hour else None,
+                "evidence": _evidence(text, m.start()),
+                "page": chunk.page + 1,
+                "offset": chunk.char_start + m.start(),
+            })
@@ -0,0 +1,65 @@
+"""
+BidPilot — Prezzi modelli LLM  v1.0
+====================================
+Tabella dei prezzi di listino (USD per 1M token, input / output) usata per
+stimare il costo delle estrazioni. Il modello è risolto per prefisso più
+lungo ("gpt-4o-mini-2024-07-18" → "gpt-4o-mini").
+
+I prezzi cambiano: aggiornare la tabella (o passare overrides a
+estimate_cost) quando il provider modifica il listino.
+"""
+from __future__ import annotations
+
+from typing import Dict, Optional, Tuple
+
+# modello (prefisso) → (USD / 1M token input, USD / 1M token output)
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "o4-mini": (1.10, 4.40),
+    "claude-3-haiku": (0.25, 1.25),
+    "claude-3-5-haiku": (0.80, 4.00),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-sonnet-4": (3.00, 15.00),
+    "claude-opus-4": (15.00, 75.00),
+    "local": (0.0, 0.0),
+}
+
+# Token di input serviti dalla prompt cache del provider: quota del prezzo di input
+_CACHED_INPUT_RATIO: Dict[str, float] = {"claude": 0.1}
+_DEFAULT_CACHED_INPUT_RATIO = 0.5
+
+
+def price_for(model: str, overrides: Optional[Dict[str, Tuple[float, float]]] = None) -> Optional[Tuple[float, float]]:
+    """(input, output) in USD per 1M token per il modello; None se sconosciuto."""
+    prices = {**MODEL_PRICES, **(overrides or {})}
+    matches = [prefix for prefix in prices if model == prefix or model.startswith(prefix + "-")]
+    if not matches:
+        return None
+    return prices[max(matches, key=len)]
+
+
+def estimate_cost(
+    model: str,
+    input_tokens: int,
+    output_tokens: int = 0,
+    overrides: Optional[Dict[str, Tuple[float, float]]] = None,
+    cached_tokens: int = 0,
+) -> Optional[float]:
+    """
+    Costo in USD di una chiamata; None se il modello non è in tabella.
+    cached_tokens: quota di input_tokens letta dalla prompt cache (prezzo ridotto).
+    """
+    price = price_for(model, overrides)
+    if price is None:
+        return None
+    ratio = next(
+        (r for prefix, r in _CACHED_INPUT_RATIO.items() if model.startswith(prefix)),
+        _DEFAULT_CACHED_INPUT_RATIO,
+    )
+    cached = min(cached_tokens, input_tokens)
+    billed_input = (input_tokens - cached) + cached * ratio
+    return (billed_input * price[0] + output_tokens * price[1]) / 1_000_000
@@ -0,0 +1,267 @@
+"""
+BidPilot — Rate Limiter  v1.0
+==============================
+Limitatore condiviso delle chiamate LLM, per coppia (provider, api_key)
+come i backend di llm_client: tutte le categorie, i documenti e le sessioni
+dello stesso processo attingono agli stessi bucket.
+
+  - due token bucket: richieste/minuto (RPM) e token/minuto (TPM); una
+    richiesta prenota 1 richiesta + i token stimati del prompt e attende
+    (fuori dal lock) finché entrambi i bucket sono in positivo
+  - backoff adattivo: un 429 apre un cooldown condiviso (Retry-After se
+    presente) e riduce la velocità di ricarica (x0.7, minimo 10%); ogni
+    successo la riporta gradualmente al 100%
+  - classificazione degli errori: 429, 408, 409, 5xx, timeout e errori di
+    connessione sono ritentabili; gli altri 4xx (chiave errata, richiesta
+    non valida) e le eccezioni di programma (KeyError, TypeError, …) no
+  - backoff esponenziale con full jitter (evita che i thread ritentino insieme)
+  - metriche per limitatore: richieste, attese, secondi di throttling, 429
+
+Limiti predefiniti per provider (tier base), sovrascrivibili con
+configure_rate_limit() o con le variabili BIDPILOT_<PROVIDER>_RPM / _TPM.
+Lo stand-in "local" non ha limiti.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("bidpilot.rate_limiter")
+
+# (RPM, TPM) predefiniti; None = illimitato
+_DEFAULT_LIMITS: Dict[str, Tuple[Optional[int], Optional[int]]] = {
+    "openai": (500, 200_000),
+    "anthropic": (50, 40_000),
+    "local": (None, None),
+}
+_SCALE_DECREASE = 0.7      # moltiplicatore della ricarica dopo un 429
+_SCALE_RECOVERY = 0.05     # recupero per ogni richiesta riuscita
+_SCALE_FLOOR = 0.1
+_RETRY_MAX_DELAY = 60.0    # secondi; tetto del backoff esponenziale
+
+_RETRYABLE_STATUS = {408, 409, 429}
+# Eccezioni di trasporto senza status HTTP: httpx.TimeoutException/TransportError,
+# openai/anthropic APIConnectionError/APITimeoutError
+_TRANSPORT_ERRORS = {"TimeoutException", "TransportError", "APIConnectionError", "APITimeoutError"}
+_TRANSPORT_MODULES = {"httpx", "openai", "anthropic"}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLASSIFICAZIONE ERRORI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def status_code(exc: BaseException) -> Optional[int]:
+    """Status HTTP dell'eccezione SDK (openai/anthropic: .status_code o .response.status_code)."""
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_rate_limit(exc: BaseException) -> bool:
+    return status_code(exc) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+def _is_transport_error(exc: BaseException) -> bool:
+    """Timeout / errori di rete: builtin, httpx o SDK (riconosciuti per nome, SDK opzionali)."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return any(
+        cls.__name__ in _TRANSPORT_ERRORS and cls.__module__.split(".")[0] in _TRANSPORT_MODULES
+        for cls in type(exc).__mro__
+    )
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    429/408/409/5xx, timeout ed errori di connessione sì; gli altri 4xx e
+    qualsiasi altra eccezione (TypeError, KeyError, … = bug, non transitori) no.
+    """
+    code = status_code(exc)
+    if code is None:
+        return _is_transport_error(exc)
+    return code in _RETRYABLE_STATUS or code >= 500
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Secondi dall'header Retry-After della risposta, se presente e numerico."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, hint: Optional[float] = None) -> float:
+    """Full jitter: uniforme in [0, base·2^attempt] (max _RETRY_MAX_DELAY), mai sotto Retry-After."""
+    delay = random.uniform(0.0, min(_RETRY_MAX_DELAY, base * (2 ** attempt)))
+    return max(delay, hint or 0.0)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TOKEN BUCKET
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TokenBucket:
+    """
+    Bucket con capacità = limite al minuto e ricarica continua.
+    reserve() scala subito la quantità (anche in negativo) e restituisce
+    l'attesa necessaria: le richieste successive si accodano dietro il debito.
+    """
+
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0   # unità al secondo
+        self.level = self.capacity
+        self.updated = now
+
+    def reserve(self, amount: float, now: float, scale: float = 1.0) -> float:
+        rate = self.rate * scale
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / rate
+
+
+@dataclass
+class RateLimiterStats:
+    """Metriche cumulative di un limitatore."""
+    requests: int = 0
+    throttled: int = 0            # richieste che hanno atteso il limitatore
+    wait_seconds: float = 0.0     # attesa totale (bucket + cooldown)
+    max_wait_seconds: float = 0.0
+    rate_limited: int = 0         # risposte 429 ricevute
+    retries: int = 0              # nuovi tentativi dopo errori ritentabili
+    failures: int = 0             # chiamate fallite a tentativi esauriti
+
+
+class RateLimiter:
+    """RPM + TPM per (provider, api_key) con cooldown e ricarica adattiva."""
+
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rpm, self.tpm = rpm, tpm
+        self._clock, self._sleep = clock, sleep
+        now = clock()
+        self._requests = TokenBucket(rpm, now) if rpm else None
+        self._tokens = TokenBucket(tpm, now) if tpm else None
+        self._cooldown_until = 0.0
+        self._scale = 1.0
+        self._stats = RateLimiterStats()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Prenota una richiesta da `tokens` token; attende se serve. Restituisce i secondi attesi."""
+        with self._lock:
+            now = self._clock()
+            wait = max(0.0, self._cooldown_until - now)
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now, self._scale))
+            if self._tokens is not None and tokens:
+                wait = max(wait, self._tokens.reserve(tokens, now, self._scale))
+            self._stats.requests += 1
+            if wait > 0:
+                self._stats.throttled += 1
+                self._stats.wait_seconds += wait
+                self._stats.max_wait_seconds = max(self._stats.max_wait_seconds, wait)
+        if wait > 0:
+            logger.debug(f"Rate limiter: attesa {wait:.2f}s prima della chiamata.")
+            self._sleep(wait)
+        return wait
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._scale = min(1.0, self._scale + _SCALE_RECOVERY)
+
+    def record_rate_limited(self, cooldown: float) -> None:
+        """429: cooldown condiviso da tutti i thread e ricarica rallentata."""
+        with self._lock:
+            self._cooldown_until = max(self._cooldown_until, self._clock() + cooldown)
+            self._scale = max(_SCALE_FLOOR, self._scale * _SCALE_DECREASE)
+            self._stats.rate_limited += 1
+            self._stats.retries += 1
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._stats.retries += 1
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._stats.failures += 1
+
+    @property
+    def scale(self) -> float:
+        return self._scale
+
+    def stats(self) -> RateLimiterStats:
+        with self._lock:
+            return RateLimiterStats(**asdict(self._stats))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# REGISTRY
+# ══════════════════════════════════════════════════════════════════════════════
+
+_limits: Dict[str, Tuple[Optional[int], Optional[int]]] = dict(_DEFAULT_LIMITS)
+_limiters: Dict[Tuple[str, Optional[str]], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_limit(provider: str, name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(f"BIDPILOT_{provider.upper()}_{name}")
+    if not value:
+        return default
+    return int(value) or None   # 0 = illimitato
+
+
+def configure_rate_limit(provider: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+    """Imposta i limiti di un provider (None = illimitato); i limitatori esistenti vengono ricreati."""
+    with _limiters_lock:
+        _limits[provider] = (rpm, tpm)
+        for key in [k for k in _limiters if k[0] == provider]:
+            del _limiters[key]
+
+
+def get_limiter(provider: str, api_key: Optional[str]) -> RateLimiter:
+    """Limitatore condiviso per (provider, api_key), creato al primo uso."""
+    key = (provider, api_key)
+    limiter = _limiters.get(key)
+    if limiter is not None:
+        return limiter
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            rpm, tpm = _limits.get(provider, (None, None))
+            limiter = _limiters[key] = RateLimiter(
+                rpm=_env_limit(provider, "RPM", rpm), tpm=_env_limit(provider, "TPM", tpm),
+            )
+    return limiter
+
+
+def rate_limit_stats() -> Dict[str, dict]:
+    """Metriche di tutti i limitatori attivi, per 'provider:…ultime 4 cifre della chiave'."""
+    with _limiters_lock:
+        items = list(_limiters.items())
+    return {
+        f"{provider}:…{(api_key or '')[-4:]}": asdict(limiter.stats())
+        for (provider, api_key), limiter in items
+    }
+
+
+def reset_rate_limiters() -> None:
+    """Azzera limitatori e metriche (test / cambio configurazione)."""
+    with _limiters_lock:
+        _limiters.clear()
@@ -21,6 +21,7 @@ from src.schemas import (
     RequirementResult, Fixability, CompanyGap, Evidence,
     ReqStatus, Severity
 )
+from src.tracing import traced
 
 CLASSIFICHE_SOA: Dict[str, float] = {
     "I": 258_000, "II": 516_000, "III": 1_033_000,
@@ -1608,6 +1609,7 @@ def eval_M_vincoli(bando: BandoRequisiti) -> List[RequirementResult]:
 # ENTRY POINT PRINCIPALE
 # ══════════════════════════════════════════════════════════
 
+@traced("evaluate_all")
 def evaluate_all(bando: BandoRequisiti, company: CompanyProfile,
                  participation_forms: Any = None) -> List[RequirementResult]:
     results: List[RequirementResult] = []
@@ -9,16 +9,28 @@ Implementa:
 
 Design deliberato:
   - NESSUNA dipendenza da modelli vettoriali o indici ANN.
-  - Scoring BM25-like puramente lessicale: trasparente, reproducibile, testabile.
+  - Scoring puramente lessicale: trasparente, reproducibile, testabile.
+    Due scorer: "log_tf" (default, Σ log(1+tf)) e "bm25" (IDF + normalizzazione
+    per lunghezza, statistiche calcolate sul documento stesso).
   - Se un termine multi-parola ("UNI EN", "art. 94") appare nel chunk → peso doppio.
   - Tie-break: preferisce chunk più vicini all'inizio del documento (position bias).
+  - KeywordMatcher: tutte le keyword del catalogo compilate in un'unica regex;
+    ogni chunk viene scansionato una sola volta e fornisce i tf di tutte le
+    categorie insieme.
+  - Indice invertito (termine → chunk, tf) costruito una volta nel Retriever:
+    le query toccano solo i chunk che contengono almeno una keyword.
 """
 from __future__ import annotations
 
+import heapq
 import re
 import math
+import sys
+import time
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.tracing import traced
 
 # ══════════════════════════════════════════════════════════════════════════════
 # KEYWORD CATALOG
@@ -128,7 +140,22 @@ class ExtractionTrace:
     top_scores: List[float]
     top_pages: List[int]
     total_available: int
-    tokens_sent: int               # stima token inviati all'LLM
+    tokens_sent: int               # token di contesto inviati all'LLM
+    error: Optional[str] = None    # errore LLM che ha svuotato la categoria (se presente)
+    cache_status: Optional[str] = None  # "hit" / "miss" / None (cache non consultata)
+    tokens_full: Optional[int] = None   # token del contesto completo prima del packing
+    group: Optional[List[str]] = None   # categorie estratte con lo stesso prompt (modalità grouped)
+    method: str = "llm"                 # "llm" / "deterministic" (pre-estrazione regex) / "skipped" (non usata a valle)
+                                        # / "reused" (versione precedente, incremental.py)
+    model: Optional[str] = None         # modello che ha prodotto la risposta (None = nessuna chiamata)
+    latency_ms: Optional[float] = None  # durata della chiamata LLM (retry e attese incluse)
+    # Utilizzo riportato dal provider, sommato su retry e re-prompt (None = nessuna chiamata)
+    input_tokens: Optional[int] = None      # prompt completo: istruzioni, schema e contesto
+    output_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None     # input servito dalla prompt cache del provider
+    provider_latency_ms: Optional[float] = None  # solo il tempo delle risposte, senza attese
+    llm_calls: int = 0                      # richieste effettive al provider
+    cost_usd: Optional[float] = None        # stima da pricing.py (None = modello senza prezzo)
 
     def to_dict(self) -> dict:
         return {
@@ -138,6 +165,21 @@ class ExtractionTrace:
             "top_pages": self.top_pages,
             "total_available": self.total_available,
             "tokens_sent": self.tokens_sent,
+            "error": self.error,
+            "cache_status": self.cache_status,
+            "tokens_full": self.tokens_full,
+            "group": self.group,
+            "method": self.method,
+            "model": self.model,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "provider_latency_ms": (
+                round(self.provider_latency_ms, 1) if self.provider_latency_ms is not None else None
+            ),
+            "llm_calls": self.llm_calls,
+            "cost_usd": round(self.cost_usd, 6) if self.cost_usd is not None else None,
         }
 
 
@@ -149,6 +191,7 @@ _MAX_CHUNK_CHARS = 6_000   # ~1500 token (stima 4 char/token)
 _MIN_CHUNK_CHARS = 100     # chunk troppo corti vengono ignorati
 
 
+@traced("chunk_by_page")
 def chunk_by_page(pages: List[str]) -> List[Chunk]:
     """
     A2 — Chunking per pagina. Se una pagina supera _MAX_CHUNK_CHARS la spezza
@@ -164,47 +207,57 @@ def chunk_by_page(pages: List[str]) -> List[Chunk]:
     abs_offset = 0
 
     for page_idx, page_text in enumerate(pages):
-        text = page_text.strip()
-        if len(text) < _MIN_CHUNK_CHARS:
-            abs_offset += len(page_text) + 1
-            continue
-
-        if len(text) <= _MAX_CHUNK_CHARS:
-            chunk_id = f"p{page_idx + 1}"
-            chunks.append(Chunk(
-                chunk_id=chunk_id,
-                page=page_idx,
-                text=text,
-                token_estimate=len(text) // 4,
-                char_start=abs_offset,
-                char_end=abs_offset + len(text),
-            ))
-        else:
-            # Spezza con overlap
-            overlap = 200
-            pos = 0
-            sub_idx = 0
-            while pos < len(text):
-                end = min(pos + _MAX_CHUNK_CHARS, len(text))
-                sub_text = text[pos:end].strip()
-                if len(sub_text) >= _MIN_CHUNK_CHARS:
-                    chunk_id = f"p{page_idx + 1}_b{sub_idx}"
-                    chunks.append(Chunk(
-                        chunk_id=chunk_id,
-                        page=page_idx,
-                        text=sub_text,
-                        token_estimate=len(sub_text) // 4,
-                        char_start=abs_offset + pos,
-                        char_end=abs_offset + end,
-                    ))
-                    sub_idx += 1
-                pos = end - overlap if end < len(text) else end
-
+        chunks.extend(chunk_page(page_idx, page_text, abs_offset))
         abs_offset += len(page_text) + 1
 
     return chunks
 
 
+def chunk_page(page_idx: int, page_text: str, abs_offset: int) -> List[Chunk]:
+    """
+    Chunk di una singola pagina (usato da chunk_by_page e dal parse in streaming).
+    abs_offset = offset della pagina nel documento (somma di len(pagina) + 1 delle precedenti).
+    """
+    chunks: List[Chunk] = []
+    text = page_text.strip()
+    if len(text) < _MIN_CHUNK_CHARS:
+        return chunks
+
+    if len(text) <= _MAX_CHUNK_CHARS:
+        chunk_id = f"p{page_idx + 1}"
+        chunks.append(Chunk(
+            chunk_id=chunk_id,
+            page=page_idx,
+            text=text,
+            token_estimate=len(text) // 4,
+            char_start=abs_offset,
+            char_end=abs_offset + len(text),
+        ))
+    else:
+        # Spezza con overlap
+        overlap = 200
+        pos = 0
+        sub_idx = 0
+        while pos < len(text):
+            end = min(pos + _MAX_CHUNK_CHARS, len(text))
+            sub_text = text[pos:end].strip()
+            if len(sub_text) >= _MIN_CHUNK_CHARS:
+                chunk_id = f"p{page_idx + 1}_b{sub_idx}"
+                chunks.append(Chunk(
+                    chunk_id=chunk_id,
+                    page=page_idx,
+                    text=sub_text,
+                    token_estimate=len(sub_text) // 4,
+                    char_start=abs_offset + pos,
+                    char_end=abs_offset + end,
+                ))
+                sub_idx += 1
+            pos = end - overlap if end < len(text) else end
+
+    return chunks
+
+
+@traced("chunk_full_text")
 def chunk_full_text(full_text: str) -> List[Chunk]:
     """
     Fallback: chunking su testo completo senza separatori di pagina.
@@ -234,6 +287,17 @@ def _normalize(text: str) -> str:
     return re.sub(r'\s+', ' ', text.lower())
 
 
+# Penalità di posizione: 0.01 per chunk dall'inizio, al massimo _POSITION_BIAS_MAX.
+# Senza tetto, in un disciplinare da 1000 pagine le sezioni della seconda metà
+# (DGUE, forme di partecipazione) scendevano a score 0 qualunque fosse il match.
+_POSITION_BIAS_STEP = 0.01
+_POSITION_BIAS_MAX = 1.0
+
+
+def _position_penalty(position: float) -> float:
+    return min(_POSITION_BIAS_MAX, position * _POSITION_BIAS_STEP)
+
+
 def _score(chunk: Chunk, keywords: List[str], position_bias: float = 0.0) -> Tuple[float, List[str]]:
     """
     Calcola score BM25-like per un chunk dato un set di keyword.
@@ -243,7 +307,7 @@ def _score(chunk: Chunk, keywords: List[str], position_bias: float = 0.0) -> Tup
       - tf_i = occorrenze del termine i nel chunk
       - weight_i = 2.0 per multi-parola, 1.0 per singola parola
       - position_bias = piccola penalità proporzionale alla posizione nel doc
-        (chunk iniziali premiati, ma solo lievemente)
+        (chunk iniziali premiati, ma solo lievemente: al massimo _POSITION_BIAS_MAX)
 
     Returns:
         (score, lista di termini che hanno matchato)
@@ -263,23 +327,212 @@ def _score(chunk: Chunk, keywords: List[str], position_bias: float = 0.0) -> Tup
             score += weight * math.log(1 + tf)
             matched.append(kw)
 
-    # Position bias: −0.1 per ogni 10 chunk di distanza dall'inizio
-    score = max(0.0, score - position_bias * 0.01)
+    # Position bias: −0.1 per ogni 10 chunk di distanza dall'inizio (tetto −1.0)
+    score = max(0.0, score - _position_penalty(position_bias))
     return score, matched
 
 
+def _trie_pattern(terms: Iterable[str]) -> str:
+    """
+    Regex equivalente all'alternanza dei termini, ma fattorizzata per prefissi:
+    "soa|sopralluogo" → "so(?:a|pralluogo)". Sui cataloghi lunghi evita di
+    provare ogni alternativa a ogni posizione del testo.
+    """
+    trie: Dict[str, dict] = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}   # fine termine
+
+    def build(node: Dict[str, dict]) -> str:
+        children = sorted((ch, sub) for ch, sub in node.items() if ch)
+        if not children:
+            return ""
+        alts = [re.escape(ch) + build(sub) for ch, sub in children]
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:   # il prefisso è già un termine: il resto è opzionale (greedy)
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Matcher multi-keyword precompilato.
+
+    Tutti i termini (normalizzati) sono compilati in un'unica regex con
+    lookahead, strutturata come un trie (un solo ramo esplorato per posizione)
+    e con quantificatori greedy: a ogni posizione del testo la regex
+    restituisce il termine più lungo che vi inizia, e gli altri termini che
+    iniziano lì sono esattamente i suoi prefissi (precalcolati).
+    Una sola scansione produce quindi il tf di tutti i termini, con la stessa
+    semantica di re.findall(re.escape(kw)) per ciascuno: occorrenze come
+    sottostringa, non sovrapposte per lo stesso termine.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        terms = {_normalize(kw) for kw in keywords}
+        terms.discard("")
+        self.terms: List[str] = sorted(terms, key=lambda t: (-len(t), t))
+        self._regex = re.compile(
+            "(?=(" + _trie_pattern(self.terms) + "))"
+        ) if self.terms else None
+        self._prefixes: Dict[str, List[str]] = {
+            t: [p for p in self.terms if t.startswith(p)] for t in self.terms
+        }
+
+    def term_frequencies(self, text_norm: str) -> Dict[str, int]:
+        """tf di ogni termine presente in text_norm (già passato da _normalize)."""
+        counts: Dict[str, int] = {}
+        if self._regex is None:
+            return counts
+        next_free: Dict[str, int] = {}
+        for m in self._regex.finditer(text_norm):
+            pos = m.start()
+            for term in self._prefixes[m.group(1)]:
+                if pos >= next_free.get(term, 0):
+                    counts[term] = counts.get(term, 0) + 1
+                    next_free[term] = pos + len(term)
+        return counts
+
+
+_MATCHER_CACHE: Dict[Tuple[str, ...], KeywordMatcher] = {}
+
+
+def _matcher_for(keywords: Iterable[str]) -> KeywordMatcher:
+    """KeywordMatcher compilato una volta per insieme di keyword."""
+    key = tuple(sorted(set(keywords)))
+    matcher = _MATCHER_CACHE.get(key)
+    if matcher is None:
+        matcher = _MATCHER_CACHE[key] = KeywordMatcher(key)
+    return matcher
+
+
+# Scorer disponibili per Retriever(scorer=...)
+SCORERS = ("log_tf", "bm25")
+
+# Parametri BM25 standard (Robertson/Zaragoza)
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+def _bm25_idf(df: int, n_docs: int) -> float:
+    """IDF BM25 (variante non negativa): termini presenti ovunque → peso ≈ 0."""
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+
+def _bm25_tf(tf: int, length: int, avg_length: float) -> float:
+    """Saturazione del tf con normalizzazione per lunghezza del chunk."""
+    norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * length / avg_length) if avg_length else _BM25_K1
+    return tf * (_BM25_K1 + 1) / (tf + norm)
+
+
+def _catalog_keywords() -> List[str]:
+    return [kw for kws in CATEGORY_KEYWORDS.values() for kw in kws]
+
+
+def _prepare_keywords(keywords: List[str]) -> List[Tuple[str, str, float]]:
+    """(keyword originale, keyword normalizzata, peso) — calcolato una volta per query."""
+    prepared = []
+    for kw in keywords:
+        kw_norm = _normalize(kw)
+        prepared.append((kw, kw_norm, 2.0 if ' ' in kw_norm else 1.0))
+    return prepared
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # RETRIEVER
 # ══════════════════════════════════════════════════════════════════════════════
 
 class Retriever:
     """
-    A3-A4 — Retrieval per categoria: score tutti i chunk, restituisce i top-N.
+    A3-A4 — Retrieval per categoria: score dei chunk candidati, restituisce i top-N.
+
+    Alla costruzione ogni chunk viene scansionato una volta (KeywordMatcher) e
+    si costruisce un indice invertito termine → [(indice chunk, tf)].
+    Una query tocca solo i chunk che contengono almeno una keyword; le keyword
+    fuori catalogo (override, domande di follow-up) vengono indicizzate al
+    primo uso e memorizzate nell'indice.
+
+    Scorer (parametro `scorer`):
+      - "log_tf": Σ weight · log(1 + tf) — comportamento storico (default)
+      - "bm25":   Σ weight · idf · tf saturato e normalizzato per lunghezza;
+                  le statistiche di corpus (df, lunghezze) sono quelle del
+                  documento stesso. I termini di boilerplate presenti in quasi
+                  tutti i chunk ("ore", "data", "euro") pesano ≈ 0, quindi meno
+                  chunk superano min_score e meno token vanno all'LLM.
+    In entrambi i casi weight = 2.0 per keyword multi-parola e si applica lo
+    stesso position bias.
     """
 
-    def __init__(self, chunks: List[Chunk]):
-        self.chunks = chunks
+    @traced("Retriever.index")
+    def __init__(self, chunks: List[Chunk], scorer: str = "log_tf"):
+        if scorer not in SCORERS:
+            raise ValueError(f"Scorer '{scorer}' non supportato (disponibili: {', '.join(SCORERS)}).")
+        self.chunks = list(chunks)
+        self.scorer = scorer
+        t0 = time.perf_counter()
+        # Lunghezze in parole: servono solo a BM25 ma costano poco
+        self._lengths = [len(_normalize(c.text).split()) for c in chunks]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if chunks else 0.0
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._index_terms(_matcher_for(_catalog_keywords()))
+        self._build_ms = (time.perf_counter() - t0) * 1000
+
+    def _index_terms(self, matcher: KeywordMatcher, start: int = 0) -> None:
+        """Una scansione per chunk (da start); aggiunge all'indice i postings dei termini del matcher."""
+        for term in matcher.terms:
+            self._postings.setdefault(term, [])
+        for i in range(start, len(self.chunks)):
+            for term, tf in matcher.term_frequencies(_normalize(self.chunks[i].text)).items():
+                self._postings[term].append((i, tf))
+
+    def add_chunks(self, chunks: List[Chunk]) -> None:
+        """
+        Indicizzazione incrementale (parse in streaming): i nuovi chunk sono
+        scansionati per tutti i termini già nell'indice; lunghezze e statistiche
+        BM25 si aggiornano. Il risultato è identico a Retriever(tutti i chunk).
+        """
+        t0 = time.perf_counter()
+        start = len(self.chunks)
+        self.chunks.extend(chunks)
+        self._lengths.extend(len(_normalize(c.text).split()) for c in chunks)
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        self._index_terms(_matcher_for(self._postings), start=start)
+        self._build_ms += (time.perf_counter() - t0) * 1000
+
+    def _ensure_indexed(self, keywords: List[str]) -> None:
+        """Indicizza (una volta sola) le keyword non ancora presenti nell'indice."""
+        missing = {_normalize(kw) for kw in keywords} - self._postings.keys()
+        missing.discard("")
+        if missing:
+            self._index_terms(KeywordMatcher(missing))
+
+    def _term_scores(self, postings: List[Tuple[int, int]]) -> List[Tuple[int, float]]:
+        """(indice chunk, contributo del termine) secondo lo scorer scelto."""
+        if self.scorer == "bm25":
+            idf = _bm25_idf(len(postings), len(self.chunks))
+            return [(i, idf * _bm25_tf(tf, self._lengths[i], self._avg_length)) for i, tf in postings]
+        return [(i, math.log(1 + tf)) for i, tf in postings]
+
+    def index_stats(self) -> Dict[str, float]:
+        """Dimensioni dell'indice invertito (per log e benchmark)."""
+        n_postings = sum(len(p) for p in self._postings.values())
+        memory = sys.getsizeof(self._postings) + sum(
+            sys.getsizeof(term) + sys.getsizeof(p) + sum(sys.getsizeof(entry) for entry in p)
+            for term, p in self._postings.items()
+        )
+        return {
+            "chunks": len(self.chunks),
+            "terms": len(self._postings),
+            "postings": n_postings,
+            "memory_bytes": memory,
+            "build_ms": round(self._build_ms, 2),
+        }
 
+    @traced("Retriever.retrieve")
     def retrieve(
         self,
         category: str,
@@ -301,15 +554,23 @@ class Retriever:
         if not kws:
             raise ValueError(f"Categoria '{category}' non trovata e nessuna keyword fornita.")
 
+        self._ensure_indexed(kws)
+        raw: Dict[int, float] = {}
+        matched: Dict[int, List[str]] = {}
+        for kw, kw_norm, weight in _prepare_keywords(kws):
+            for i, term_score in self._term_scores(self._postings.get(kw_norm, [])):
+                raw[i] = raw.get(i, 0.0) + weight * term_score
+                matched.setdefault(i, []).append(kw)
+
+        # Con soglia <= 0 anche i chunk senza match (score 0) sono ammessi
+        candidates = range(len(self.chunks)) if min_score <= 0.0 else sorted(raw)
         scored: List[ScoredChunk] = []
-        for i, chunk in enumerate(self.chunks):
-            position_bias = i  # bias crescente
-            s, matched = _score(chunk, kws, position_bias)
+        for i in candidates:
+            s = max(0.0, raw.get(i, 0.0) - _position_penalty(i))   # bias crescente, con tetto
             if s >= min_score:
-                scored.append(ScoredChunk(chunk=chunk, score=s, matched_terms=matched))
+                scored.append(ScoredChunk(chunk=self.chunks[i], score=s, matched_terms=matched.get(i, [])))
 
-        scored.sort(key=lambda x: -x.score)
-        top = scored[:top_n]
+        top = heapq.nlargest(top_n, scored, key=lambda x: x.score)
 
         # Ri-ordina i top chunk per posizione nel documento (più naturale per l'LLM)
         top.sort(key=lambda x: x.chunk.char_start)
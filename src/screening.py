@@ -0,0 +1,242 @@
+"""
+BidPilot — Screening knockout-first  v1.0
+=========================================
+Modalità a stadi per lo screening rapido dei bandi: prima le categorie che
+alimentano i HARD_KO, poi — solo se il bando è ancora percorribile — il resto.
+
+  Stadio 1  scadenze, importo, soa, certificazioni, forme_partecipazione
+            → analyze() sul BandoRequisiti parziale
+            → eval_R01 (deadline offerta scaduta), eval_R25 (SOA prevalente),
+              eval_D_certificazioni
+  Stadio 2  metadati + categorie rimanenti (dgue, piattaforma, anac_cig)
+            solo se nessun knockout
+
+Knockout = status KO con severity HARD_KO. I KO rimediabili (FIXABLE, es.
+SOA via avvalimento/RTI) non fermano lo screening: per questo
+forme_partecipazione è nello stadio 1.
+Le regole seguono il gating di evaluate_all: nessun knockout per i sistemi
+di qualificazione, solo R01 per le richieste di preventivo.
+
+Il prezzo è la latenza: due round di chiamate invece di uno. Le chiamate
+evitate sono in ScreeningResult.calls_saved.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+from src.analyzer import AnalysisResult, analyze
+from src.llm_cache import ExtractionCache
+from src.parser import (
+    _CATEGORY_SCHEMA,
+    _DEFAULT_CONTEXT_BUDGET,
+    _DEFAULT_LLM_RETRIES,
+    _DEFAULT_LLM_TIMEOUT,
+    _DEFAULT_MAX_WORKERS,
+    ParsedDocument,
+    _chunk_pdf,
+    _deep_merge,
+    _LLMOptions,
+    _resolve_api_key,
+    _resolve_cache,
+    _run_extraction,
+)
+from src.requirements_engine import eval_D_certificazioni, eval_R01, eval_R25
+from src.retrieval import Chunk, Retriever, chunk_full_text
+from src.schemas import CompanyProfile, ReqStatus, RequirementResult, Severity
+
+logger = logging.getLogger("bidpilot.screening")
+
+# Categorie lette dalle regole di knockout (R25 usa anche importo e forme)
+KNOCKOUT_CATEGORIES = ["scadenze", "importo", "soa", "certificazioni", "forme_partecipazione"]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# OUTPUT
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class ScreeningResult:
+    """Esito dello screening: documento (parziale se terminato), knockout, risparmio."""
+    parsed: ParsedDocument
+    analysis: AnalysisResult
+    knockouts: List[RequirementResult]
+    stages: List[List[str]] = field(default_factory=list)   # categorie estratte per stadio
+    pending_categories: List[str] = field(default_factory=list)  # mai estratte (terminazione)
+    calls_saved: int = 0          # chiamate LLM evitate dalla terminazione anticipata
+
+    @property
+    def viable(self) -> bool:
+        return not self.knockouts
+
+    @property
+    def terminated_early(self) -> bool:
+        return len(self.stages) == 1
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# KNOCKOUT
+# ══════════════════════════════════════════════════════════════════════════════
+
+def knockout_results(bando, company: CompanyProfile) -> List[RequirementResult]:
+    """HARD_KO non rimediabili tra R01, R25 e certificazioni (stesso gating di evaluate_all)."""
+    if bando.is_qualification_system:
+        return []
+    results = [eval_R01(bando)]
+    if bando.document_type != "richiesta_preventivo":
+        results.append(eval_R25(bando, company))
+        results.extend(eval_D_certificazioni(bando, company))
+    return [
+        r for r in results
+        if r is not None and r.status == ReqStatus.KO and r.severity == Severity.HARD_KO
+    ]
+
+
+def _avoidable_calls(run_parsed: ParsedDocument, pending: List[str]) -> int:
+    """
+    Chiamate LLM che lo stadio 2 avrebbe fatto: metadati + categorie pendenti,
+    escluse quelle che classificazione o pre-estrazione avrebbero risolto senza LLM.
+    """
+    skipped = set(run_parsed.classification.skipped_categories(pending)) if run_parsed.classification else set()
+    pre = run_parsed.pre_extraction
+    calls = 1
+    for cat in pending:
+        if cat in skipped or (pre is not None and pre.category_fields(cat) is not None):
+            continue
+        calls += 1
+    return calls
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# STADI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _screen(
+    chunks: List[Chunk],
+    retriever: Retriever,
+    company: CompanyProfile,
+    categories: List[str],
+    llm: _LLMOptions,
+    pages_count: int,
+    source_path: str,
+    top_n: int,
+    min_score: float,
+    max_workers: int,
+    context_budget: Optional[int],
+) -> ScreeningResult:
+    first = [c for c in categories if c in KNOCKOUT_CATEGORIES]
+    rest = [c for c in categories if c not in KNOCKOUT_CATEGORIES]
+    options = dict(top_n=top_n, min_score=min_score, max_workers=max_workers, context_budget=context_budget)
+
+    logger.info(f"  Screening stadio 1: {first}...")
+    stage1 = _run_extraction(chunks, retriever, first, llm, extract_meta=False, **options)
+    parsed = ParsedDocument(
+        raw_fields=stage1.raw_fields, chunks=chunks, traces=stage1.traces,
+        pages_count=pages_count, source_path=source_path,
+        pre_extraction=stage1.pre_extraction, classification=stage1.classification,
+    )
+    analysis = analyze(parsed)
+    knockouts = knockout_results(analysis.bando, company)
+    if knockouts:
+        saved = _avoidable_calls(parsed, rest)
+        logger.info(
+            f"  Screening: knockout {[r.req_id for r in knockouts]} — "
+            f"stadio 2 non eseguito, {saved} chiamate LLM risparmiate."
+        )
+        return ScreeningResult(
+            parsed=parsed, analysis=analysis, knockouts=knockouts,
+            stages=[first], pending_categories=rest, calls_saved=saved,
+        )
+
+    logger.info(f"  Screening stadio 2: metadati + {rest}...")
+    stage2 = _run_extraction(chunks, retriever, rest, llm, pre_extraction=stage1.pre_extraction, **options)
+    by_category = {t.category: t for t in stage1.traces + stage2.traces}
+    parsed = ParsedDocument(
+        raw_fields=_deep_merge(stage2.raw_fields, stage1.raw_fields),
+        chunks=chunks,
+        traces=[by_category[c] for c in categories],
+        pages_count=pages_count,
+        source_path=source_path,
+        meta_trace=stage2.meta_trace,
+        pre_extraction=stage1.pre_extraction,
+        classification=stage1.classification,
+    )
+    return ScreeningResult(
+        parsed=parsed, analysis=analyze(parsed), knockouts=[], stages=[first, rest],
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ENTRY POINT
+# ══════════════════════════════════════════════════════════════════════════════
+
+def screen_pdf(
+    path: str,
+    company: CompanyProfile,
+    model: str = "gpt-4o-mini",
+    api_key: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    top_n_per_category: int = 6,
+    min_score: float = 0.1,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT,
+    retries: int = _DEFAULT_LLM_RETRIES,
+    use_cache: bool = True,
+    cache: Optional[ExtractionCache] = None,
+    scorer: str = "log_tf",
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+    pdf_workers: Optional[int] = None,
+) -> ScreeningResult:
+    """
+    Come parse_pdf + analyze, ma a stadi: se lo stadio 1 trova un knockout
+    il documento resta parziale (metadati e categorie rimanenti non estratti).
+    Argomenti come parse_pdf; company = profilo su cui valutare i knockout.
+    """
+    api_key = _resolve_api_key(api_key, model)
+    path = str(Path(path).resolve())
+    logger.info(f"screen_pdf: {path}")
+
+    chunks, pages_count = _chunk_pdf(path, pdf_workers)
+    llm = _LLMOptions(
+        model=model, api_key=api_key, timeout=timeout, retries=retries,
+        cache=_resolve_cache(use_cache, cache),
+    )
+    return _screen(
+        chunks, Retriever(chunks, scorer=scorer), company,
+        categories or list(_CATEGORY_SCHEMA.keys()), llm, pages_count, path,
+        top_n=top_n_per_category, min_score=min_score, max_workers=max_workers,
+        context_budget=context_budget,
+    )
+
+
+def screen_text(
+    text: str,
+    company: CompanyProfile,
+    model: str = "gpt-4o-mini",
+    api_key: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    top_n_per_category: int = 6,
+    min_score: float = 0.1,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = _DEFAULT_LLM_TIMEOUT,
+    retries: int = _DEFAULT_LLM_RETRIES,
+    use_cache: bool = True,
+    cache: Optional[ExtractionCache] = None,
+    scorer: str = "log_tf",
+    context_budget: Optional[int] = _DEFAULT_CONTEXT_BUDGET,
+) -> ScreeningResult:
+    """Variante di screen_pdf su testo già estratto (come parse_text)."""
+    api_key = _resolve_api_key(api_key, model)
+    chunks = chunk_full_text(text)
+    llm = _LLMOptions(
+        model=model, api_key=api_key, timeout=timeout, retries=retries,
+        cache=_resolve_cache(use_cache, cache),
+    )
+    return _screen(
+        chunks, Retriever(chunks, scorer=scorer), company,
+        categories or list(_CATEGORY_SCHEMA.keys()), llm, 0, "<text>",
+        top_n=top_n_per_category, min_score=min_score, max_workers=max_workers,
+        context_budget=context_budget,
+    )
@@ -0,0 +1,226 @@
+"""
+BidPilot — Servizio HTTP  v1.0
+===============================
+Servizio locale senza interfaccia attorno alla pipeline, per integrare
+BidPilot in altri strumenti (gestionali, script, CI documentale):
+
+  python -m src.service --port 8765 --workers 2 --profile config/profilo_azienda.json
+
+Endpoint (JSON):
+  POST   /jobs              corpo application/pdf (i byte del bando) oppure
+                            JSON {"path": "...", "model": "...", "profile": {...}}
+                            → 202 {"id": ..., "status": "queued"}
+  GET    /jobs              ultimi job (?status=queued|running|done|failed|cancelled)
+  GET    /jobs/<id>         stato ed eventi di avanzamento
+  GET    /jobs/<id>/result  BandoCard + DecisionReport + violazioni (409 se non concluso)
+  DELETE /jobs/<id>         annulla (subito se in coda, al prossimo stadio se in corso)
+  GET    /health            stato del servizio e job per stato
+
+I job vivono nella coda persistente di jobs.py: un riavvio riprende quelli
+interrotti. I PDF caricati sono salvati in <cache_dir>/jobs/uploads/.
+La chiave API si legge da --api-key o dalle variabili d'ambiente e non
+viene mai salvata nella coda. Il server ascolta su 127.0.0.1 per default:
+non ha autenticazione, non esporlo su reti condivise.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import uuid
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from src.jobs import DONE, JobQueue, JobStore, analysis_runner
+from src.llm_cache import cache_dir
+
+logger = logging.getLogger("bidpilot.service")
+
+_MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+_JOB_PATH = re.compile(r"^/jobs/([0-9a-f]{32})(/result)?$")
+
+
+def default_upload_dir() -> str:
+    return os.path.join(cache_dir(), "jobs", "uploads")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# HANDLER
+# ══════════════════════════════════════════════════════════════════════════════
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "BidPilotServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str) -> None:
+        self._send(status, {"error": message})
+
+    def _job_route(self, path: str) -> Tuple[Optional[str], bool]:
+        m = _JOB_PATH.match(path)
+        return (m.group(1), bool(m.group(2))) if m else (None, False)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        store = self.server.queue.store
+        if url.path == "/health":
+            self._send(HTTPStatus.OK, {"status": "ok", "workers": self.server.queue.workers, "jobs": store.counts()})
+            return
+        if url.path == "/jobs":
+            status = parse_qs(url.query).get("status", [None])[0]
+            self._send(HTTPStatus.OK, {"jobs": [j.status_dict() for j in store.list(status=status)]})
+            return
+
+        job_id, wants_result = self._job_route(url.path)
+        job = store.get(job_id) if job_id else None
+        if job is None:
+            self._error(HTTPStatus.NOT_FOUND, "job non trovato")
+        elif not wants_result:
+            self._send(HTTPStatus.OK, job.status_dict())
+        elif job.status != DONE:
+            self._send(HTTPStatus.CONFLICT, {"error": f"job {job.status}", **job.status_dict()})
+        else:
+            self._send(HTTPStatus.OK, {"id": job.id, **job.result})
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != "/jobs":
+            self._error(HTTPStatus.NOT_FOUND, "endpoint non trovato")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._error(HTTPStatus.BAD_REQUEST, "corpo vuoto: inviare un PDF o un JSON con 'path'")
+            return
+        if length > _MAX_UPLOAD_BYTES:
+            self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "PDF troppo grande")
+            return
+        body = self.rfile.read(length)
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+
+        if content_type == "application/json":
+            try:
+                request = json.loads(body)
+                path = request["path"]
+            except (ValueError, KeyError, TypeError):
+                self._error(HTTPStatus.BAD_REQUEST, "JSON non valido: serve almeno {'path': ...}")
+                return
+            if not os.path.isfile(path):
+                self._error(HTTPStatus.BAD_REQUEST, f"file non trovato: {path}")
+                return
+            options = {k: request[k] for k in ("model", "profile", "decision_report") if k in request}
+            job = self.server.queue.submit(os.path.abspath(path), options)
+        else:
+            job = self.server.submit_upload(body)
+        self._send(HTTPStatus.ACCEPTED, {"id": job.id, "status": job.status})
+
+    def do_DELETE(self) -> None:
+        job_id, wants_result = self._job_route(urlparse(self.path).path)
+        status = self.server.queue.cancel(job_id) if job_id and not wants_result else None
+        if status is None:
+            self._error(HTTPStatus.NOT_FOUND, "job non trovato")
+        else:
+            self._send(HTTPStatus.ACCEPTED, {"id": job_id, "status": status})
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SERVER
+# ══════════════════════════════════════════════════════════════════════════════
+
+class BidPilotServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer + JobQueue: le richieste rispondono subito, l'analisi è nei worker."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], queue: JobQueue, upload_dir: Optional[str] = None):
+        super().__init__(address, _Handler)
+        self.queue = queue
+        self.upload_dir = upload_dir or default_upload_dir()
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+    def submit_upload(self, pdf_bytes: bytes):
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.upload_dir, f"{job_id}.pdf")
+        with open(path, "wb") as f:
+            f.write(pdf_bytes)
+        return self.queue.submit(path, job_id=job_id)
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self.queue.stop(timeout=5)
+
+
+def create_server(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    profile_dict: Optional[dict] = None,
+    api_key: Optional[str] = None,
+    model: str = "gpt-4o-mini",
+    workers: int = 2,
+    use_cache: bool = True,
+    jobs_db: Optional[str] = None,
+    upload_dir: Optional[str] = None,
+) -> BidPilotServer:
+    """Server pronto (worker già avviati); serve_forever() per rispondere. port=0: porta libera."""
+    runner = analysis_runner(profile_dict or {}, api_key=api_key, model=model, use_cache=use_cache)
+    queue = JobQueue(JobStore(jobs_db), runner, workers=workers).start()
+    return BidPilotServer((host, port), queue, upload_dir=upload_dir)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv: Optional[list] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.service", description="Servizio HTTP locale di BidPilot.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=2, help="analisi eseguite in parallelo")
+    ap.add_argument("--profile", default="config/profilo_azienda.json", help="profilo aziendale JSON di default")
+    ap.add_argument("--model", default="gpt-4o-mini")
+    ap.add_argument("--api-key", default=None, help="default: OPENAI_API_KEY / ANTHROPIC_API_KEY")
+    ap.add_argument("--jobs-db", default=None, help="default: BIDPILOT_JOBS_DB o <cache_dir>/jobs.sqlite")
+    ap.add_argument("--no-cache", action="store_true", help="bypass della cache documenti")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+    logging.getLogger("bidpilot.service").setLevel(logging.INFO)
+    logging.getLogger("bidpilot.jobs").setLevel(logging.INFO)
+
+    with open(args.profile, encoding="utf-8") as f:
+        profile_dict = json.load(f)
+    server = create_server(
+        args.host, args.port, profile_dict, api_key=args.api_key, model=args.model,
+        workers=args.workers, use_cache=not args.no_cache, jobs_db=args.jobs_db,
+    )
+    host, port = server.server_address[:2]
+    logger.info(f"BidPilot service su http://{host}:{port} ({args.workers} worker)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.queue.stop(timeout=5)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+BidPilot — Tracing  v1.0
+=========================
+Span di temporizzazione leggeri per vedere dove vanno i 30–90 s di un bando:
+analyze_pdf → parse_pdf → _extract_pages / chunk_by_page →
+Retriever.retrieve → _call_llm → analyze → evaluate_all → build_bando_card.
+
+API:
+  with span("parse_pdf", path=path): ...     context manager
+  @traced("analyze")                          decoratore
+
+Gli span si annidano per thread (contextvars): ogni span conosce il padre.
+Le chiamate LLM nei thread del pool partono come radici sulla corsia del
+proprio thread; nel formato Chrome si leggono comunque in parallelo.
+
+Configurazione via env (letta al primo uso):
+  BIDPILOT_TRACE   file di output; disattivato se assente
+                   *.json  → formato Chrome trace (chrome://tracing, Perfetto)
+                   altro   → JSON lines, uno span per riga
+  BIDPILOT_TRACE_MAX_SPANS  span tenuti in memoria (Chrome e modalità in
+                   memoria; default 50000): oltre, i più vecchi vengono scartati
+
+Da spento span() restituisce un context manager condiviso che non fa nulla
+e @traced chiama direttamente la funzione: costo di un controllo su None.
+"""
+from __future__ import annotations
+
+import atexit
+import collections
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger("bidpilot.tracing")
+
+_ENV_VAR = "BIDPILOT_TRACE"
+_MAX_SPANS_ENV_VAR = "BIDPILOT_TRACE_MAX_SPANS"
+_DEFAULT_MAX_SPANS = 50_000
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SPAN
+# ══════════════════════════════════════════════════════════════════════════════
+
+@dataclass
+class SpanRecord:
+    """Uno span concluso (tempi in microsecondi dall'avvio del tracer)."""
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    start_us: float
+    duration_us: float
+    thread_id: int
+    thread_name: str
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_us": round(self.start_us, 1),
+            "duration_ms": round(self.duration_us / 1000, 3),
+            "thread": self.thread_name,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+    def to_chrome_event(self, pid: int) -> dict:
+        """Evento "complete" (ph=X) del formato Chrome trace."""
+        args = dict(self.attrs)
+        if self.error:
+            args["error"] = self.error
+        return {
+            "name": self.name, "ph": "X", "ts": round(self.start_us, 1),
+            "dur": round(self.duration_us, 1), "pid": pid, "tid": self.thread_id, "args": args,
+        }
+
+
+_current: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("bidpilot_span", default=None)
+
+
+class _Span:
+    """Span attivo; set() aggiunge attributi noti solo a metà (es. token ricevuti)."""
+
+    __slots__ = ("_tracer", "name", "attrs", "span_id", "parent_id", "_start", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]):
+        self._tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "_Span":
+        self.span_id = self._tracer.next_id()
+        self.parent_id = _current.get()
+        self._token = _current.set(self.span_id)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        end = time.perf_counter()
+        _current.reset(self._token)
+        thread = threading.current_thread()
+        self._tracer.record(SpanRecord(
+            name=self.name, span_id=self.span_id, parent_id=self.parent_id,
+            start_us=(self._start - self._tracer.origin) * 1e6,
+            duration_us=(end - self._start) * 1e6,
+            thread_id=thread.ident or 0, thread_name=thread.name,
+            attrs=self.attrs, error=f"{exc_type.__name__}: {exc}" if exc_type else None,
+        ))
+        return False
+
+
+class _NoopSpan:
+    """Span da spento: condiviso, nessuna allocazione né misura."""
+
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TRACER + EXPORT
+# ══════════════════════════════════════════════════════════════════════════════
+
+class Tracer:
+    """
+    Raccoglie gli span conclusi e li esporta su path.
+    JSON lines: una riga per span, scritta alla chiusura; lo span non resta
+    in memoria.
+    Chrome: il file è un unico JSON, scritto da flush() (all'uscita o alla
+    riconfigurazione); fino ad allora gli span restano in spans.
+    path=None: solo in memoria (spans), per test e benchmark.
+
+    spans tiene al più max_spans span (i più vecchi vengono scartati e
+    contati in dropped): un servizio che gira a lungo non cresce senza limite.
+    """
+
+    def __init__(self, path: Optional[str] = None, fmt: Optional[str] = None, max_spans: Optional[int] = None):
+        self.path = path
+        self.fmt = fmt or ("chrome" if path and path.endswith(".json") else "jsonl")
+        self.origin = time.perf_counter()
+        if max_spans is None:
+            max_spans = int(os.environ.get(_MAX_SPANS_ENV_VAR, _DEFAULT_MAX_SPANS))
+        self.spans: Deque[SpanRecord] = collections.deque(maxlen=max_spans)
+        self.dropped = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        if path:
+            parent = os.path.dirname(path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def record(self, record: SpanRecord) -> None:
+        with self._lock:
+            if self.path and self.fmt == "jsonl":
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(record.to_dict(), ensure_ascii=False, default=str) + "\n")
+                except OSError as exc:
+                    logger.warning(f"Tracing: scrittura di {self.path} fallita — {exc}")
+                return
+            if len(self.spans) == self.spans.maxlen:
+                if not self.dropped:
+                    logger.warning(f"Tracing: superati {self.spans.maxlen} span, scarto i più vecchi.")
+                self.dropped += 1
+            self.spans.append(record)
+
+    def flush(self) -> None:
+        if self.path and self.fmt == "chrome":
+            with self._lock:
+                try:
+                    self._write_chrome()
+                except OSError as exc:
+                    logger.warning(f"Tracing: scrittura di {self.path} fallita — {exc}")
+
+    def _write_chrome(self) -> None:
+        pid = os.getpid()
+        events = [r.to_chrome_event(pid) for r in self.spans]
+        trace = {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": self.dropped}}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False, default=str)
+        os.replace(tmp, self.path)
+
+
+_tracer: Optional[Tracer] = None
+_configured = False
+_config_lock = threading.Lock()
+
+
+def _from_env() -> None:
+    global _tracer, _configured
+    with _config_lock:
+        if not _configured:
+            path = os.environ.get(_ENV_VAR)
+            _tracer = Tracer(path) if path else None
+            _configured = True
+            if _tracer is not None:
+                atexit.register(_tracer.flush)
+                logger.info(f"Tracing attivo → {path} ({_tracer.fmt})")
+
+
+def configure_tracing(path: Optional[str] = None, fmt: Optional[str] = None, enabled: bool = True) -> Optional[Tracer]:
+    """
+    Attiva il tracing (sostituisce la configurazione da env).
+    path=None con enabled=True: span solo in memoria (get_tracer().spans).
+    enabled=False: disattiva. Restituisce il tracer attivo.
+    """
+    global _tracer, _configured
+    with _config_lock:
+        if _tracer is not None:
+            _tracer.flush()
+        _tracer = Tracer(path, fmt) if enabled else None
+        _configured = True
+    return _tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    if not _configured:
+        _from_env()
+    return _tracer
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# API
+# ══════════════════════════════════════════════════════════════════════════════
+
+def span(name: str, **attrs: Any):
+    """Context manager che misura il blocco; attrs finiscono nell'export."""
+    tracer = _tracer if _configured else get_tracer()
+    if tracer is None:
+        return _NOOP
+    return _Span(tracer, name, attrs)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decoratore: uno span per chiamata (default: nome qualificato della funzione)."""
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer if _configured else get_tracer()
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with _Span(tracer, span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator